@@ -0,0 +1,89 @@
+import numpy as np
+
+# grouped totals over a RegistryStore, worked out with bincount and ufunc
+# reductions rather than loops over records. Groups are an integer code per
+# record, such as the publisher code; `ids` restricts the records included.
+#
+# The feed only gives distinct recipient and funder counts per file, so for
+# a group these are the largest per-file count: a lower bound on the true
+# number of distinct organisations.
+
+
+class Aggregates(object):
+
+    def __init__(self, store, groups, ngroups, ids=None):
+        self.store = store
+        self.ngroups = ngroups
+        if ids is None:
+            ids = np.arange(store.size)
+        ids = np.asarray(ids, dtype=np.int64)
+        g = groups[ids]
+
+        self.files = np.bincount(g, minlength=ngroups)
+        self.count = np.bincount(
+            g, weights=store.count[ids], minlength=ngroups
+        ).astype(np.int64)
+
+        self.recipients = np.zeros(ngroups, dtype=np.int64)
+        np.maximum.at(self.recipients, g, store.recipients[ids])
+        self.funders = np.zeros(ngroups, dtype=np.int64)
+        np.maximum.at(self.funders, g, store.funders[ids])
+
+        self.min_award_date = self._date_range(np.minimum, store.min_award_date[ids], g)
+        self.max_award_date = self._date_range(np.maximum, store.max_award_date[ids], g)
+
+        # currency totals as a groups x currencies table
+        selected = np.zeros(store.size, dtype=bool)
+        selected[ids] = True
+        entries = selected[store.currency_record]
+        ncurrencies = len(store.currencies)
+        flat = groups[store.currency_record[entries]] * ncurrencies + store.currency_code[entries]
+        size = ngroups * ncurrencies
+        self.currency_total = np.bincount(
+            flat, weights=store.currency_amount[entries], minlength=size
+        ).reshape(ngroups, ncurrencies)
+        self.currency_present = (np.bincount(flat, minlength=size) > 0).reshape(ngroups, ncurrencies)
+
+    def _date_range(self, ufunc, dates, g):
+        # NaT is the smallest int64, so leave missing dates out and mark
+        # groups without any dates as NaT afterwards
+        values = dates.astype(np.int64)
+        valid = ~np.isnat(dates)
+        start = np.iinfo(np.int64).max if ufunc is np.minimum else np.iinfo(np.int64).min
+        result = np.full(self.ngroups, start, dtype=np.int64)
+        ufunc.at(result, g[valid], values[valid])
+        result = result.astype(dates.dtype)
+        result[np.bincount(g[valid], minlength=self.ngroups) == 0] = np.datetime64('NaT')
+        return result
+
+    def currencies(self, group=0):
+        # {currency: total_amount} for a group, in currency table order
+        return {
+            self.store.currencies[c]: self.currency_total[group, c]
+            for c in np.flatnonzero(self.currency_present[group])
+        }
+
+    def as_datagetter_aggregates(self, group=0):
+        # the same shape as a record's datagetter_aggregates
+        return {
+            "count": int(self.count[group]),
+            "currencies": {
+                c: {"total_amount": as_number(amount)}
+                for c, amount in self.currencies(group).items()
+            },
+        }
+
+
+def as_number(value):
+    # sums are worked out as floats; give whole amounts back as ints, as
+    # they appear in the feed
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def publisher_aggregates(store, ids=None):
+    return Aggregates(store, store.publisher, len(store.publishers), ids=ids)
+
+
+def totals(store, ids=None):
+    return Aggregates(store, np.zeros(store.size, dtype=np.int64), 1, ids=ids)
@@ -0,0 +1,369 @@
+import base64
+import bisect
+import csv
+import hashlib
+import io
+import json
+import urllib.parse
+
+import flask
+import numpy as np
+
+from aggregates import as_number, publisher_aggregates
+from formatting import parse_datetime
+from history import STATS
+from indexes import LIST_FILTERS, filter_key, filter_time, normalise_filters
+from registry import get_changelogs, get_snapshot
+
+# JSON and CSV endpoints for the registry, with the same filters as the
+# dashboard. Lists are paged with an opaque cursor, and every response has
+# a strong ETag worked out from the snapshot and the request alone, so a
+# client revalidating an unchanged page gets a 304 before anything is
+# filtered.
+#   /api/publishers?currency=GBP&currency=USD&search=trust&format=csv
+#   /api/files?fields=Beneficiary+Location:Name&limit=500&cursor=...
+#   /api/history?metric=currencies&publisher=Example+Trust&start=2019-01-01
+#   /api/coverage?fields_all=Beneficiary+Location:Name&fields_none=Recipient+Org:Charity+Number
+
+DEFAULT_LIMIT = 100
+HISTORY_METRICS = STATS + ("currencies", "fields", "licences")
+MAX_LIMIT = 1000
+
+PUBLISHER_COLUMNS = (
+    "name", "prefix", "website", "files", "grants", "recipients", "funders",
+    "min_award_date", "max_award_date", "currencies",
+)
+FILE_COLUMNS = (
+    "identifier", "title", "publisher", "publisher_prefix", "license",
+    "license_name", "modified", "file_type", "grants", "recipients", "funders",
+    "min_award_date", "max_award_date", "currencies", "access_url",
+    "download_url",
+)
+
+
+class APIError(Exception):
+
+    def __init__(self, message, status=400):
+        super(APIError, self).__init__(message)
+        self.message = message
+        self.status = status
+
+
+def get_filters(args):
+    filters = {name: args.getlist(name) for name in LIST_FILTERS}
+    filters["search"] = args.get("search")
+    filters["last_modified"] = args.get("last_modified")
+    return normalise_filters(filters)
+
+
+def get_limit(args):
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise APIError("limit must be a number")
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def get_format(args):
+    # ?format=, or whichever of the two the Accept header prefers. The
+    # format is part of the ETag, and responses chosen by Accept say so in
+    # Vary for caches in between.
+    format_ = args.get("format")
+    if format_ is None:
+        flask.g.api_negotiated = True
+        best = flask.request.accept_mimetypes.best_match(['application/json', 'text/csv'])
+        format_ = 'csv' if best == 'text/csv' else 'json'
+    if format_ not in ('json', 'csv'):
+        raise APIError("format must be json or csv")
+    return format_
+
+
+# a cursor is the position of the last item returned, tied to the snapshot
+# it came from
+def encode_cursor(snapshot, position):
+    value = json.dumps({"s": snapshot.digest[:12], "after": int(position)}).encode('utf8')
+    return base64.urlsafe_b64encode(value).decode('ascii').rstrip('=')
+
+
+def decode_cursor(snapshot, cursor):
+    if not cursor:
+        return -1
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        digest, position = value["s"], int(value["after"])
+    except (ValueError, TypeError, KeyError):
+        raise APIError("cursor is not valid")
+    if digest != snapshot.digest[:12]:
+        raise APIError("the registry has been updated since this cursor was given; "
+                       "start again from the first page", status=409)
+    return position
+
+
+def format_date(value):
+    return None if np.isnat(value) else str(value.astype('datetime64[D]'))
+
+
+def format_currencies(currencies):
+    return "; ".join("{} {}".format(c, amount) for c, amount in currencies.items())
+
+
+def etag_for(snapshot, *parts):
+    key = json.dumps([snapshot.digest] + list(parts), sort_keys=True)
+    return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+
+def not_modified(etag):
+    if etag in flask.request.if_none_match:
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def next_url(cursor):
+    args = flask.request.args.to_dict(flat=False)
+    args["cursor"] = [cursor]
+    return flask.request.base_url + '?' + urllib.parse.urlencode(args, doseq=True)
+
+
+def respond(kind, columns, items, total, cursor, etag, format_, filters):
+    if format_ == 'csv':
+        def rows():
+            out = io.StringIO()
+            writer = csv.DictWriter(out, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            for row in items:
+                writer.writerow(row)
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+            yield out.getvalue()
+        response = flask.Response(rows(), mimetype='text/csv')
+    else:
+        response = flask.Response(json.dumps({
+            "filters": filters,
+            "total": total,
+            kind: list(items),
+            "next": next_url(cursor) if cursor else None,
+        }), mimetype='application/json')
+    if cursor:
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url(cursor))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def get_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return parse_datetime(value)
+    except (ValueError, OverflowError):
+        raise APIError("{} must be a date".format(name))
+
+
+def create_api(reg_url, max_age=None, caches=None, history=None):
+    api = flask.Blueprint('api', __name__, url_prefix='/api')
+
+    @api.errorhandler(APIError)
+    def api_error(e):
+        return flask.jsonify({"error": e.message}), e.status
+
+    @api.after_request
+    def vary(response):
+        if flask.g.pop('api_negotiated', False):
+            response.vary.add('Accept')
+        return response
+
+    def request_context():
+        args = flask.request.args
+        snapshot = get_snapshot(reg_url, max_age=max_age)
+        filters = get_filters(args)
+        # results move as time passes; the time is fixed to the minute so
+        # the ETag can say which minute they were worked out for
+        now = filter_time(filters)
+        limit = get_limit(args)
+        format_ = get_format(args)
+        cursor = args.get("cursor")
+        etag = etag_for(
+            snapshot, flask.request.path, filter_key(filters),
+            now.isoformat() if now else None, cursor, limit, format_,
+        )
+        return snapshot, filters, now, limit, format_, cursor, etag
+
+    @api.route('/publishers')
+    def publishers():
+        snapshot, filters, now, limit, format_, cursor, etag = request_context()
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        after = decode_cursor(snapshot, cursor)
+        store = snapshot.store
+        ids = snapshot.index.filter(filters, now=now)
+        groups = snapshot.index.group_by_publisher(ids)
+        # publishers are in order of their first matching file
+        start = bisect.bisect_right([g[0] for _, g in groups], after)
+        page = groups[start:start + limit]
+        next_cursor = None
+        if start + limit < len(groups):
+            next_cursor = encode_cursor(snapshot, page[-1][1][0])
+        aggregates = publisher_aggregates(store, ids)
+
+        def items():
+            for name, group in page:
+                p = store.publisher[group[0]]
+                publisher = snapshot.registry[group[0]].get("publisher", {})
+                currencies = {c: as_number(a) for c, a in aggregates.currencies(p).items()}
+                yield {
+                    "name": name,
+                    "prefix": publisher.get("prefix"),
+                    "website": publisher.get("website"),
+                    "logo": publisher.get("logo"),
+                    "files": int(aggregates.files[p]),
+                    "grants": int(aggregates.count[p]),
+                    "recipients": int(aggregates.recipients[p]),
+                    "funders": int(aggregates.funders[p]),
+                    "min_award_date": format_date(aggregates.min_award_date[p]),
+                    "max_award_date": format_date(aggregates.max_award_date[p]),
+                    "currencies": format_currencies(currencies) if format_ == 'csv' else currencies,
+                }
+
+        return respond('publishers', PUBLISHER_COLUMNS, items(), len(groups),
+                       next_cursor, etag, format_, filters)
+
+    @api.route('/files')
+    def files():
+        snapshot, filters, now, limit, format_, cursor, etag = request_context()
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        after = decode_cursor(snapshot, cursor)
+        ids = snapshot.index.filter(filters, now=now)
+        start = np.searchsorted(ids, after, side='right')
+        page = ids[start:start + limit]
+        next_cursor = None
+        if start + limit < len(ids):
+            next_cursor = encode_cursor(snapshot, page[-1])
+
+        def items():
+            for i in page:
+                r = snapshot.registry[i]
+                if format_ == 'csv':
+                    yield file_row(r)
+                else:
+                    yield r
+
+        return respond('files', FILE_COLUMNS, items(), len(ids),
+                       next_cursor, etag, format_, filters)
+
+    @api.route('/changelog')
+    def changelog():
+        return flask.jsonify([c.as_dict() for c in get_changelogs(reg_url)])
+
+    # the share of each publisher's matching files with each field, for the
+    # standard fields or the ones given as column
+    @api.route('/coverage')
+    def coverage():
+        snapshot, filters, now, limit, format_, cursor, etag = request_context()
+        columns = flask.request.args.getlist("column") or None
+        etag = etag_for(snapshot, etag, columns)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        start = decode_cursor(snapshot, cursor) + 1
+        ids = snapshot.index.filter(filters, now=now)
+        # publishers are in order of their files, most first
+        codes, files, fields, shares = snapshot.index.coverage(ids, columns)
+        next_cursor = None
+        if start + limit < len(codes):
+            next_cursor = encode_cursor(snapshot, start + limit - 1)
+
+        def items():
+            for p, f, row in zip(codes[start:start + limit], files[start:start + limit],
+                                 shares[start:start + limit]):
+                item = {"name": snapshot.store.publishers[p], "files": int(f)}
+                coverage = {field: round(float(v), 1) for field, v in zip(fields, row)}
+                if format_ == 'csv':
+                    item.update(coverage)
+                else:
+                    item["coverage"] = coverage
+                yield item
+
+        return respond('publishers', ("name", "files") + tuple(fields), items(), len(codes),
+                       next_cursor, etag, format_, filters)
+
+    # a statistic over time, for the registry or one publisher. Tables
+    # (currencies, fields and licences) give a series for each entry.
+    @api.route('/history')
+    def history_series():
+        if history is None:
+            raise APIError("no history is kept", status=404)
+        args = flask.request.args
+        metric = args.get("metric", "grants")
+        if metric not in HISTORY_METRICS:
+            raise APIError("metric must be one of {}".format(", ".join(HISTORY_METRICS)))
+        publisher = args.get("publisher") or None
+        start, end = get_date(args, "start"), get_date(args, "end")
+
+        index = history.index()
+        etag = hashlib.sha1(json.dumps([
+            index.size, float(index.time[-1]) if index.size else None, flask.request.full_path,
+        ]).encode('utf8')).hexdigest()
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        points = index.points(start, end)
+        table = "stats" if metric in STATS else metric
+        names, values = index.values(table, publisher, points)
+        columns = [list(names).index(metric)] if metric in STATS else range(len(names))
+        response = flask.jsonify({
+            "metric": metric,
+            "publisher": publisher,
+            "times": [t.isoformat() for t in index.times(points)],
+            "series": {
+                names[c]: [None if np.isnan(v) else as_number(v) for v in values[:, c]]
+                for c in columns
+            },
+        })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    # size, hit ratio and evictions for each of the app's caches
+    @api.route('/caches')
+    def cache_stats():
+        return flask.jsonify({name: c.stats() for name, c in (caches or {}).items()})
+
+    return api
+
+
+def file_row(r):
+    # a registry entry flattened to the CSV columns
+    agg = r.get("datagetter_aggregates", {})
+    distribution = (r.get("distribution") or [{}])[0]
+    publisher = r.get("publisher", {})
+    return {
+        "identifier": r.get("identifier"),
+        "title": r.get("title"),
+        "publisher": publisher.get("name"),
+        "publisher_prefix": publisher.get("prefix"),
+        "license": r.get("license"),
+        "license_name": r.get("license_name"),
+        "modified": r.get("modified"),
+        "file_type": r.get("datagetter_metadata", {}).get("file_type"),
+        "grants": agg.get("count"),
+        "recipients": agg.get("distinct_recipient_org_identifier_count"),
+        "funders": agg.get("distinct_funding_org_identifier_count"),
+        "min_award_date": agg.get("min_award_date"),
+        "max_award_date": agg.get("max_award_date"),
+        "currencies": format_currencies({
+            c: v.get("total_amount") for c, v in agg.get("currencies", {}).items()
+        }),
+        "access_url": distribution.get("accessURL"),
+        "download_url": distribution.get("downloadURL"),
+    }
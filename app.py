@@ -1,34 +1,65 @@
+import gc
 import hashlib
 import os
+import time
 import json
 import io
 import datetime
-import dateutil.parser
 
+import flask
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
 
-import babel.numbers
 import humanize
-import requests_cache
+import numpy as np
+import plotly
 
-from utils import get_registry_by_publisher, get_registry, pluralize, format_currency, message_box
+from utils import get_ids_by_publisher, message_box, get_page_args, paginate, page_url, MAX_PAGE_SIZE
+from utils import filters_tag, get_page_filters
+import formatting
+from formatting import pluralize, format_currency, currency_name, parse_datetime
+from indexes import filter_key, filter_time, normalise_filters
+from registry import RegistryRefresher, get_snapshot, current_snapshot, get_client, set_client, on_snapshot
+from registry import timings as registry_timings
+from fetch import FeedClient, make_cache
+import instrumentation
+from instrumentation import traced, traced_dash_callback, note, stage
+from render_cache import RenderCache
+from prerender import PrerenderedPayloads
+from aggregates import totals
+from api import create_api
+from linkcheck import LinkCache, LinkChecker
+from history import HistoryStore, STATS
 
 
 # THREESIXTY_STATUS_JSON = 'https://storage.googleapis.com/datagetter-360giving-output/branch/master/status.json'
-THREESIXTY_STATUS_JSON = 'https://storage.googleapis.com/datagetter-360giving-output/branch/11-coverage/coverage.json'
+THREESIXTY_STATUS_JSON = os.environ.get(
+    'REGISTRY_URL',
+    'https://storage.googleapis.com/datagetter-360giving-output/branch/11-coverage/coverage.json')
 THREESIXTY_STATUS_LOCATION = 'data/status.json'
+THREESIXTY_SNAPSHOT_LOCATION = 'data/registry.snapshot'
+LINK_CHECK_LOCATION = 'data/links.json'
+HISTORY_LOCATION = 'data/history'
 FILE_TYPES = {
     "xlsx": ("Excel", "Microsoft Excel"),
     "xls": ("Excel", "Microsoft Excel (pre 2007)"),
     "csv": ("CSV", "Comma Separated Values"),
     "json": ("JSON", "JSON is a structured file format"),
 }
+PAGE_SIZE = 20 # publishers per page of results
+# a publisher's file rows are only rendered when its card is opened. Dash
+# can't match callbacks to components made on the fly, so each card on the
+# page has a numbered slot with a callback of its own.
+DETAIL_SLOTS = MAX_PAGE_SIZE
+# filter in the browser and only ask the server for the page of results
+CLIENT_FILTERING = bool(os.environ.get('CLIENT_FILTERING'))
+# set by gunicorn.conf.py: the app is imported once in the gunicorn master
+# and warmed up there, and the workers are forked from it
+PRELOAD = bool(os.environ.get('PRELOAD'))
 
 app = dash.Dash(__name__)
-# app.config.suppress_callback_exceptions = True
 
 app.css.append_css({
     "external_url": "https://unpkg.com/tachyons@4.10.0/css/tachyons.min.css"
@@ -38,11 +69,123 @@ app.css.append_css({
 })
 
 cache_expiry = 60*60 # one hour in seconds
-requests_cache.install_cache(
-    backend='sqlite',
-    expire_after=cache_expiry,
-    allowable_methods=('GET', 'HEAD',),
+# the registry feed is fetched with its own pooled client. The snapshot
+# already keeps the ETag to revalidate with; REGISTRY_CACHE can add a cache
+# ("memory", a directory or a redis:// url) that outlives the process
+set_client(FeedClient(cache=make_cache(os.environ.get('REGISTRY_CACHE'))))
+
+# revalidate the registry in the background well before it expires, falling
+# back to the last copy saved to disk if the bucket can't be reached. Under
+# gunicorn one worker fetches the registry and the others map its snapshot.
+registry_refresher = RegistryRefresher(
+    THREESIXTY_STATUS_JSON,
+    interval=cache_expiry / 2,
+    fallback_location=THREESIXTY_STATUS_LOCATION,
+    shared_location=THREESIXTY_SNAPSHOT_LOCATION,
+)
+
+# each new registry is summarised into the history by whichever worker
+# fetched it, and every worker loads what's new for the graphs. This is
+# registered before the refresher starts so the first registry is kept.
+history_store = HistoryStore(os.environ.get('HISTORY_LOCATION', HISTORY_LOCATION))
+
+@on_snapshot
+def record_history(reg_url, snapshot, previous):
+    if reg_url != THREESIXTY_STATUS_JSON:
+        return
+    try:
+        if registry_refresher.is_leader:
+            history_store.append(snapshot)
+        history_store.index()
+    except Exception:
+        app.server.logger.exception('Could not record the registry history')
+
+# the results of checking each file's download link, which replace what the
+# datagetter found. LINK_CHECK_INTERVAL=<seconds> checks them in the
+# background, in the worker that fetches the registry.
+link_cache = LinkCache(os.environ.get('LINK_CHECK_LOCATION', LINK_CHECK_LOCATION))
+link_checker = None
+if os.environ.get('LINK_CHECK_INTERVAL'):
+    link_checker = LinkChecker(
+        link_cache,
+        lambda: get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry),
+        interval=float(os.environ['LINK_CHECK_INTERVAL']),
+        should_check=lambda: registry_refresher.is_leader,
+        per_host=int(os.environ.get('LINK_CHECK_PER_HOST', 4)),
+    )
+
+render_cache = RenderCache(maxsize=4096)
+# the ids matching recent filters, and the JSON sent back for recent
+# requests for the results. Both belong to one snapshot and are bounded by
+# size as well as count; FILTER_CACHE_BYTES and PAYLOAD_CACHE_BYTES set the
+# limits. Payloads expire after a few minutes as the file rows say how long
+# ago each file was modified.
+filter_cache = RenderCache(
+    maxsize=256,
+    maxbytes=int(os.environ.get('FILTER_CACHE_BYTES', 64 * 1024 * 1024)),
+    sizeof=lambda ids: ids.nbytes,
+    ttl=cache_expiry,
+)
+payload_cache = RenderCache(
+    maxsize=512,
+    maxbytes=int(os.environ.get('PAYLOAD_CACHE_BYTES', 128 * 1024 * 1024)),
+    sizeof=len,
+    ttl=5 * 60,
 )
+# file rows, and the opened cards made of them, say how long ago each file
+# was modified too, so they expire as often as the payloads
+ROW_TTL = payload_cache.ttl
+
+# a new registry only invalidates what was rendered from records that
+# changed; everything else is still cached under the same content hashes
+@on_snapshot
+def invalidate_render_cache(reg_url, snapshot, previous):
+    if reg_url != THREESIXTY_STATUS_JSON:
+        return
+    if snapshot.changelog is None:
+        render_cache.clear()
+        return
+    identifiers = snapshot.changelog.identifiers
+    publishers = snapshot.changelog.publishers
+    render_cache.discard(lambda key: (
+        key[0] == 'options'
+        or (key[0] == 'file' and key[1] in identifiers)
+        or (key[0] == 'publisher' and key[1] in publishers)
+    ))
+
+# /api/publishers, /api/files and /api/changelog, for integrations that
+# need the filtered registry without rendering the dashboard,
+# /api/history for how it has changed, and /api/caches with the state of
+# the caches below
+caches = {"render": render_cache, "filter": filter_cache, "payload": payload_cache}
+app.server.register_blueprint(create_api(
+    THREESIXTY_STATUS_JSON, max_age=cache_expiry, caches=caches, history=history_store))
+
+# time every request and its stages for /metrics. SERVER_TIMING also sends
+# each request's stages back in a Server-Timing header, and
+# PROFILE_SLOW_REQUESTS=<seconds> writes folded stacks for requests slower
+# than that to PROFILE_DIR, for flame graphs.
+profiler = None
+if os.environ.get('PROFILE_SLOW_REQUESTS'):
+    profiler = instrumentation.SlowRequestProfiler(
+        float(os.environ['PROFILE_SLOW_REQUESTS']),
+        os.environ.get('PROFILE_DIR', 'data/profiles'),
+    )
+instrumentation.instrument(
+    app.server, app.config.routes_pathname_prefix,
+    server_timing_header=bool(os.environ.get('SERVER_TIMING')),
+    profiler=profiler,
+)
+
+@app.server.route('/metrics')
+def metrics():
+    snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+    return flask.Response(instrumentation.metrics_text(
+        caches=caches,
+        snapshot=snapshot,
+        fetch_timings=get_client().timings,
+        lock_timings=registry_timings,
+    ), mimetype='text/plain; version=0.0.4')
 
 app.title = '360Giving Insights'
 
@@ -160,161 +303,639 @@ def layout_wrapper(contents):
         ]),
     ])
 
-app.layout = layout_wrapper(html.Div(id="status-container", className='', children=[
-    html.Div(className="fl w-25-l w-100 pa2-l", children=[
-        message_box(title="Filter data", contents=[
-            html.Form(className='', children=[
-                html.Div(className='cf mv3', children=[
-                    html.Div(className='', children=[
-                        dcc.Input(id='status-search', placeholder='Search',
-                                  type='text', className='w-100 pa2'),
-                        html.I(className='search icon'),
+# the dropdown options only change with the registry, so they are worked
+# out once per snapshot and sent with the page rather than by a callback
+def get_options(snapshot):
+    return render_cache.get(('options', snapshot.digest), lambda: registry_options(snapshot.store))
+
+def registry_options(store):
+    return {
+        "licence": [{
+            "label": v,
+            "value": k
+        } for k, v in store.licence_names.items()],
+        "fields": [{
+            "label": f,
+            "value": f
+        } for f in sorted(store.standard_fields)],
+        "currency": [{
+            "label": "{} [{}]".format(currency_name(c), c),
+            "value": c
+        } for c in store.currencies],
+        "filetype": [{
+            "label": "{} ({})".format(v[0], v[1]),
+            "value": k
+        } for k, v in (
+            (f, FILE_TYPES.get(f, (f, "Unknown"))) for f in store.filetypes
+        )],
+        "publisher": [{
+            "label": p,
+            "value": p
+        } for p in sorted(p for p in store.publishers if p)],
+    }
+
+def serve_layout():
+    # dash also builds the layout when it is assigned, when callbacks are
+    # registered and when it sets itself up in a process's first request,
+    # where waiting for the registry isn't wanted and the options aren't
+    # used. Requests for the layout itself get the prerendered one.
+    if not flask.has_request_context():
+        # the layout dash checks the callbacks against, with every slot
+        return status_layout(
+            {"licence": [], "fields": [], "currency": [], "filetype": [], "publisher": []},
+            detail_slots())
+    snapshot = current_snapshot(THREESIXTY_STATUS_JSON)
+    if snapshot is None:
+        return status_layout({"licence": [], "fields": [], "currency": [], "filetype": [], "publisher": []})
+    return status_layout(get_options(snapshot))
+
+def status_layout(options, slots=()):
+    return layout_wrapper(html.Div(id="status-container", className='', children=[
+        html.Div(className="fl w-25-l w-100 pa2-l", children=[
+            message_box(title="Filter data", contents=[
+                html.Form(className='', children=[
+                    html.Div(className='cf mv3', children=[
+                        html.Div(className='', children=[
+                            dcc.Input(id='status-search', placeholder='Search',
+                                      type='text', className='w-100 pa2'),
+                            html.I(className='search icon'),
+                        ]),
                     ]),
-                ]),
-                html.Div(className='cf mv3', children=[
-                    html.Label('Licence'),
-                    dcc.Dropdown(id='status-licence', multi=True, options=[]),
-                ]),
-                html.Div(className='cf mv3', children=[
-                    html.Label('Currency'),
-                    dcc.Dropdown(id='status-currency', multi=True, options=[]),
-                ]),
-                html.Div(className='cf mv3', children=[
-                    html.Label('File type'),
-                    dcc.Dropdown(id='status-file-type', multi=True, options=[]),
-                ]),
-                html.Div(className='cf mv3', children=[
-                    html.Label('Last updated'),
-                    dcc.Dropdown(id='status-last-modified', options=[
-                        {'label': 'All publishers', 'value': '__all'},
-                        {'label': 'In the last month', 'value': 'lastmonth'},
-                        {'label': 'In the last 6 months', 'value': '6month'},
-                        {'label': 'In the last year', 'value': '12month'},
+                    html.Div(className='cf mv3', children=[
+                        html.Label('Licence'),
+                        dcc.Dropdown(id='status-licence', multi=True, options=options['licence']),
+                    ]),
+                    html.Div(className='cf mv3', children=[
+                        html.Label('Currency'),
+                        dcc.Dropdown(id='status-currency', multi=True, options=options['currency']),
+                    ]),
+                    html.Div(className='cf mv3', children=[
+                        html.Label('File type'),
+                        dcc.Dropdown(id='status-file-type', multi=True, options=options['filetype']),
+                    ]),
+                    html.Div(className='cf mv3', children=[
+                        html.Label('Last updated'),
+                        dcc.Dropdown(id='status-last-modified', options=[
+                            {'label': 'All publishers', 'value': '__all'},
+                            {'label': 'In the last month', 'value': 'lastmonth'},
+                            {'label': 'In the last 6 months', 'value': '6month'},
+                            {'label': 'In the last year', 'value': '12month'},
+                        ]),
+                    ]),
+                    html.Div(className='cf mv3', children=[
+                        html.Label('Fields'),
+                        dcc.Dropdown(id='status-fields', multi=True, options=options['fields']),
+                    ]),
+                    html.Div(className='cf mv3', children=[
+                        html.Label('With all of these fields'),
+                        dcc.Dropdown(id='status-fields-all', multi=True, options=options['fields']),
+                    ]),
+                    html.Div(className='cf mv3', children=[
+                        html.Label('Without these fields'),
+                        dcc.Dropdown(id='status-fields-none', multi=True, options=options['fields']),
                     ]),
                 ]),
-                html.Div(className='cf mv3', children=[
-                    html.Label('Fields'),
-                    dcc.Dropdown(id='status-fields', multi=True, options=[]),
-                ]),
+            ]),
+        ] + list(slots)),
+        html.Div(className="fl w-75-l w-100 pa2-l", children=[
+            history_panel(options),
+            coverage_panel(),
+            html.Div(id='status-rows', children=[], className=''),
+        ] + selection_input()),
+    ]))
+
+HISTORY_METRICS = [
+    {'label': 'Grants', 'value': 'grants'},
+    {'label': 'Files', 'value': 'files'},
+    {'label': 'Amount awarded', 'value': 'currencies'},
+    {'label': 'Files using each field', 'value': 'fields'},
+    {'label': 'Files under each licence', 'value': 'licences'},
+]
+
+def history_panel(options):
+    return message_box(title="Over time", contents=[
+        html.Div(className='flex', children=[
+            html.Div(className='w-50 pr2', children=[
+                dcc.Dropdown(id='history-metric', options=HISTORY_METRICS, value='grants', clearable=False),
+            ]),
+            html.Div(className='w-50', children=[
+                dcc.Dropdown(id='history-publisher', options=options['publisher'],
+                             placeholder='All publishers'),
             ]),
         ]),
-    ]),
-    html.Div(className="fl w-75-l w-100 pa2-l", children=[
-        html.Div(id='status-rows', children=[], className=''),
-    ]),
-]))
-
-@app.callback([Output('status-licence', 'options'),
-               Output('status-fields', 'options'),
-               Output('status-currency', 'options'),
-               Output('status-file-type', 'options')],
-              [Input('status-container', 'children')])
-def get_options(_):
-    reg = get_registry(THREESIXTY_STATUS_JSON)
-    return_options = []
-
-    # get licences
-    licenses = {}
-    for r in reg:
-        if r.get('license') and r.get('license') in licenses:
-            continue
-        licenses[r.get('license')] = r.get('license_name')
-    return_options.append([{
-        "label": v,
-        "value": k
-    } for k, v in licenses.items()])
-
-    # get fields
-    fields = set()
-    for r in reg:
-        for f, field in r.get("datagetter_coverage", {}).items():
-            if field.get("standard"):
-                fields.add(f)
-    return_options.append([{
-        "label": f,
-        "value": f
-    } for f in sorted(list(fields))])
-
-    # get currencies
-    currencies = set()
-    for r in reg:
-        for c in r.get("datagetter_aggregates", {}).get('currencies', {}).keys():
-            currencies.add(c)
-    return_options.append([{
-        "label": "{} [{}]".format(babel.numbers.get_currency_name(c), c),
-        "value": c
-    } for c in currencies])
-
-    # get filetypes
-    filetypes = {}
-    for r in reg:
-        filetype = r.get('datagetter_metadata', {}).get("file_type")
-        filetypes[filetype] = FILE_TYPES.get(filetype, (filetype, "Unknown"))
-    return_options.append([{
-        "label": "{} ({})".format(v[0], v[1]),
-        "value": k
-    } for k, v in filetypes.items()])
-
-    return return_options
+        dcc.Graph(id='history-graph', config={'displayModeBar': False}, style={'height': '300px'}),
+    ])
+
+def coverage_panel():
+    return message_box(title="Field coverage", contents=[
+        dcc.Graph(id='coverage-graph', config={'displayModeBar': False}),
+    ])
+
+def selection_input():
+    # where the browser puts the records it has filtered
+    if not CLIENT_FILTERING:
+        return []
+    return [dcc.Input(id='status-selection', type='text', value='', style={'display': 'none'})]
+
+def detail_slots():
+    # each slot's toggle and panel, hidden. On a page they come with the
+    # cards in the results instead.
+    return [html.Div(style={'display': 'none'}, children=[
+        c for slot in range(DETAIL_SLOTS) for c in (
+            html.Button(id='publisher-toggle-{}'.format(slot)),
+            html.Div(id='publisher-detail-{}'.format(slot)),
+        )
+    ])]
+
+app.layout = serve_layout
+
 
+# in the usual mode every filter is an input to the results. With
+# CLIENT_FILTERING the browser filters with assets/client_filtering.js and
+# only sends the matching records, through a hidden input.
+STATUS_OUTPUT = 'status-rows.children'
+if CLIENT_FILTERING:
+    STATUS_INPUTS = ['status-selection.value', 'url.search']
+else:
+    STATUS_INPUTS = [
+        'status-search.value', 'status-licence.value', 'status-last-modified.value',
+        'status-currency.value', 'status-file-type.value', 'status-fields.value',
+        'status-fields-all.value', 'status-fields-none.value', 'url.search',
+    ]
 
 @app.callback(Output('status-rows', 'children'),
-              [Input('status-search', 'value'),
-               Input('status-licence', 'value'),
-               Input('status-last-modified', 'value'),
-               Input('status-currency', 'value'),
-               Input('status-file-type', 'value'),
-               Input('status-fields', 'value')])
-def update_status_container(search, licence, last_modified, currency, filetype, fields):
-    reg = get_registry_by_publisher(filters={
-        "search": search,
-        "licence": licence,
-        "last_modified": last_modified,
-        "currency": currency,
-        "filetype": filetype,
-        "fields": fields
-    }, reg_url=THREESIXTY_STATUS_JSON)
+              [Input(*i.split('.')) for i in STATUS_INPUTS])
+@traced('callback')
+def update_status_container(*values):
+    filters, selection, page, page_size = status_request(dict(zip(STATUS_INPUTS, values)))
+
+    snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+    return status_rows(snapshot, filters, page, page_size, selection)
+
+app.callback_map[STATUS_OUTPUT]['callback'] = traced_dash_callback(
+    app.callback_map[STATUS_OUTPUT]['callback'], 'callback')
+
+@app.callback(Output('history-graph', 'figure'),
+              [Input('history-metric', 'value'), Input('history-publisher', 'value')])
+@traced('history')
+def update_history_graph(metric, publisher):
+    snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+    return history_figure(history_store.index(), metric or 'grants', publisher, snapshot)
+
+FILTER_INPUTS = [i for i in STATUS_INPUTS if i != 'url.search']
+
+def detail_callback(slot):
+    @app.callback(Output('publisher-detail-{}'.format(slot), 'children'),
+                  [Input('publisher-toggle-{}'.format(slot), 'n_clicks')],
+                  [State('publisher-toggle-{}'.format(slot), 'value')] +
+                  [State(*i.split('.')) for i in FILTER_INPUTS])
+    @traced('detail')
+    def update_publisher_detail(n_clicks, publisher, *values):
+        if not n_clicks or n_clicks % 2 == 0:
+            return []
+        filters, selection, _, _ = status_request(dict(zip(FILTER_INPUTS, values)))
+        snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+        ids = matching_publishers(snapshot, filters, selection).get(publisher)
+        if ids is None:
+            return []
+        return cached_publisher_detail(snapshot, ids)
+    return update_publisher_detail
+
+for slot in range(DETAIL_SLOTS):
+    detail_callback(slot)
+
+# the share of each publisher's files with each standard field, for the
+# publishers with files matching the filters
+COVERAGE_PUBLISHERS = 50 # rows in the heatmap
+
+@app.callback(Output('coverage-graph', 'figure'),
+              [Input(*i.split('.')) for i in FILTER_INPUTS])
+@traced('coverage')
+def update_coverage_graph(*values):
+    filters, selection, _, _ = status_request(dict(zip(FILTER_INPUTS, values)))
+    snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+    reg = matching_publishers(snapshot, filters, selection)
+    ids = np.concatenate(list(reg.values())) if reg else np.zeros(0, dtype=np.int64)
+    return coverage_figure(snapshot, ids)
+
+def coverage_figure(snapshot, ids, limit=COVERAGE_PUBLISHERS):
+    codes, files, fields, coverage = snapshot.index.coverage(ids)
+    names = [snapshot.store.publishers[p] for p in codes[:limit]]
+    title = None
+    if len(codes) > limit:
+        title = 'The {} publishers with the most files, of {}'.format(limit, len(codes))
+    return {
+        'data': [{
+            'type': 'heatmap',
+            'z': np.round(coverage[:limit], 1),
+            'x': fields,
+            'y': names,
+            'text': [['{} of {} files'.format(int(round(c * f / 100)), f) for c in row]
+                     for row, f in zip(coverage[:limit], files[:limit])],
+            'zmin': 0,
+            'zmax': 100,
+            'colorscale': 'Greens',
+            'reversescale': True,
+            'hovertemplate': '%{y}<br>%{x}: %{z}% (%{text})<extra></extra>',
+            'colorbar': {'ticksuffix': '%'},
+        }],
+        'layout': {
+            'title': title,
+            'height': 200 + 20 * len(names),
+            'margin': {'l': 250, 'r': 20, 't': 40 if title else 20, 'b': 180},
+            'xaxis': {'tickangle': -45, 'side': 'bottom'},
+            'yaxis': {'autorange': 'reversed', 'automargin': True},
+        },
+    }
+
+# the history is a step for each registry that was different, so each line
+# is drawn as steps and carried on to now
+def history_figure(index, metric, publisher=None, snapshot=None):
+    points = index.points()
+    table = 'stats' if metric in STATS else metric
+    names, values = index.values(table, publisher, points)
+    if metric in STATS:
+        columns = [list(names).index(metric)]
+    else:
+        # the entries with the most in the latest registry
+        latest = np.nan_to_num(values[-1]) if len(points) else np.zeros(len(names))
+        columns = [c for c in np.argsort(-latest, kind='stable')[:10] if latest[c] > 0]
+    times = index.times(points)
+    if times:
+        times.append(datetime.datetime.now())
+        values = np.concatenate([values, values[-1:]])
+
+    def label(name):
+        if metric == 'currencies':
+            return '{} [{}]'.format(currency_name(name), name)
+        if metric == 'licences' and snapshot is not None:
+            return snapshot.store.licence_names.get(name) or name or 'No licence'
+        return name
 
+    traces = []
+    for c in columns:
+        trace = {
+            'x': times,
+            'y': values[:, c],
+            'name': label(names[c]),
+            'type': 'scatter',
+            'mode': 'lines',
+            'line': {'shape': 'hv'},
+        }
+        if metric == 'licences':
+            # the licence mix, as a share of the files under the licences
+            # shown; plotly takes groupnorm from the first trace in the group
+            trace['stackgroup'] = 'licences'
+            if not traces:
+                trace['groupnorm'] = 'percent'
+        traces.append(trace)
+    return {
+        'data': traces,
+        'layout': {
+            'margin': {'l': 60, 'r': 20, 't': 20, 'b': 40},
+            'showlegend': metric not in STATS,
+            'legend': {'orientation': 'h'},
+            'xaxis': {'rangeselector': {'buttons': [
+                {'count': 7, 'label': '1w', 'step': 'day', 'stepmode': 'backward'},
+                {'count': 1, 'label': '1m', 'step': 'month', 'stepmode': 'backward'},
+                {'count': 6, 'label': '6m', 'step': 'month', 'stepmode': 'backward'},
+                {'step': 'all'},
+            ]}},
+            'yaxis': {'ticksuffix': '%', 'range': [0, 100]} if metric == 'licences' else {},
+        },
+    }
+
+# {publisher: ids} for the files matching the filters, or those selected
+# in the browser
+def matching_publishers(snapshot, filters, selection=None):
+    ids = None
+    if selection is not None and selection[0] == snapshot.digest[:12]:
+        ids = snapshot.index.from_bitset(selection[1])
+    if ids is None:
+        # nothing selected, or selected from an older registry
+        _, reg = get_ids_by_publisher(filters=filters, cache=filter_cache, snapshot=snapshot)
+        return reg
+    return dict(snapshot.index.group_by_publisher(ids))
+
+def status_rows(snapshot, filters, page, page_size, selection=None):
+    reg = matching_publishers(snapshot, filters, selection)
     file_count = sum([len(pub_reg) for pub, pub_reg in reg.items()])
+    with stage('totals'):
+        filtered = totals(snapshot.store, np.concatenate(list(reg.values())) if reg else [])
+    summary = [
+        html.Span(className="", children=[
+            html.Strong(len(reg)),
+            ' ' + pluralize("publisher", len(reg))
+        ]),
+        html.Span(className="", children=[
+            html.Strong(file_count),
+            ' ' + pluralize("file", file_count)
+        ]),
+        html.Span(className="", children=[
+            html.Strong(humanize.intcomma(int(filtered.count[0]))),
+            ' ' + pluralize("grant", int(filtered.count[0]))
+        ]),
+    ]
+    for c, amount in filtered.currencies().items():
+        cur = format_currency(amount, c)
+        summary.append(html.Span(className="", children=[
+            html.Strong(cur[0]),
+            ' ' + cur[1] if cur[1] else ''
+        ]))
     rows = [
-        html.Div(className='w-100 f3', children=[
-            html.Span(className="", children=[
-                html.Strong(len(reg)),
-                ' ' + pluralize("publisher", len(reg))
-            ]),
-            html.Span(className='mh2', children='·'),
-            html.Span(className="", children=[
-                html.Strong(file_count),
-                ' ' + pluralize("file", file_count)
-            ]),
+        html.Div(className='w-100 f3', children=[summary[0]] + [
+            c for s in summary[1:] for c in (html.Span(className='mh2', children='·'), s)
         ])
     ]
-    for pub, pub_reg in reg.items():
-        rows.append(
-            html.Div(className='br2 ba dark-gray b--black-10 mv4 w-100 center mb4', children=[
-                html.Div(className='w-100 cf pa3', children=[
-                    html.A(className='f3 link black b',
-                           href=pub_reg[0].get("publisher", {}).get("website"),
-                           target='_blank', children=[
-                               pub_reg[0].get("publisher", {}).get("name")
-                           ]),
-                    html.Img(className='fr mw5', src=pub_reg[0].get(
-                        "publisher", {}).get("logo"), style={'max-height': '8rem'}),
-                ]),
-                html.Div(className='content', children=[
-                    html.Div(className='flex ph3', children=([
-                        to_statistic(len(pub_reg), pluralize("file", len(pub_reg)))
-                    ] + get_publisher_stats(pub_reg, separator=html.Span('·')) if len(pub_reg)>1 else [])
-                    ),
-                    html.Div(className='description', children=[
-                        file_row(v, len(pub_reg)) for v in pub_reg
-                    ])
-                ])
-            ])
-        )
+    page_reg, page, pages = paginate(list(reg.values()), page, page_size)
+    with stage('render'):
+        for slot, ids in enumerate(page_reg):
+            rows.append(cached_publisher_card(snapshot, ids, slot))
+    if pages > 1:
+        rows.append(pagination(page, pages, page_size, filters))
     return rows
 
-def file_row(v, files=1):
+def status_request(values):
+    # the normalised filters, any (version, bitset) selected in the browser,
+    # and the page asked for
+    selection = None
+    if CLIENT_FILTERING:
+        filters, selection = parse_selection(values.get('status-selection.value'))
+    else:
+        filters = normalise_filters({
+            "search": values.get('status-search.value'),
+            "licence": values.get('status-licence.value'),
+            "last_modified": values.get('status-last-modified.value'),
+            "currency": values.get('status-currency.value'),
+            "filetype": values.get('status-file-type.value'),
+            "fields": values.get('status-fields.value'),
+            "fields_all": values.get('status-fields-all.value'),
+            "fields_none": values.get('status-fields-none.value'),
+        })
+    page, page_size = get_page_args(values.get('url.search'), default_page_size=PAGE_SIZE)
+    # changing a filter starts again from the first page. Which input dash
+    # says triggered the call can't tell us that, as the first call of all
+    # names a filter too, so compare with the filters the page was for. A
+    # page link from filtered results, opened afresh, has no filters to
+    # match and so opens on the first page.
+    if get_page_filters(values.get('url.search')) != filters_tag(filters):
+        page = 1
+    return filters, selection, page, page_size
+
+def parse_selection(value):
+    # {"v": snapshot version, "ids": bitset, "filters": {...}} from the
+    # browser, or nothing if there aren't any filters
+    try:
+        value = json.loads(value or 'null') or {}
+        filters = normalise_filters(value.get("filters") or {})
+        selection = (value["v"], value["ids"]) if filters else None
+    except (ValueError, TypeError, AttributeError, KeyError):
+        return {}, None
+    return filters, selection
+
+# the results are the same JSON for every request with equivalent filters
+# on the same page, so the serialised response is kept and sent straight
+# back before dash decodes the request or renders anything
+def status_payload_key():
+    if flask.request.method != 'POST' or \
+            flask.request.path != app.config.routes_pathname_prefix + '_dash-update-component':
+        return None
+    body = flask.request.get_json(silent=True) or {}
+    if body.get('output') != STATUS_OUTPUT:
+        return None
+    values = {
+        '{}.{}'.format(x.get('id'), x.get('property')): x.get('value')
+        for x in body.get('inputs', [])
+    }
+    filters, selection, page, page_size = status_request(values)
+    if selection is not None:
+        return (filter_key(filters), None, selection, page, page_size)
+    return (filter_key(filters), filter_time(filters), None, page, page_size)
+
+# the landing page is the same for everyone until the registry changes, so
+# its layout, option lists and unfiltered results are built once for each
+# snapshot, compressed, and served as they are. The unfiltered results are
+# rebuilt every few minutes too, as they say how long ago files changed.
+DEFAULT_STATUS_KEY = (filter_key({}), None, None, 1, PAGE_SIZE)
+
+def build_landing_page(snapshot):
+    options = get_options(snapshot)
+    # the same envelope dash puts round a callback's output
+    status = {'response': {'props': {'children': status_rows(snapshot, {}, 1, PAGE_SIZE)}}}
+    payloads = {
+        "layout.json": (to_json(status_layout(options)), 'application/json'),
+        "options.json": (to_json(options), 'application/json'),
+        "status.json": (to_json(status), 'application/json'),
+    }
+    if CLIENT_FILTERING:
+        index = dict(snapshot.index.compact(), version=snapshot.digest[:12])
+        payloads["filter-index.json"] = (to_json(index), 'application/json')
+    return payloads
+
+def to_json(value):
+    return json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder).encode('utf8')
+
+landing_page = caches["landing_page"] = PrerenderedPayloads(
+    build_landing_page, max_age=payload_cache.ttl, version=lambda snapshot: link_cache.version())
+
+@on_snapshot
+def build_landing_page_on_swap(reg_url, snapshot, previous):
+    if reg_url != THREESIXTY_STATUS_JSON:
+        return
+    try:
+        landing_page.get(snapshot)
+    except Exception:
+        # requests will try again
+        app.server.logger.exception('Could not build the landing page')
+
+@app.server.before_request
+def cached_status_payload():
+    if flask.request.path == app.config.routes_pathname_prefix + '_dash-layout':
+        snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+        return landing_page.get(snapshot)["layout.json"].response()
+    key = status_payload_key()
+    if key is None:
+        return None
+    snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+    if key == DEFAULT_STATUS_KEY:
+        note('payload', 'prerendered')
+        return landing_page.get(snapshot)["status.json"].response()
+    # the payloads also go out of date when links are checked again
+    version = (snapshot.digest, link_cache.version())
+    payload = payload_cache.lookup(key, version=version)
+    if payload is not None:
+        note('payload', 'cache hit')
+        return flask.Response(payload, mimetype='application/json')
+    note('payload', 'cache miss')
+    flask.g.status_payload = (key, version)
+    return None
+
+# the same payloads for anything else that wants them. Under a version
+# they never change, so they can be cached for as long as a client likes.
+@app.server.route('/prerendered/<name>')
+@app.server.route('/prerendered/<version>/<name>')
+def prerendered(name, version=None):
+    snapshot = get_snapshot(THREESIXTY_STATUS_JSON, max_age=cache_expiry)
+    payload = landing_page.get(snapshot).get(name)
+    if payload is None:
+        flask.abort(404)
+    if version is None:
+        response = payload.response()
+        response.headers['Link'] = '</prerendered/{}/{}>; rel="canonical"'.format(payload.etag, name)
+        return response
+    if version != payload.etag:
+        # an older build; send them to the current one
+        return flask.redirect('/prerendered/{}/{}'.format(payload.etag, name))
+    return payload.response('public, max-age=31536000, immutable')
+
+# whether this process can serve without waiting: it has a registry and
+# the landing page built from it. For load balancers and rolling restarts,
+# so it never waits on the registry itself.
+@app.server.route('/ready')
+def ready():
+    snapshot = current_snapshot(THREESIXTY_STATUS_JSON)
+    state = {
+        "registry": snapshot is not None,
+        "landing_page": snapshot is not None and landing_page.digest == snapshot.digest,
+        "leader": registry_refresher.is_leader,
+        "pid": os.getpid(),
+    }
+    ok = state["registry"] and state["landing_page"]
+    return flask.Response(json.dumps(state), status=200 if ok else 503, mimetype='application/json')
+
+# everything a worker would otherwise do before its first response: load
+# the registry and build its indexes, Babel's locale data, the history and
+# the landing page. With PRELOAD this happens in the gunicorn master, so
+# the forked workers share it copy-on-write.
+def warm_up():
+    timings = {}
+    start = time.perf_counter()
+    snapshot = registry_refresher.warm_up()
+    timings['registry'] = time.perf_counter() - start
+    if snapshot is None:
+        return timings
+    start = time.perf_counter()
+    snapshot.digest
+    snapshot.index.field_matrix
+    formatting.warm_up(snapshot.store.currencies)
+    get_options(snapshot)
+    timings['indexes'] = time.perf_counter() - start
+    start = time.perf_counter()
+    history_store.index()
+    landing_page.get(snapshot)
+    # dash sets itself up in the first request, which would be in each worker
+    with app.server.app_context():
+        app.server.try_trigger_before_first_request_functions()
+    timings['landing_page'] = time.perf_counter() - start
+    # connections in the pool can't be shared between processes
+    get_client().close()
+    return timings
+
+# the threads that keep the registry and link results fresh. Importing the
+# app doesn't start them: gunicorn.conf.py does in each worker once it has
+# been forked, as does running app.py. Without them the registry is loaded
+# when a request needs it.
+def start_background():
+    registry_refresher.start()
+    if link_checker is not None:
+        link_checker.start()
+
+@app.server.after_request
+def store_status_payload(response):
+    key = flask.g.pop('status_payload', None)
+    if key is not None and response.status_code == 200 and not response.direct_passthrough:
+        payload_cache.put(key[0], response.get_data(), version=key[1])
+    return response
+
+def pagination(page, pages, page_size, filters=None):
+    def page_link(label, page_):
+        if page_ < 1 or page_ > pages:
+            return html.Span(label, className='pa2 mid-gray')
+        return dcc.Link(label, href=page_url(page_, page_size, PAGE_SIZE, filters),
+                        className='link black underline-hover pa2')
+
+    return html.Nav(className='w-100 tc f4 mv4', children=[
+        page_link('← Previous', page - 1),
+        html.Span('Page {} of {}'.format(page, pages), className='mh3'),
+        page_link('Next →', page + 1),
+    ])
+
+# a card only changes when one of the files shown in it changes, or the
+# check of one of their links does, so cards and file rows are cached by
+# the content hashes of their records and the state of their links
+def cached_publisher_card(snapshot, ids, slot=0):
+    publisher = snapshot.store.publishers[snapshot.store.publisher[ids[0]]]
+    key = ('publisher', publisher, files_digest(snapshot, ids), slot)
+    return render_cache.get(
+        key,
+        lambda: publisher_card(
+            snapshot.registry[ids[0]].get("publisher", {}),
+            publisher,
+            len(ids),
+            publisher_stats(snapshot, ids),
+            slot,
+        ),
+    )
+
+# the file rows of an opened card, kept until its files or their links
+# change, or for ROW_TTL
+def cached_publisher_detail(snapshot, ids):
+    links = link_cache.merged(snapshot)
+    publisher = snapshot.store.publishers[snapshot.store.publisher[ids[0]]]
+    key = (
+        'detail', publisher, files_digest(snapshot, ids),
+        tuple(link_state(links.get(i)) for i in ids),
+    )
+    return render_cache.get(
+        key, lambda: [cached_file_row(snapshot, i, len(ids), links.get(i)) for i in ids],
+        ttl=ROW_TTL)
+
+def files_digest(snapshot, ids):
+    return hashlib.sha1(snapshot.store.hashes[ids].tobytes()).hexdigest()
+
+def cached_file_row(snapshot, i, files=1, link=None):
+    key = ('file', snapshot.store.identifiers[i], snapshot.store.hashes[i], files > 1, link_state(link))
+    return render_cache.get(key, lambda: file_row(snapshot.registry[i], files, link), ttl=ROW_TTL)
+
+def link_state(link):
+    return None if link is None else (link.ok, link.status, link.error)
+
+# totals for the files of one publisher: precomputed if all of its files
+# are shown, otherwise summed over just the ones that are
+def publisher_stats(snapshot, ids):
+    publisher = snapshot.store.publisher[ids[0]]
+    if snapshot.publisher_aggregates.files[publisher] == len(ids):
+        return snapshot.publisher_aggregates.as_datagetter_aggregates(publisher)
+    return totals(snapshot.store, ids).as_datagetter_aggregates()
+
+def publisher_card(publisher, code, files, stats, slot=0):
+    return html.Div(className='br2 ba dark-gray b--black-10 mv4 w-100 center mb4', children=[
+        html.Div(className='w-100 cf pa3', children=[
+            html.A(className='f3 link black b',
+                   href=publisher.get("website"),
+                   target='_blank', children=[
+                       publisher.get("name")
+                   ]),
+            html.Img(className='fr mw5', src=publisher.get("logo"), style={'max-height': '8rem'}),
+        ]),
+        html.Div(className='content', children=[
+            html.Div(className='flex ph3', children=[
+                to_statistic(files, pluralize("file", files))
+            ] + get_publisher_stats(stats, separator=html.Span('·'))
+            ),
+            # made without n_clicks, or children, so that nothing is
+            # rendered until the button is pressed
+            html.Button(
+                id='publisher-toggle-{}'.format(slot),
+                value=code,
+                className='bn bg-transparent pointer link dark-gray underline-hover pa3 f5',
+                children='Show or hide {}'.format(pluralize("file", files)),
+            ),
+            html.Div(id='publisher-detail-{}'.format(slot), className='description'),
+        ])
+    ])
+
+def file_row(v, files=1, link=None):
     style = {"border-top": '0'} if files > 1 else {}
 
     validity = {
@@ -328,13 +949,18 @@ def file_row(v, files=1):
             'positive': 'Licensed for reuse', 'negative': 'Licence doesn\'t allow reuse'
         }, 'message': 'Unknown licence'},
     }
+    checks = dict(v.get('datagetter_metadata', {}))
+    if link is not None:
+        checks['downloads'] = link.ok
+        if not link.ok:
+            validity['downloads']['messages']['negative'] += ' ({})'.format(link.status or link.error)
     for i in validity:
-        if v.get('datagetter_metadata', {}).get(i)==True:
+        if checks.get(i)==True:
             validity[i]['class'] = 'positive'
             validity[i]['icon'] = html.Span(className='green mr1', children='✓')
             validity[i]['message'] = validity[i]['messages']['positive']
             validity[i]['color'] = 'green'
-        elif v.get('datagetter_metadata', {}).get(i)==False:
+        elif checks.get(i)==False:
             validity[i]['class'] = 'positive'
             validity[i]['icon'] = html.Span(className='red mr1', children='✕')
             validity[i]['message'] = validity[i]['messages']['negative']
@@ -361,14 +987,14 @@ def file_row(v, files=1):
                 html.Span(get_date_range(v)),
                 html.Span(className='mh1', children='·'),
                 html.Span(', '.join(
-                    [babel.numbers.get_currency_name(k) for k in v.get("datagetter_aggregates", {}).get("currencies", {})]
+                    [currency_name(k) for k in v.get("datagetter_aggregates", {}).get("currencies", {})]
                 )),
                 html.Span(className='mh1', children='·'),
                 html.Span([
                     'Last modified ',
                     html.Time(dateTime=v.get("modified"), children=[
                     humanize.naturaldelta(
-                        datetime.datetime.now() - dateutil.parser.parse(v.get("modified"), ignoretz=True)
+                        datetime.datetime.now() - parse_datetime(v.get("modified"))
                     )]),
                     ' ago'
                 ]),
@@ -450,19 +1076,7 @@ def get_file_stats(v, separator=None, as_statistic=True):
     return stats
 
 
-def get_publisher_stats(pub_reg, **kwargs):
-    data = {
-        "count": 0,
-        "currencies": {}
-    }
-
-    for r in pub_reg:
-        data["count"] += r.get("datagetter_aggregates", {}).get("count", 0)
-        for c, cagg in r.get("datagetter_aggregates", {}).get("currencies", {}).items():
-            if c not in data["currencies"]:
-                data["currencies"][c] = {"total_amount": 0}
-            data["currencies"][c]["total_amount"] += cagg.get("total_amount", 0)
-
+def get_publisher_stats(data, **kwargs):
     return get_file_stats({"datagetter_aggregates": data}, **kwargs)
 
 def get_date_range(v):
@@ -513,5 +1127,14 @@ def get_license_badge(url, name):
     return name
 
 
+if PRELOAD:
+    warm_up_timings = warm_up()
+    app.server.logger.info('Warmed up in %s', warm_up_timings)
+    # keep the objects made so far out of the garbage collector's way, so
+    # collections in the workers don't write to the pages they share
+    gc.freeze()
+
+
 if __name__ == '__main__':
+    start_background()
     app.run_server(debug=True)
@@ -0,0 +1,315 @@
+/*
+Filters the registry in the browser when the dashboard runs with
+CLIENT_FILTERING set. The compact filter index is fetched once (and
+revalidated now and then), the filters are read from dash's store as they
+change, and the records that match are handed to the server as a bitset
+through the hidden status-selection input, so the server only renders the
+visible page of cards.
+
+Dash 0.40 has no clientside callbacks, so the input is set the way a user
+typing into it would set it.
+*/
+(function (window) {
+    var INDEX_URL = '/prerendered/filter-index.json';
+    var DEBOUNCE = 300; // ms after the last change before filtering
+    var REFRESH = 60 * 1000; // ms before checking the index is current
+    var SELECTION_ID = 'status-selection';
+    var FILTERS = {
+        search: 'status-search',
+        licence: 'status-licence',
+        last_modified: 'status-last-modified',
+        currency: 'status-currency',
+        filetype: 'status-file-type',
+        fields: 'status-fields',
+        fields_all: 'status-fields-all',
+        fields_none: 'status-fields-none'
+    };
+    var LIST_FILTERS = ['licence', 'currency', 'filetype', 'fields', 'fields_all', 'fields_none'];
+    var LAST_MODIFIED = ['lastmonth', '6month', '12month'];
+
+    function decode(value, Type) {
+        var s = window.atob(value);
+        var bytes = new Uint8Array(s.length);
+        for (var i = 0; i < s.length; i++) {
+            bytes[i] = s.charCodeAt(i);
+        }
+        return new Type(bytes.buffer);
+    }
+
+    function load(index) {
+        index.publisher = decode(index.publisher, Int32Array);
+        index.licence = decode(index.licence, Int32Array);
+        index.filetype = decode(index.filetype, Int32Array);
+        index.currency_record = decode(index.currency_record, Int32Array);
+        index.currency_code = decode(index.currency_code, Int32Array);
+        index.field_bits = decode(index.field_bits, Uint32Array);
+        index.modified = decode(index.modified, Float64Array);
+        return index;
+    }
+
+    // the same as normalise_filters in indexes.py
+    function normalise(filters) {
+        var normalised = {};
+        if (filters.search) {
+            normalised.search = filters.search.toLowerCase();
+        }
+        if (LAST_MODIFIED.indexOf(filters.last_modified) >= 0) {
+            normalised.last_modified = filters.last_modified;
+        }
+        LIST_FILTERS.forEach(function (name) {
+            var values = filters[name];
+            if (typeof values === 'string') {
+                values = [values];
+            }
+            values = (values || []).filter(function (v, i, all) {
+                return v && all.indexOf(v) === i;
+            }).sort();
+            if (values.length && values.indexOf('__all') < 0) {
+                normalised[name] = values;
+            }
+        });
+        return normalised;
+    }
+
+    function codes(table, values) {
+        return values.map(function (v) {
+            return table.indexOf(v);
+        }).filter(function (c) {
+            return c >= 0;
+        });
+    }
+
+    function keepAnyOf(mask, column, wanted) {
+        for (var i = 0; i < mask.length; i++) {
+            if (mask[i] && wanted.indexOf(column[i]) < 0) {
+                mask[i] = 0;
+            }
+        }
+    }
+
+    function keepMarked(mask, marked) {
+        for (var i = 0; i < mask.length; i++) {
+            mask[i] &= marked[i];
+        }
+    }
+
+    // keep the records with any, all or none of the fields, as
+    // any_field, all_fields and no_fields in indexes.py
+    function keepFields(mask, index, fields, how) {
+        var words = index.field_words;
+        var wanted = codes(index.fields, fields);
+        var fieldMask = new Uint32Array(words);
+        var i, w;
+        if (how === 'all' && wanted.length < fields.length) {
+            mask.fill(0);
+            return;
+        }
+        wanted.forEach(function (f) {
+            fieldMask[f >> 5] |= 1 << (f & 31);
+        });
+        for (i = 0; i < mask.length; i++) {
+            var any = 0;
+            var all = true;
+            for (w = 0; w < words; w++) {
+                var bits = index.field_bits[i * words + w] & fieldMask[w];
+                any |= bits;
+                all = all && (bits >>> 0) === fieldMask[w];
+            }
+            if ((how === 'any' && !any) || (how === 'all' && !all) || (how === 'none' && any)) {
+                mask[i] = 0;
+            }
+        }
+    }
+
+    // the local time now, in the same terms as the index's modified times
+    function localNow() {
+        var d = new Date();
+        return Date.UTC(d.getFullYear(), d.getMonth(), d.getDate(),
+                        d.getHours(), d.getMinutes(), d.getSeconds()) / 1000;
+    }
+
+    // a mask of the records matching the filters, as RegistryIndex.filter_mask
+    function filter(index, filters, now) {
+        var mask = new Uint8Array(index.size);
+        var marked, i, j;
+        mask.fill(1);
+        if (filters.licence) {
+            keepAnyOf(mask, index.licence, codes(index.licences, filters.licence));
+        }
+        if (filters.last_modified in index.last_modified_days) {
+            var since = now - index.last_modified_days[filters.last_modified] * 86400;
+            for (i = 0; i < mask.length; i++) {
+                // NaN never compares true
+                if (!(index.modified[i] >= since)) {
+                    mask[i] = 0;
+                }
+            }
+        }
+        if (filters.currency) {
+            var currencies = codes(index.currencies, filters.currency);
+            marked = new Uint8Array(index.size);
+            for (j = 0; j < index.currency_record.length; j++) {
+                if (currencies.indexOf(index.currency_code[j]) >= 0) {
+                    marked[index.currency_record[j]] = 1;
+                }
+            }
+            keepMarked(mask, marked);
+        }
+        if (filters.filetype) {
+            keepAnyOf(mask, index.filetype, codes(index.filetypes, filters.filetype));
+        }
+        if (filters.fields) {
+            keepFields(mask, index, filters.fields, 'any');
+        }
+        if (filters.fields_all) {
+            keepFields(mask, index, filters.fields_all, 'all');
+        }
+        if (filters.fields_none) {
+            keepFields(mask, index, filters.fields_none, 'none');
+        }
+        if (filters.search) {
+            marked = new Uint8Array(index.search_texts.length);
+            index.search_texts.forEach(function (text, t) {
+                marked[t] = text.indexOf(filters.search) >= 0 ? 1 : 0;
+            });
+            for (i = 0; i < mask.length; i++) {
+                if (!marked[index.search_by_publisher ? index.publisher[i] : i]) {
+                    mask[i] = 0;
+                }
+            }
+        }
+        return mask;
+    }
+
+    // base64 bitset of a mask, first record in the high bit of the first
+    // byte, as RegistryIndex.from_bitset reads it
+    function encode(mask) {
+        var bytes = new Uint8Array((mask.length + 7) >> 3);
+        for (var i = 0; i < mask.length; i++) {
+            if (mask[i]) {
+                bytes[i >> 3] |= 0x80 >> (i & 7);
+            }
+        }
+        var s = '';
+        for (var j = 0; j < bytes.length; j += 0x8000) {
+            s += String.fromCharCode.apply(null, bytes.subarray(j, j + 0x8000));
+        }
+        return window.btoa(s);
+    }
+
+    function selection(index, filters, now) {
+        if (!Object.keys(filters).length) {
+            return '';
+        }
+        return JSON.stringify({
+            v: index.version,
+            ids: encode(filter(index, filters, now)),
+            filters: filters
+        });
+    }
+
+    window.clientFiltering = {
+        load: load,
+        normalise: normalise,
+        filter: filter,
+        encode: encode,
+        selection: selection
+    };
+
+    if (!window.document) {
+        return;
+    }
+
+    var index = null;
+    var fetched = 0;
+    var pending = null;
+    var lastValues = null;
+    var timer = null;
+
+    function fetchIndex() {
+        if (pending === null) {
+            pending = window.fetch(INDEX_URL, {credentials: 'same-origin'}).then(function (r) {
+                return r.json();
+            }).then(function (data) {
+                if (!index || index.version !== data.version) {
+                    index = load(data);
+                }
+                fetched = Date.now();
+                pending = null;
+                return index;
+            }, function (e) {
+                pending = null;
+                throw e;
+            });
+        }
+        return pending;
+    }
+
+    function prop(state, id, name) {
+        var path = state.paths[id];
+        if (!path) {
+            return undefined;
+        }
+        var node = state.layout;
+        for (var i = 0; i < path.length; i++) {
+            node = node[path[i]];
+        }
+        return node.props[name];
+    }
+
+    function filterValues(state) {
+        var values = {};
+        Object.keys(FILTERS).forEach(function (name) {
+            values[name] = prop(state, FILTERS[name], 'value');
+        });
+        return values;
+    }
+
+    function send(value) {
+        var input = window.document.getElementById(SELECTION_ID);
+        if (!input || input.value === value) {
+            return;
+        }
+        var setter = Object.getOwnPropertyDescriptor(window.HTMLInputElement.prototype, 'value').set;
+        setter.call(input, value);
+        input.dispatchEvent(new window.Event('input', {bubbles: true}));
+    }
+
+    function update() {
+        var filters = normalise(lastValues);
+        var current = index && Date.now() - fetched < REFRESH ? Promise.resolve(index) : fetchIndex();
+        current.then(function (loaded) {
+            send(selection(loaded, filters, localNow()));
+        });
+    }
+
+    function changed() {
+        var state = window.store.getState();
+        if (!state.paths || !state.paths[SELECTION_ID]) {
+            return;
+        }
+        var values = filterValues(state);
+        var key = JSON.stringify(values);
+        if (lastValues !== null && key === JSON.stringify(lastValues)) {
+            return;
+        }
+        var first = lastValues === null;
+        lastValues = values;
+        if (first) {
+            // start fetching the index while the user decides what to filter
+            fetchIndex();
+            return;
+        }
+        window.clearTimeout(timer);
+        timer = window.setTimeout(update, DEBOUNCE);
+    }
+
+    // the store is made when dash's renderer starts
+    var wait = window.setInterval(function () {
+        if (window.store) {
+            window.clearInterval(wait);
+            window.store.subscribe(changed);
+            changed();
+        }
+    }, 50);
+})(this);
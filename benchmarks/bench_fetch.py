@@ -0,0 +1,88 @@
+import argparse
+import http.server
+import json
+import tempfile
+import threading
+import time
+
+from fetch import FeedClient, FileCache, MemoryCache
+from benchmarks.synthetic import make_registry
+
+# concurrent revalidation of the registry feed through FeedClient with each
+# cache store, against a local server that answers conditional GETs
+#   python -m benchmarks.bench_fetch --threads 8 --requests 50
+
+
+class Feed(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    content = b''
+    etag = '"1"'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == Feed.etag:
+            self.send_response(304)
+            self.send_header('ETag', Feed.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', Feed.etag)
+        self.send_header('Content-Length', str(len(Feed.content)))
+        self.end_headers()
+        self.wfile.write(Feed.content)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(client, url, threads, requests):
+    def worker():
+        for _ in range(requests):
+            client.fetch(url)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    Feed.content = json.dumps(make_registry(args.size)).encode('utf8')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Feed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/coverage.json'.format(server.server_port)
+
+    stores = [
+        ("none", None),
+        ("memory", MemoryCache()),
+        ("file", FileCache(tempfile.mkdtemp())),
+    ]
+    print("{} requests from {} threads for a {:.1f}MB feed".format(
+        args.threads * args.requests, args.threads, len(Feed.content) / 1e6))
+    print("{:>8} {:>10} {:>8} {:>12} {:>12}".format(
+        "cache", "total s", "req/s", "mean ms", "max ms"))
+    for name, cache in stores:
+        client = FeedClient(cache=cache, pool_size=args.threads)
+        elapsed = run(client, url, args.threads, args.requests)
+        timings = client.timings.summary()
+        fetches = [timings[t] for t in ('fetch', 'not_modified') if t in timings]
+        count = sum(t["count"] for t in fetches)
+        print("{:>8} {:>10.2f} {:>8.0f} {:>12.2f} {:>12.2f}".format(
+            name, elapsed, count / elapsed,
+            1000 * sum(t["total"] for t in fetches) / count,
+            1000 * max(t["max"] for t in fetches)))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
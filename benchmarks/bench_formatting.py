@@ -0,0 +1,122 @@
+import argparse
+import json
+import time
+from unittest import mock
+
+import babel.numbers
+import dateutil.parser
+import humanize
+import inflect
+import plotly
+
+from benchmarks.synthetic import make_registry
+
+# time to render every file row and publisher summary in a registry with
+# the formatting helpers from before formatting.py, and with formatting.py:
+#   python -m benchmarks.bench_formatting --size 2000
+
+
+def old_pluralize(string, count):
+    p = inflect.engine()
+    return p.plural(string, count)
+
+
+def old_format_currency(amount, currency='GBP', humanize_=True, int_format="{:,.0f}"):
+    if humanize_:
+        amount_str = humanize.intword(amount).split(" ")
+        if len(amount_str) == 2:
+            return (
+                babel.numbers.format_currency(
+                    float(amount_str[0]),
+                    currency,
+                    format="¤#,##0.0",
+                    currency_digits=False,
+                    locale='en_UK'
+                ),
+                amount_str[1]
+            )
+
+    return (
+        babel.numbers.format_currency(
+            amount,
+            currency,
+            format="¤#,##0",
+            currency_digits=False,
+            locale='en_UK'
+        ),
+        ""
+    )
+
+
+def old_parse_datetime(value):
+    return dateutil.parser.parse(value, ignoretz=True)
+
+
+OLD_HELPERS = {
+    "pluralize": old_pluralize,
+    "format_currency": old_format_currency,
+    "currency_name": babel.numbers.get_currency_name,
+    "parse_datetime": old_parse_datetime,
+}
+
+
+def format_all(helpers, registry):
+    # the formatting calls a full render makes, without building components
+    output = []
+    for v in registry:
+        agg = v["datagetter_aggregates"]
+        output.append(helpers["pluralize"]("grant", agg["count"]))
+        output.append(helpers["pluralize"]("recipient", agg["distinct_recipient_org_identifier_count"]))
+        output.append(helpers["pluralize"]("file", 2))
+        output.append(helpers["parse_datetime"](v["modified"]))
+        for c, cagg in agg["currencies"].items():
+            output.append(helpers["currency_name"](c))
+            output.append(helpers["format_currency"](cagg["total_amount"], c))
+    return output
+
+
+def render_all(app, registry):
+    by_publisher = {}
+    for r in registry:
+        by_publisher.setdefault(r["publisher"]["name"], []).append(r)
+    rows = []
+    for pub_reg in by_publisher.values():
+        rows.extend(app.file_row(v, len(pub_reg)) for v in pub_reg)
+    return json.dumps(rows, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import app
+    registry = make_registry(args.size)
+
+    new_helpers = {k: getattr(app, k) for k in OLD_HELPERS}
+
+    print("{:<12} {:>12} {:>12} {:>8} {:>10}".format("", "before ms", "after ms", "speed up", "identical"))
+    for name, func, old_args, new_args in [
+        ("formatting", format_all, (OLD_HELPERS, registry), (new_helpers, registry)),
+        ("full render", render_all, (app, registry), (app, registry)),
+    ]:
+        with mock.patch.multiple(app, **OLD_HELPERS):
+            old_time, old_output = best_of(args.repeat, func, *old_args)
+        new_time, new_output = best_of(args.repeat, func, *new_args)
+        print("{:<12} {:>12.1f} {:>12.1f} {:>7.1f}x {:>10}".format(
+            name, old_time * 1000, new_time * 1000, old_time / new_time, str(old_output == new_output)))
+
+
+if __name__ == '__main__':
+    main()
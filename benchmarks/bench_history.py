@@ -0,0 +1,100 @@
+import argparse
+import copy
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from history import HistoryStore, summarise
+from registry import RegistrySnapshot
+from benchmarks.synthetic import make_registry
+
+# the registry history with a point every hour for --days days, written as
+# the app writes it: a keyframe, then only the publishers whose files
+# changed. Times writing the points and compacting them, loading the
+# history, and the queries the graphs and /api/history make.
+#   python -m benchmarks.bench_history --days 365 --size 1000
+
+
+def variants(size, count, changes, seed=1):
+    # count registries, each with a few files changed from the one before
+    rng = random.Random(seed)
+    feed = make_registry(size)
+    snapshots = [RegistrySnapshot(feed)]
+    for _ in range(count - 1):
+        feed = copy.deepcopy(feed)
+        for r in rng.sample(feed, changes):
+            r["datagetter_aggregates"]["count"] = rng.randint(1, 10000)
+        snapshots.append(RegistrySnapshot(feed, previous=snapshots[-1]))
+    return snapshots
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, max(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--size', type=int, default=1000, help='files in the registry')
+    parser.add_argument('--changes', type=int, default=3, help='files changed each hour')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--directory', help='where to write the history; a temporary directory by default')
+    args = parser.parse_args()
+
+    snapshots = variants(args.size, 24, args.changes)
+    keyframe = summarise(snapshots[0])
+    deltas = [
+        summarise(s).only(sorted(p or '' for p in s.changelog.publishers)) for s in snapshots[1:]
+    ]
+
+    store = HistoryStore(args.directory or tempfile.mkdtemp())
+    start = datetime.datetime(2020, 1, 1).timestamp()
+    hours = args.days * 24
+    began = time.perf_counter()
+    for hour in range(hours):
+        # a keyframe once a week, as if the app had restarted
+        chunk = keyframe if hour % (24 * 7) == 0 else deltas[hour % len(deltas)]
+        chunk.time = np.array([start + hour * 3600.0])
+        store.write(chunk)
+    written = time.perf_counter() - began
+    began = time.perf_counter()
+    store.compact(today='9999-12-31')
+    compacted = time.perf_counter() - began
+    disk = sum(os.path.getsize(p) for p in store.paths())
+
+    began = time.perf_counter()
+    index = store.index()
+    loaded = time.perf_counter() - began
+    publisher = index.publishers[int(index.publisher[len(index.publisher) // 2])]
+    end = datetime.datetime.fromtimestamp(start + hours * 3600)
+
+    print("{} points, {} publisher rows, {:.1f}MB on disk in {} files".format(
+        index.size, len(index.publisher), disk / 1e6, len(store.paths())))
+    print("write {:.2f}ms a point, compact {:.2f}s, load {:.3f}s".format(
+        written / hours * 1000, compacted, loaded))
+    print("{:<40} {:>10} {:>10}".format("query", "median ms", "max ms"))
+    for name, func in [
+        ("registry grants", lambda: index.series("grants")),
+        ("registry grants, last 30 days", lambda: index.series(
+            "grants", start=end - datetime.timedelta(days=30))),
+        ("publisher grants", lambda: index.series("grants", publisher=publisher)),
+        ("publisher currencies", lambda: index.values("currencies", publisher)),
+        ("publisher fields", lambda: index.values("fields", publisher)),
+        ("registry licences", lambda: index.values("licences")),
+        ("index() with nothing new", store.index),
+    ]:
+        print("{:<40} {:>10.2f} {:>10.2f}".format(name, *timed(func, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from linkcheck import check_links
+
+# the link checker against local stand-ins for publishers' servers, each
+# on its own port and answering after a delay. Some links are broken, some
+# redirect and some servers refuse HEAD. Checking one link at a time is
+# timed on a sample for comparison.
+#   python -m benchmarks.bench_linkcheck --links 5000 --hosts 50 --latency 0.05
+
+
+class StandIn(object):
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        request = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        method, path = request[0], request[1]
+        if path.startswith('/missing'):
+            head = 'HTTP/1.1 404 Not Found\r\nContent-Length: 0'
+        elif path.startswith('/moved'):
+            head = 'HTTP/1.1 302 Found\r\nLocation: /file{}\r\nContent-Length: 0'.format(path[6:])
+        elif path.startswith('/nohead') and method == 'HEAD':
+            head = 'HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0'
+        elif method == 'GET':
+            head = 'HTTP/1.1 206 Partial Content\r\nContent-Range: bytes 0-0/12345\r\nContent-Length: 1'
+        else:
+            head = 'HTTP/1.1 200 OK\r\nContent-Length: 12345'
+        writer.write((head + '\r\nConnection: close\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+        writer.close()
+
+
+def serve(stand_in, hosts):
+    # start a server on hosts ports in a thread of its own, returning them
+    loop = asyncio.new_event_loop()
+    ports = []
+    ready = threading.Event()
+
+    async def start():
+        for _ in range(hosts):
+            server = await asyncio.start_server(stand_in.handle, '127.0.0.1', 0, backlog=1024)
+            ports.append(server.sockets[0].getsockname()[1])
+        ready.set()
+
+    def run():
+        loop.run_until_complete(start())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return ports
+
+
+def make_links(ports, count, seed=1):
+    rng = random.Random(seed)
+    kinds = ['file'] * 85 + ['missing'] * 5 + ['moved'] * 5 + ['nohead'] * 5
+    return [
+        'http://127.0.0.1:{}/{}{}.csv'.format(rng.choice(ports), rng.choice(kinds), i)
+        for i in range(count)
+    ]
+
+
+def check_serially(urls, timeout):
+    for url in urls:
+        try:
+            urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout).close()
+        except urllib.error.HTTPError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--links', type=int, default=5000)
+    parser.add_argument('--hosts', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds each response takes')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--per-host', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=None, help='requests a second to each host')
+    parser.add_argument('--serial-sample', type=int, default=50)
+    args = parser.parse_args()
+
+    stand_in = StandIn(args.latency)
+    ports = serve(stand_in, args.hosts)
+    urls = make_links(ports, args.links)
+
+    start = time.perf_counter()
+    results = check_links(urls, concurrency=args.concurrency, per_host=args.per_host,
+                          rate=args.rate, timeout=10)
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for r in results.values():
+        key = r.status if r.error is None else r.error
+        statuses[key] = statuses.get(key, 0) + 1
+    latencies = sorted(r.latency for r in results.values())
+    print("{} links on {} hosts, {:.0f}ms a response, {} requests".format(
+        len(results), args.hosts, args.latency * 1000, stand_in.requests))
+    print("checked in {:.2f}s ({:.0f} links/s), {} broken".format(
+        elapsed, len(results) / elapsed, sum(not r.ok for r in results.values())))
+    print("latency median {:.1f}ms, p99 {:.1f}ms".format(
+        latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+    print("statuses", dict(sorted(statuses.items(), key=str)))
+
+    sample = urls[:args.serial_sample]
+    start = time.perf_counter()
+    check_serially(sample, 10)
+    serial = (time.perf_counter() - start) / len(sample) * len(urls)
+    print("one at a time: an estimated {:.1f}s ({:.0f}x slower)".format(serial, serial / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import gc
+import json
+import tracemalloc
+
+from columnar import build_store
+from indexes import RegistryIndex
+from benchmarks.synthetic import make_registry
+
+# memory held per record by the parsed registry: the nested dicts from
+# r.json() against the columnar store and its index
+#   python -m benchmarks.bench_memory --sizes 1000 10000
+
+
+def retained(func, *args):
+    # bytes still allocated by func's result once it has returned
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, peak
+
+
+def columnar(content):
+    return build_store(json.loads(content))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>12} {:>14} {:>10}".format(
+        "records", "dicts B/rec", "store B/rec", "index B/rec", "build peak MB", "reduction"))
+    for size in args.sizes:
+        content = json.dumps(make_registry(size)).encode('utf8')
+
+        dicts, dicts_size, _ = retained(json.loads, content)
+        del dicts
+        store, store_size, store_peak = retained(columnar, content)
+        index, index_size, _ = retained(RegistryIndex, store)
+        del store, index
+
+        print("{:>8} {:>12.0f} {:>12.0f} {:>12.0f} {:>14.1f} {:>9.1f}x".format(
+            size, dicts_size / size, store_size / size, index_size / size,
+            store_peak / 1e6, dicts_size / (store_size + index_size)))
+
+
+if __name__ == '__main__':
+    main()
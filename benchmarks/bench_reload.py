@@ -0,0 +1,53 @@
+import argparse
+import copy
+import io
+import json
+import random
+import time
+
+from columnar import read_store
+from registry import RegistrySnapshot
+from benchmarks.synthetic import make_registry
+
+# time to reload the registry when a fraction of its records have changed:
+# building a snapshot from scratch against building it from the previous
+# one, copying the records that are unchanged
+#   python -m benchmarks.bench_reload --size 20000 --changed 0 0.01 0.1 1
+
+
+def changed_feed(registry, fraction, rnd):
+    registry = copy.deepcopy(registry)
+    for i in rnd.sample(range(len(registry)), int(len(registry) * fraction)):
+        registry[i]["datagetter_aggregates"]["count"] += 1
+    return json.dumps(registry).encode('utf8')
+
+
+def load(content, previous=None):
+    start = time.perf_counter()
+    store = read_store(io.BytesIO(content), previous=previous.store if previous else None)
+    snapshot = RegistrySnapshot(None, store=store, previous=previous)
+    return snapshot, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--changed', type=float, nargs='+', default=[0, 0.01, 0.1, 1])
+    args = parser.parse_args()
+
+    rnd = random.Random(360)
+    registry = make_registry(args.size)
+    current, _ = load(json.dumps(registry).encode('utf8'))
+
+    print("{:>8} {:>9} {:>10} {:>10} {:>8} {:>9}".format(
+        "records", "changed", "full s", "delta s", "speedup", "changelog"))
+    for fraction in args.changed:
+        content = changed_feed(registry, fraction, rnd)
+        _, full = load(content)
+        snapshot, delta = load(content, previous=current)
+        print("{:>8} {:>8.0%} {:>10.2f} {:>10.2f} {:>7.1f}x {:>9}".format(
+            args.size, fraction, full, delta, full / delta, len(snapshot.changelog)))
+
+
+if __name__ == '__main__':
+    main()
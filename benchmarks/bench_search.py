@@ -0,0 +1,64 @@
+import argparse
+import random
+import time
+
+from indexes import SearchIndex
+from benchmarks.synthetic import make_registry
+
+# search latency for the publisher search box at different registry sizes:
+#   python -m benchmarks.bench_search --sizes 10000 100000
+
+
+def time_queries(func, queries, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for q in queries:
+            func(q)
+        elapsed = (time.perf_counter() - start) / len(queries)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def typed(queries):
+    # every prefix of every query, as if typed one keystroke at a time
+    return [q[:i] for q in queries for i in range(1, len(q) + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 30000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    print("{:>8} {:>10} {:>10} {:>12} {:>12} {:>12}".format(
+        "records", "build ms", "matches", "scan µs", "index µs", "typed µs"))
+    for size in args.sizes:
+        names = [r["publisher"]["name"] for r in make_registry(size, files_per_publisher=1)]
+        names = list(dict.fromkeys(names))
+        queries = []
+        for _ in range(args.queries):
+            name = rnd.choice(names).lower()
+            start = rnd.randint(0, len(name) - 1)
+            queries.append(name[start:start + rnd.randint(3, 12)])
+        lowered = [n.lower() for n in names]
+
+        start = time.perf_counter()
+        index = SearchIndex(names)
+        build = time.perf_counter() - start
+
+        def scan(q):
+            return [i for i, n in enumerate(lowered) if q in n]
+
+        matches = sum(len(scan(q)) for q in queries) / len(queries)
+        scan_time = time_queries(scan, queries, repeat=1)
+        index_time = time_queries(index.search, queries, repeat=1)
+        index._recent.clear()
+        typed_time = time_queries(index.search, typed(queries), repeat=1)
+        print("{:>8} {:>10.1f} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+            size, build * 1000, matches, scan_time * 1e6, index_time * 1e6, typed_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
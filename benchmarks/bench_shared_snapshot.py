@@ -0,0 +1,189 @@
+import argparse
+import http.server
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import registry
+from benchmarks.synthetic import make_registry
+
+# worker processes sharing one registry through a snapshot file, as under
+# gunicorn. A local server stands in for the feed and publishes a new
+# version every --swap-every seconds; each worker runs a RegistryRefresher
+# and keeps checking that the snapshot it reads is all one version while
+# the leader swaps the file underneath it.
+#   python -m benchmarks.bench_shared_snapshot --workers 4 --size 10000
+
+REG_URL_PATH = '/coverage.json'
+
+
+def versioned_registry(records, version):
+    # every record carries the version, so a reader can tell if it sees two
+    # versions at once
+    for r in records:
+        r["datagetter_aggregates"]["count"] = version
+    return json.dumps(records).encode('utf8')
+
+
+class Feed(http.server.BaseHTTPRequestHandler):
+
+    version = 1
+    content = b''
+    downloads = 0
+    not_modified = 0
+
+    def do_GET(self):
+        etag = '"{}"'.format(Feed.version)
+        if self.headers.get('If-None-Match') == etag:
+            Feed.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        content = Feed.content
+        Feed.downloads += 1
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def check(snapshot):
+    # the columns, the decoded records and the ETag must all agree
+    store = snapshot.store
+    version = int(snapshot.etag.strip('"'))
+    if not (store.count == version).all():
+        return False
+    sample = np.random.randint(0, store.size, 20)
+    return all(
+        store.records[i]["datagetter_aggregates"]["count"] == version for i in sample
+    ) and version
+
+
+def worker(reg_url, shared_location, started, stop, results):
+    start = time.perf_counter()
+    refresher = registry.RegistryRefresher(
+        reg_url, interval=0.05, shared_location=shared_location, poll_interval=0.02,
+    )
+    refresher.start()
+    registry.get_snapshot(reg_url)
+    cold_start = time.perf_counter() - start
+    started.release()
+
+    reads = errors = 0
+    versions = set()
+    while not stop.is_set():
+        snapshot = registry.get_snapshot(reg_url)
+        version = check(snapshot)
+        if version:
+            versions.add(version)
+        else:
+            errors += 1
+        reads += 1
+    results.put({
+        "pid": os.getpid(),
+        "leader": refresher._lock_file is not None,
+        "cold_start": cold_start,
+        "reads": reads,
+        "errors": errors,
+        "versions": len(versions),
+        "pss_kb": pss_kb(),
+    })
+    refresher.stop()
+
+
+def pss_kb():
+    # proportional set size: pages shared with other processes count
+    # fractionally, so mapped snapshots show up smaller than private copies
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--swap-every', type=float, default=2)
+    args = parser.parse_args()
+
+    records = make_registry(args.size)
+    Feed.content = versioned_registry(records, Feed.version)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Feed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    reg_url = 'http://127.0.0.1:{}{}'.format(server.server_port, REG_URL_PATH)
+
+    directory = tempfile.mkdtemp()
+    shared_location = os.path.join(directory, 'registry.snapshot')
+    try:
+        # time for one process to build the registry itself, against mapping
+        # a snapshot that another process has written
+        start = time.perf_counter()
+        snapshot = registry.RegistrySnapshot(json.loads(Feed.content))
+        build_time = time.perf_counter() - start
+        snapshot.etag = '"{}"'.format(Feed.version)
+        registry.save_shared_snapshot(snapshot, shared_location, 1)
+        start = time.perf_counter()
+        registry.load_shared_snapshot(shared_location)
+        map_time = time.perf_counter() - start
+        print("build from JSON {:.3f}s, map snapshot {:.4f}s ({:.0f}x)".format(
+            build_time, map_time, build_time / map_time))
+
+        # workers start against the snapshot left by a previous run, then
+        # keep reading while the feed changes
+        ctx = multiprocessing.get_context('fork')
+        started = ctx.Semaphore(0)
+        stop = ctx.Event()
+        results = ctx.Queue()
+        workers = [
+            ctx.Process(target=worker, args=(reg_url, shared_location, started, stop, results))
+            for _ in range(args.workers)
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            started.acquire()
+
+        end = time.time() + args.duration
+        while time.time() < end:
+            time.sleep(args.swap_every)
+            Feed.content = versioned_registry(records, Feed.version + 1)
+            Feed.version += 1
+        stop.set()
+
+        stats = [results.get() for _ in workers]
+        for w in workers:
+            w.join()
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+
+    print("{:>8} {:>7} {:>11} {:>8} {:>7} {:>9} {:>9}".format(
+        "pid", "leader", "cold start", "reads", "errors", "versions", "Pss MB"))
+    for s in sorted(stats, key=lambda s: not s["leader"]):
+        print("{:>8} {:>7} {:>10.3f}s {:>8} {:>7} {:>9} {:>9}".format(
+            s["pid"], "yes" if s["leader"] else "", s["cold_start"], s["reads"],
+            s["errors"], s["versions"],
+            "{:.1f}".format(s["pss_kb"] / 1024) if s["pss_kb"] else "-"))
+    print("{} versions published, {} downloads and {} not modified responses from the feed".format(
+        Feed.version, Feed.downloads, Feed.not_modified))
+    if any(s["errors"] for s in stats):
+        raise SystemExit("workers read inconsistent snapshots")
+
+
+if __name__ == '__main__':
+    main()
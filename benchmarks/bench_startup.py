@@ -0,0 +1,210 @@
+import argparse
+import http.server
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.synthetic import make_registry
+
+# how long a worker takes to start serving, each run in fresh processes
+# against a local stand-in for the feed:
+#   plain    imports the app, starts its background threads and answers
+#            its first requests, as running app.py does
+#   preload  imports and warms up the app once, as the gunicorn master
+#            does with PRELOAD, then forks --workers workers and times
+#            their first requests
+# Memory is each process's proportional and private set size after those
+# requests; forked workers share what the master loaded.
+#   python -m benchmarks.bench_startup --size 10000 --workers 4 --repeat 3
+
+FIRST_REQUESTS = [
+    ("layout", "/_dash-layout", None),
+    ("results", "/prerendered/status.json", None),
+    ("search", None, {"status-search.value": "trust"}),
+    ("ready", "/ready", None),
+]
+
+
+class Feed(http.server.BaseHTTPRequestHandler):
+
+    content = b''
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"1"')
+        self.send_header('Content-Length', str(len(Feed.content)))
+        self.end_headers()
+        self.wfile.write(Feed.content)
+
+    def log_message(self, *args):
+        pass
+
+
+def memory_kb():
+    # proportional and private set size, from /proc/self/smaps_rollup
+    sizes = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Pss', 'Private_Clean', 'Private_Dirty'):
+                    sizes[name] = int(value.split()[0])
+    except OSError:
+        return None, None
+    return sizes.get('Pss'), sizes.get('Private_Clean', 0) + sizes.get('Private_Dirty', 0)
+
+
+def first_requests(app):
+    # time each of the requests a browser makes first, in ms
+    client = app.app.server.test_client()
+    timings = {}
+    for name, path, values in FIRST_REQUESTS:
+        start = time.perf_counter()
+        if path is not None:
+            response = client.get(path)
+        else:
+            inputs = [
+                {"id": i.split('.')[0], "property": i.split('.')[1], "value": values.get(i)}
+                for i in app.STATUS_INPUTS
+            ]
+            response = client.post(
+                app.app.config.routes_pathname_prefix + '_dash-update-component',
+                json={"output": app.STATUS_OUTPUT, "inputs": inputs, "changedPropIds": []},
+            )
+        timings[name] = (time.perf_counter() - start) * 1000
+        timings[name + "_status"] = response.status_code
+    return timings
+
+
+def child_plain():
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter() - start
+    app.start_background()
+    timings = first_requests(app)
+    pss, private = memory_kb()
+    return [dict(timings, mode="plain", imported=imported,
+                 first_response=time.perf_counter() - start, pss_kb=pss, private_kb=private)]
+
+
+def child_preload(workers):
+    os.environ['PRELOAD'] = '1'
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter() - start
+    master = {"mode": "master", "imported": imported, "warm_up": app.warm_up_timings}
+    master["pss_kb"], master["private_kb"] = memory_kb()
+
+    pipes = []
+    for _ in range(workers):
+        read, write = os.pipe()
+        forked = time.perf_counter()
+        if os.fork() == 0:
+            # as gunicorn.conf.py's post_fork
+            os.close(read)
+            app.start_background()
+            timings = first_requests(app)
+            pss, private = memory_kb()
+            result = dict(timings, mode="worker", first_response=time.perf_counter() - forked,
+                          pss_kb=pss, private_kb=private)
+            os.write(write, json.dumps(result).encode('utf8'))
+            os._exit(0)
+        os.close(write)
+        pipes.append(read)
+    results = [master]
+    for read in pipes:
+        with os.fdopen(read) as f:
+            results.append(json.loads(f.read()))
+    os.wait()
+    return results
+
+
+def run(mode, reg_url, workers):
+    # one run in a fresh process and directory, so nothing is left on disk
+    # from the last
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, REGISTRY_URL=reg_url,
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for name in ('PRELOAD', 'CLIENT_FILTERING', 'LINK_CHECK_INTERVAL', 'REGISTRY_CACHE'):
+        env.pop(name, None)
+    try:
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.bench_startup', '--child', mode,
+             '--workers', str(workers)],
+            cwd=directory, env=env, stderr=subprocess.DEVNULL,
+        )
+    finally:
+        shutil.rmtree(directory)
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def median(results, key):
+    values = [r[key] for r in results if r.get(key) is not None]
+    return statistics.median(values) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=10000, help='files in the registry')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', choices=['plain', 'preload'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        results = child_plain() if args.child == 'plain' else child_preload(args.workers)
+        print(json.dumps(results))
+        return
+
+    Feed.content = json.dumps(make_registry(args.size)).encode('utf8')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Feed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    reg_url = 'http://127.0.0.1:{}/coverage.json'.format(server.server_port)
+
+    results = []
+    try:
+        for _ in range(args.repeat):
+            results.extend(run('plain', reg_url, args.workers))
+            results.extend(run('preload', reg_url, args.workers))
+    finally:
+        server.shutdown()
+
+    print("{} files, {:.1f}MB of JSON, {} workers, median of {} runs".format(
+        args.size, len(Feed.content) / 1e6, args.workers, args.repeat))
+    print("{:<8} {:>9} {:>14} {:>9} {:>9} {:>9} {:>9} {:>8} {:>11}".format(
+        "process", "import s", "first resp. s", "layout ms", "results ms", "search ms",
+        "ready ms", "Pss MB", "private MB"))
+    for mode in ("plain", "master", "worker"):
+        rows = [r for r in results if r["mode"] == mode]
+        cells = [median(rows, "imported"), median(rows, "first_response")] + [
+            median(rows, name) for name, _, _ in FIRST_REQUESTS
+        ] + [median(rows, "pss_kb"), median(rows, "private_kb")]
+        print("{:<8} {:>9} {:>14} {:>9} {:>9} {:>10} {:>9} {:>8} {:>11}".format(mode, *[
+            '-' if v is None else '{:.1f}'.format(v / 1024) if i >= 6
+            else '{:.2f}'.format(v) if i < 2 else '{:.1f}'.format(v)
+            for i, v in enumerate(cells)
+        ]))
+    masters = [r for r in results if r["mode"] == "master"]
+    warm_up = {
+        k: statistics.median(m["warm_up"][k] for m in masters) for k in masters[0]["warm_up"]
+    }
+    print("warm-up in the master: " + ", ".join(
+        "{} {:.2f}s".format(k, v) for k, v in warm_up.items()))
+    failed = [r for r in results for name, _, _ in FIRST_REQUESTS
+              if r["mode"] != "master" and r.get(name + "_status") != 200]
+    if failed:
+        raise SystemExit("{} processes had requests that failed".format(len(failed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from columnar import build_store, read_store
+from benchmarks.synthetic import write_registry
+
+# time and peak memory to load synthetic registry feeds into the columnar
+# store, parsing the whole document with json.load against streaming it
+# through ijson one entry at a time. Each load runs in a fresh process so
+# that its peak resident size is its own.
+#   python -m benchmarks.bench_streaming --sizes-mb 10 100 1000
+
+METHODS = {
+    "json.load": lambda f: build_store(json.load(f)),
+    "streaming": read_store,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(method, location):
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    with open(location, 'rb') as f:
+        store = METHODS[method](f)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "records": store.size,
+        "seconds": elapsed,
+        "peak_mb": peak_rss_mb() - baseline,
+        "store_mb": store.nbytes() / 1e6,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--measure', nargs=2, metavar=('METHOD', 'FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        return measure(*args.measure)
+
+    print("{:>8} {:>9} {:>10} {:>10} {:>10} {:>10}".format(
+        "feed MB", "records", "method", "seconds", "peak MB", "store MB"))
+    for size_mb in args.sizes_mb:
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            records = write_registry(f, size_mb * 10**6)
+            f.flush()
+            for method in METHODS:
+                out = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_streaming', '--measure', method, f.name],
+                    check=True, stdout=subprocess.PIPE,
+                ).stdout
+                result = json.loads(out.decode('utf8').strip().splitlines()[-1])
+                print("{:>8} {:>9} {:>10} {:>10.1f} {:>10.0f} {:>10.1f}".format(
+                    size_mb, records, method, result["seconds"], result["peak_mb"],
+                    result["store_mb"]))
+
+
+if __name__ == '__main__':
+    main()
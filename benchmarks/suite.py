@@ -0,0 +1,318 @@
+import argparse
+import datetime
+import gc
+import gzip
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import formatting
+import registry
+from columnar import read_store
+from benchmarks.synthetic import make_registry
+
+# the dashboard's hot paths against synthetic registries of each size:
+# loading the feed, each kind of filter, the field coverage matrix, the
+# results callback end to end, the size of what it sends, the formatting
+# helpers and peak memory.
+# Results are written as JSON, and a previous run's results can be given to
+# compare against.
+#   python -m benchmarks.suite --sizes 1000 10000 --output before.json
+#   python -m benchmarks.suite --sizes 1000 10000 --compare before.json
+
+# the dashboard's input for each filter
+INPUT_IDS = {
+    "search": 'status-search.value',
+    "licence": 'status-licence.value',
+    "last_modified": 'status-last-modified.value',
+    "currency": 'status-currency.value',
+    "filetype": 'status-file-type.value',
+    "fields": 'status-fields.value',
+    "fields_all": 'status-fields-all.value',
+    "fields_none": 'status-fields-none.value',
+}
+
+
+def timed(func, *args, repeat=5, setup=None):
+    # median and best seconds for func(*args), with the last result
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return {"median": statistics.median(times), "best": min(times)}, result
+
+
+def peak_memory(func, *args):
+    # the most memory allocated at once while func runs, in bytes
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def filter_cases(store):
+    licence = store.licences[0]
+    currency = store.currencies[0]
+    filetype = store.filetypes[0]
+    fields = sorted(store.fields)[:2]
+    return {
+        "none": {},
+        "licence": {"licence": [licence]},
+        "currency": {"currency": [currency]},
+        "filetype": {"filetype": [filetype]},
+        "fields": {"fields": fields},
+        "fields_all": {"fields_all": fields},
+        "fields_none": {"fields_none": fields[:1]},
+        "last_modified": {"last_modified": "6month"},
+        "search": {"search": "trust"},
+        "search_short": {"search": "a"},
+        "combined": {
+            "licence": [licence], "currency": [currency], "filetype": [filetype],
+            "last_modified": "12month", "search": "an",
+        },
+    }
+
+
+def bench_load(feed, repeat):
+    content = json.dumps(feed).encode('utf8')
+    results = {"feed_bytes": len(content)}
+    results["json_parse"], parsed = timed(json.loads, content, repeat=repeat)
+    results["snapshot_build"], snapshot = timed(
+        registry.RegistrySnapshot, parsed, repeat=repeat)
+    results["stream_build"], _ = timed(
+        lambda: read_store(io.BytesIO(content)), repeat=repeat)
+    results["peak_bytes"] = {
+        "json_parse_and_build": peak_memory(
+            lambda: registry.RegistrySnapshot(json.loads(content))),
+        "stream_build": peak_memory(lambda: read_store(io.BytesIO(content))),
+    }
+    results["store_bytes"] = snapshot.store.nbytes()
+    return snapshot, results
+
+
+def bench_filters(snapshot, repeat):
+    index = snapshot.index
+    now = datetime.datetime.now()
+    results = {}
+    for name, filters in filter_cases(snapshot.store).items():
+        timing, ids = timed(index.filter, filters, now, repeat=repeat)
+        results[name] = dict(timing, matches=len(ids))
+    return results
+
+
+def bench_coverage(snapshot, repeat):
+    # unpacking the field bitsets, then the coverage matrix from them for
+    # every file and for the files matching a filter
+    index = snapshot.index
+    results = {}
+
+    def unpack():
+        index._field_matrix = None
+        return index.field_matrix
+    results["field_matrix"], _ = timed(unpack, repeat=repeat)
+    results["all"], _ = timed(index.coverage, repeat=repeat)
+    ids = index.filter({"licence": [snapshot.store.licences[0]]})
+    results["filtered"], _ = timed(index.coverage, ids, repeat=repeat)
+    return results
+
+
+def bench_callback(app, snapshot, repeat):
+    # the results callback as the browser calls it, with every cache
+    # emptied first (cold) and then left as the first call filled them
+    # (warm). With no filters it's served from the landing page payloads.
+    client = app.app.server.test_client()
+    caches = [app.render_cache, app.filter_cache, app.payload_cache]
+
+    def clear():
+        for c in caches:
+            c.clear()
+
+    def call(values):
+        inputs = [
+            {"id": i.split('.')[0], "property": i.split('.')[1], "value": values.get(i)}
+            for i in app.STATUS_INPUTS
+        ]
+        response = client.post(
+            app.app.config.routes_pathname_prefix + '_dash-update-component',
+            json={"output": app.STATUS_OUTPUT, "inputs": inputs, "changedPropIds": []},
+        )
+        assert response.status_code == 200, response.status_code
+        return response.get_data()
+
+    results = {}
+    cases = {"page_2": ({}, '?page=2')}
+    if not app.CLIENT_FILTERING:
+        cases.update({
+            name: (filters, None) for name, filters in filter_cases(snapshot.store).items()
+        })
+    for name, (filters, search) in cases.items():
+        values = {INPUT_IDS[k]: v for k, v in filters.items()}
+        values['url.search'] = search
+        cold, payload = timed(call, values, repeat=repeat, setup=clear)
+        warm, _ = timed(call, values, repeat=repeat)
+        results[name] = {
+            "cold": cold,
+            "warm": warm,
+            "payload_bytes": len(payload),
+            "payload_gzip_bytes": len(gzip.compress(payload)),
+        }
+
+    # opening the card of the publisher with the most files
+    publisher = max(snapshot.index.group_by_publisher(np.arange(len(snapshot.registry))),
+                    key=lambda g: len(g[1]))[0]
+
+    def open_card():
+        states = [{"id": "publisher-toggle-0", "property": "value", "value": publisher}] + [
+            {"id": i.split('.')[0], "property": i.split('.')[1], "value": None}
+            for i in app.FILTER_INPUTS
+        ]
+        response = client.post(
+            app.app.config.routes_pathname_prefix + '_dash-update-component',
+            json={"output": "publisher-detail-0.children", "state": states, "changedPropIds": [],
+                  "inputs": [{"id": "publisher-toggle-0", "property": "n_clicks", "value": 1}]},
+        )
+        assert response.status_code == 200, response.status_code
+        return response.get_data()
+
+    cold, payload = timed(open_card, repeat=repeat, setup=clear)
+    warm, _ = timed(open_card, repeat=repeat)
+    results["publisher_detail"] = {
+        "cold": cold,
+        "warm": warm,
+        "payload_bytes": len(payload),
+        "payload_gzip_bytes": len(gzip.compress(payload)),
+    }
+
+    # the landing page, served from what was built for the snapshot
+    results["landing_page_build"], _ = timed(
+        app.build_landing_page, snapshot, repeat=repeat, setup=clear)
+    results["landing_page"] = {
+        name: {"bytes": len(p.content), "encoded_bytes": {e: len(v) for e, v in p.encodings.items()}}
+        for name, p in app.landing_page.get(snapshot).items()
+    }
+    return results
+
+
+def bench_helpers(app, utils, snapshot, feed, repeat):
+    # the helpers the callback spends its time in, per call
+    sample = feed[:min(len(feed), 500)]
+    amounts = [
+        (c["total_amount"], code)
+        for r in sample for code, c in r["datagetter_aggregates"]["currencies"].items()
+    ]
+    by_currency = {}
+    for a, c in amounts:
+        by_currency.setdefault(c, []).append(a)
+    results = {}
+    for name, func, calls in [
+        ("format_currency", lambda: [app.format_currency(a, c) for a, c in amounts], len(amounts)),
+        ("format_currencies", lambda: [
+            formatting.format_currencies(a, c) for c, a in by_currency.items()
+        ], len(amounts)),
+        ("get_file_stats", lambda: [app.get_file_stats(r) for r in sample], len(sample)),
+        ("file_row", lambda: [app.file_row(r, 2) for r in sample], len(sample)),
+    ]:
+        timing, _ = timed(func, repeat=repeat)
+        results[name] = {k: v / calls for k, v in timing.items()}
+    results["get_registry_by_publisher"], _ = timed(
+        lambda: utils.get_registry_by_publisher({}, snapshot=snapshot), repeat=repeat)
+    return results
+
+
+def run(sizes, repeat):
+    import app
+    import utils
+
+    results = {}
+    for size in sizes:
+        feed = make_registry(size)
+        snapshot, load = bench_load(feed, repeat)
+        registry.set_snapshot(app.THREESIXTY_STATUS_JSON, snapshot)
+        results[str(size)] = {
+            "records": snapshot.store.size,
+            "publishers": len(snapshot.store.publishers),
+            "load": load,
+            "filter": bench_filters(snapshot, repeat),
+            "coverage": bench_coverage(snapshot, repeat),
+            "callback": bench_callback(app, snapshot, repeat),
+            "helpers": bench_helpers(app, utils, snapshot, feed, repeat),
+        }
+    return results
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            yield from flatten(value, name + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(baseline, current):
+    # every timing, size and memory figure against the same one in baseline
+    before = dict(flatten(baseline["results"]))
+    print("{:<60} {:>14} {:>14} {:>8}".format("", "baseline", "current", "ratio"))
+    for name, value in flatten(current["results"]):
+        if name not in before or name.endswith('.best'):
+            continue
+        ratio = value / before[name] if before[name] else float('nan')
+        flag = ' <' if ratio > 1.1 and not name.endswith(('matches', 'records', 'publishers')) else ''
+        print("{:<60} {:>14.6g} {:>14.6g} {:>7.2f}x{}".format(name, before[name], value, ratio, flag))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results here as JSON, rather than to stdout')
+    parser.add_argument('--compare', help='results from an earlier run to compare with')
+    args = parser.parse_args()
+
+    current = {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+        },
+        "results": run(args.sizes, args.repeat),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    else:
+        json.dump(current, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), current)
+
+
+if __name__ == '__main__':
+    main()
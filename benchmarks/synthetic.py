@@ -0,0 +1,144 @@
+import datetime
+import json
+import random
+
+# builds registries shaped like the datagetter's coverage.json, for
+# benchmarking without downloading the real feed
+
+LICENSES = [
+    ("https://creativecommons.org/licenses/by/4.0/", "Creative Commons Attribution 4.0 International"),
+    ("https://creativecommons.org/licenses/by-sa/4.0/", "Creative Commons Attribution Share-Alike 4.0 International"),
+    ("https://creativecommons.org/publicdomain/zero/1.0/", "Creative Commons Zero 1.0"),
+    ("http://www.nationalarchives.gov.uk/doc/open-government-licence/version/3/", "Open Government Licence v3.0"),
+    ("http://www.opendefinition.org/licenses/odc-pddl", "Open Data Commons Public Domain Dedication and License"),
+]
+CURRENCIES = ["GBP", "GBP", "GBP", "GBP", "EUR", "USD"]
+FILE_TYPES = ["xlsx", "xlsx", "csv", "json", "xls"]
+STANDARD_FIELDS = [
+    "Identifier", "Title", "Description", "Currency", "Amount Awarded",
+    "Award Date", "Recipient Org:Identifier", "Recipient Org:Name",
+    "Recipient Org:Charity Number", "Recipient Org:Company Number",
+    "Recipient Org:Postal Code", "Funding Org:Identifier", "Funding Org:Name",
+    "Grant Programme:Title", "Beneficiary Location:Name",
+    "Beneficiary Location:Geographic Code", "Planned Dates:Duration (months)",
+    "Last modified", "Data Source",
+]
+EXTRA_FIELDS = ["Recipient Org:Web Address", "Grant Type", "From an open call?"]
+NAME_WORDS = [
+    "Community", "Foundation", "Trust", "Charitable", "Lottery", "Council",
+    "Big", "Fund", "Arts", "Heritage", "Sport", "London", "Yorkshire",
+    "Esmée", "Paul", "Hamlyn", "Garfield", "Weston", "Tudor", "Northern",
+    "Rock", "Wales", "Scotland", "Children", "Youth", "Power", "Lloyds",
+    "Bank", "City", "Bridge", "Joseph", "Rowntree", "Sussex", "Kent",
+]
+
+
+SYLLABLES = ["ba", "ca", "den", "fo", "gar", "ham", "ke", "lyn", "mor", "ney",
+             "os", "pri", "quin", "ros", "sel", "tre", "ul", "ver", "wes", "yat"]
+
+
+def publisher_name(rnd, i):
+    surname = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).title()
+    words = rnd.sample(NAME_WORDS, rnd.randint(1, 2))
+    return "{} {} {}".format(surname, " ".join(words), i)
+
+
+def make_record(rnd, i, publisher, now):
+    license, license_name = rnd.choice(LICENSES)
+    currencies = sorted(set(rnd.choice(CURRENCIES) for _ in range(rnd.choice([1, 1, 1, 2]))))
+    count = rnd.randint(1, 20000)
+    min_award = now - datetime.timedelta(days=rnd.randint(400, 4000))
+    max_award = min_award + datetime.timedelta(days=rnd.randint(0, 365))
+    modified = now - datetime.timedelta(days=rnd.randint(0, 1000), seconds=rnd.randint(0, 86400))
+    fields = rnd.sample(STANDARD_FIELDS, rnd.randint(6, len(STANDARD_FIELDS)))
+    fields += rnd.sample(EXTRA_FIELDS, rnd.randint(0, len(EXTRA_FIELDS)))
+    file_type = rnd.choice(FILE_TYPES)
+
+    return {
+        "identifier": "{}-{}".format(publisher["prefix"], i),
+        "title": "{} grants {}".format(publisher["name"], i),
+        "description": "",
+        "license": license,
+        "license_name": license_name,
+        "issued": min_award.strftime("%Y-%m-%d"),
+        "modified": modified.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        "publisher": publisher,
+        "distribution": [{
+            "title": "Grants file {}".format(i),
+            "accessURL": "{}/grants".format(publisher["website"]),
+            "downloadURL": "{}/grants-{}.{}".format(publisher["website"], i, file_type),
+        }],
+        "datagetter_metadata": {
+            "file_type": file_type,
+            "downloads": rnd.random() > 0.05,
+            "valid": rnd.random() > 0.1,
+            "acceptable_license": rnd.random() > 0.05,
+            "datetime_downloaded": now.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+            "json": "data/json_all/{}.json".format(publisher["prefix"]),
+        },
+        "datagetter_aggregates": {
+            "count": count,
+            "min_award_date": min_award.strftime("%Y-%m-%d"),
+            "max_award_date": max_award.strftime("%Y-%m-%d"),
+            "distinct_recipient_org_identifier_count": rnd.randint(0, count),
+            "distinct_funding_org_identifier_count": rnd.choice([1, 1, 1, 2, 3]),
+            "currencies": {
+                c: {
+                    "count": count,
+                    "total_amount": rnd.randint(1000, 10**9),
+                    "min_amount": rnd.randint(1, 1000),
+                    "max_amount": rnd.randint(1000, 10**7),
+                    "currency_symbol": "",
+                } for c in currencies
+            },
+        },
+        "datagetter_coverage": {
+            f: {
+                "standard": f in STANDARD_FIELDS,
+                "grants_with_field": rnd.randint(1, count),
+            } for f in fields
+        },
+    }
+
+
+def iter_registry(size=None, files_per_publisher=3, seed=360, now=None):
+    # records one at a time, without end if size is None
+    rnd = random.Random(seed)
+    now = now or datetime.datetime.now()
+    i = 0
+    p = 0
+    while size is None or i < size:
+        prefix = "360G-{:06d}".format(p)
+        publisher = {
+            "name": publisher_name(rnd, p),
+            "prefix": prefix,
+            "website": "https://example.org/{}".format(prefix),
+            "logo": "https://example.org/{}/logo.png".format(prefix),
+        }
+        files = rnd.randint(1, files_per_publisher * 2 - 1)
+        if size is not None:
+            files = min(files, size - i)
+        for _ in range(files):
+            yield make_record(rnd, i, publisher, now)
+            i += 1
+        p += 1
+
+
+def make_registry(size, files_per_publisher=3, seed=360, now=None):
+    return list(iter_registry(size, files_per_publisher, seed, now))
+
+
+def write_registry(f, nbytes, **kwargs):
+    # write a registry of about nbytes of JSON to a binary file object,
+    # one record at a time; returns the number of records
+    written = f.write(b'[')
+    size = 0
+    for r in iter_registry(**kwargs):
+        if written >= nbytes:
+            break
+        if size:
+            written += f.write(b', ')
+        written += f.write(json.dumps(r).encode('utf8'))
+        size += 1
+    f.write(b']')
+    return size
@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+
+# what changed between two registry stores. Records are matched by their
+# identifier, and a matched record has changed if its content hash has.
+# Positions are record ids: `added` and `changed` in the new store,
+# `removed` and `changed_from` in the previous one.
+
+
+class Changelog(object):
+
+    def __init__(self, previous, store, from_digest=None, to_digest=None):
+        self.from_digest = from_digest
+        self.to_digest = to_digest
+        self.created = time.time()
+
+        positions = {}
+        if previous is not None:
+            positions = {identifier: j for j, identifier in enumerate(previous.identifiers)}
+        added, changed, changed_from = [], [], []
+        for i, identifier in enumerate(store.identifiers):
+            j = positions.pop(identifier, None)
+            if j is None:
+                added.append(i)
+            elif previous.hashes[j] != store.hashes[i]:
+                changed.append(i)
+                changed_from.append(j)
+        self.added = np.array(added, dtype=np.int64)
+        self.changed = np.array(changed, dtype=np.int64)
+        self.changed_from = np.array(changed_from, dtype=np.int64)
+        self.removed = np.array(sorted(positions.values()), dtype=np.int64)
+        self.unchanged = store.size - len(self.added) - len(self.changed)
+
+        self._entries = {
+            "added": [self._entry(store, i) for i in self.added],
+            "changed": [self._entry(store, i) for i in self.changed],
+            "removed": [self._entry(previous, j) for j in self.removed],
+        }
+        # a changed record may have moved from another publisher
+        self._publishers = set(
+            e["publisher"] for entries in self._entries.values() for e in entries
+        )
+        self._publishers.update(previous.publishers[previous.publisher[j]] for j in self.changed_from)
+
+    def _entry(self, store, i):
+        return {
+            "identifier": store.identifiers[i],
+            "publisher": store.publishers[store.publisher[i]],
+        }
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    def __repr__(self):
+        return '<Changelog {}..{} added={} changed={} removed={}>'.format(
+            (self.from_digest or '')[:7], (self.to_digest or '')[:7],
+            len(self.added), len(self.changed), len(self.removed)
+        )
+
+    @property
+    def identifiers(self):
+        # identifiers of every record that was added, changed or removed
+        return set(e["identifier"] for entries in self._entries.values() for e in entries)
+
+    @property
+    def publishers(self):
+        # names of the publishers with any record added, changed or removed
+        return set(self._publishers)
+
+    def as_dict(self):
+        return dict(
+            from_digest=self.from_digest,
+            to_digest=self.to_digest,
+            created=self.created,
+            unchanged=self.unchanged,
+            **self._entries
+        )
@@ -0,0 +1,348 @@
+import collections.abc
+import hashlib
+import json
+import zlib
+
+import dateutil.parser
+import ijson
+import numpy as np
+
+# a compact, column-oriented copy of the registry. The scalar fields that
+# filtering and the statistics use are held in numpy arrays, repeated
+# strings are interned to small integer codes, field coverage is a bitset
+# per record, and the full record is only kept as compressed JSON for the
+# card view to decode when it needs it.
+
+
+# the parts of a registry entry that the dashboard shows; anything else in
+# the feed isn't kept
+RECORD_FIELDS = (
+    "identifier", "title", "publisher", "license", "license_name", "modified",
+    "distribution", "datagetter_metadata", "datagetter_aggregates",
+    "datagetter_coverage",
+)
+
+
+# interns strings to integer codes, in order of first appearance
+class StringTable(object):
+
+    def __init__(self, values=()):
+        self.values = []
+        self._codes = {}
+        for v in values:
+            self.code(v)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __contains__(self, value):
+        return value in self._codes
+
+    def code(self, value):
+        if value not in self._codes:
+            self._codes[value] = len(self.values)
+            self.values.append(value)
+        return self._codes[value]
+
+    def codes(self, values):
+        # codes for the values that are in the table; unknown values are
+        # dropped, as they can't match any record
+        return np.array([self._codes[v] for v in values if v in self._codes], dtype=np.int32)
+
+
+# the records of a store, decoded from their compressed JSON on access
+class RecordSequence(collections.abc.Sequence):
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store._blobs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        d = zlib.decompressobj(zdict=self._store._zdict)
+        blob = d.decompress(self._store._blobs[i]) + d.flush()
+        return json.loads(blob.decode('utf8'))
+
+
+# a sequence of byte strings packed end to end in one buffer, such as a
+# memory-mapped snapshot file
+class PackedSequence(collections.abc.Sequence):
+
+    def __init__(self, data, offsets, encoding=None):
+        self.data = data
+        self.offsets = offsets
+        self.encoding = encoding
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        value = self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+        if self.encoding:
+            return value.decode(self.encoding)
+        return value
+
+
+def pack(values):
+    # (offsets, data) for a list of byte strings
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in values], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(values), dtype=np.uint8)
+
+
+def parse_date(value, unit='D'):
+    if not value:
+        return np.datetime64('NaT', unit)
+    if unit == 'D':
+        return np.datetime64(value[:10], unit)
+    return np.datetime64(dateutil.parser.parse(value, ignoretz=True), unit)
+
+
+class RegistryStore(object):
+
+    # the numpy columns, as saved to and loaded from snapshot files
+    array_names = (
+        "hashes", "publisher", "licence", "filetype", "count", "recipients",
+        "funders", "min_award_date", "max_award_date", "modified",
+        "currency_offsets", "currency_code", "currency_amount",
+        "currency_count", "currency_record", "field_bits",
+    )
+    table_names = ("publishers", "licences", "filetypes", "currencies", "fields")
+
+    def __init__(self, fields=RECORD_FIELDS, previous=None):
+        self.record_fields = fields
+        self.previous = previous
+        self.reused = 0
+        self.size = 0
+        self.publishers = StringTable()
+        self.licences = StringTable()
+        self.filetypes = StringTable()
+        self.currencies = StringTable()
+        self.fields = StringTable()
+        self.licence_names = {}
+        self.identifiers = []
+        self.download_urls = []
+        self._blobs = []
+        self._zdict = b''
+        self.records = RecordSequence(self)
+
+        self._columns = collections.defaultdict(list)
+        self._currency_entries = []
+        self._field_bits = []
+        self._standard_fields = set()
+
+        if previous is not None:
+            # records that haven't changed since the previous store are
+            # copied from it rather than worked out again. Their compressed
+            # blobs are only valid with the same preset dictionary.
+            self._zdict = previous._zdict
+            self._previous_positions = {
+                identifier: i for i, identifier in enumerate(previous.identifiers)
+            }
+            self._field_translations = {}
+
+    # build the store one record at a time, then call finish()
+    def add(self, r):
+        if self.record_fields is not None:
+            r = {k: r[k] for k in self.record_fields if k in r}
+        blob = json.dumps(r, separators=(',', ':'), ensure_ascii=False).encode('utf8')
+        digest = hashlib.sha1(blob).digest()
+        if self.previous is not None:
+            j = self._previous_positions.get(r.get("identifier"))
+            # numpy drops trailing nul bytes from the hashes it hands back
+            if j is not None and self.previous.hashes[j] == digest.rstrip(b'\0'):
+                return self._copy_previous(j)
+
+        if not self._zdict:
+            # records share most of their keys and structure, so the first
+            # one makes a good preset dictionary for compressing the rest
+            self._zdict = blob[-32768:]
+        c = zlib.compressobj(zdict=self._zdict)
+        self._blobs.append(c.compress(blob) + c.flush())
+        self._columns["hash"].append(digest)
+        self.identifiers.append(r.get("identifier"))
+        self.download_urls.append((r.get("distribution") or [{}])[0].get("downloadURL"))
+
+        agg = r.get("datagetter_aggregates", {})
+        meta = r.get("datagetter_metadata", {})
+        columns = self._columns
+        columns["publisher"].append(self.publishers.code(r.get("publisher", {}).get("name")))
+        columns["licence"].append(self.licences.code(r.get("license", "")))
+        columns["filetype"].append(self.filetypes.code(meta.get("file_type")))
+        columns["count"].append(agg.get("count", 0))
+        columns["recipients"].append(agg.get("distinct_recipient_org_identifier_count", 0))
+        columns["funders"].append(agg.get("distinct_funding_org_identifier_count", 0))
+        columns["min_award_date"].append(parse_date(agg.get("min_award_date")))
+        columns["max_award_date"].append(parse_date(agg.get("max_award_date")))
+        columns["modified"].append(parse_date(r.get("modified"), 'us'))
+
+        currencies = agg.get("currencies", {})
+        columns["currency_entries"].append(len(currencies))
+        for c, cagg in currencies.items():
+            self._currency_entries.append((
+                self.currencies.code(c),
+                cagg.get("total_amount", 0),
+                cagg.get("count", 0),
+            ))
+
+        bits = 0
+        for f, field in r.get("datagetter_coverage", {}).items():
+            bits |= 1 << self.fields.code(f)
+            if field.get("standard"):
+                self._standard_fields.add(f)
+        self._field_bits.append(bits)
+
+        if not (r.get('license') and r.get('license') in self.licence_names):
+            self.licence_names[r.get('license')] = r.get('license_name')
+
+        self.size += 1
+
+    def _copy_previous(self, j):
+        # add record j of the previous store. Strings are looked up again,
+        # as codes are given in order of first appearance in this store.
+        previous = self.previous
+        self._blobs.append(previous._blobs[j])
+        self.identifiers.append(previous.identifiers[j])
+        self.download_urls.append(previous.download_urls[j])
+        columns = self._columns
+        columns["hash"].append(previous.hashes[j])
+        columns["publisher"].append(self.publishers.code(previous.publishers[previous.publisher[j]]))
+        licence = previous.licences[previous.licence[j]]
+        columns["licence"].append(self.licences.code(licence))
+        columns["filetype"].append(self.filetypes.code(previous.filetypes[previous.filetype[j]]))
+        for name in ("count", "recipients", "funders", "min_award_date", "max_award_date", "modified"):
+            columns[name].append(getattr(previous, name)[j])
+
+        start, end = previous.currency_offsets[j], previous.currency_offsets[j + 1]
+        columns["currency_entries"].append(end - start)
+        for e in range(start, end):
+            self._currency_entries.append((
+                self.currencies.code(previous.currencies[previous.currency_code[e]]),
+                previous.currency_amount[e],
+                previous.currency_count[e],
+            ))
+
+        # files from one publisher tend to share a pattern of fields, so
+        # each pattern is only translated to this store's codes once
+        old_bits = int.from_bytes(previous.field_bits[j].astype('<u8').tobytes(), 'little')
+        bits = self._field_translations.get(old_bits)
+        if bits is None:
+            bits = 0
+            remaining = old_bits
+            while remaining:
+                low = remaining & -remaining
+                f = previous.fields[low.bit_length() - 1]
+                bits |= 1 << self.fields.code(f)
+                if f in previous.standard_fields:
+                    self._standard_fields.add(f)
+                remaining ^= low
+            self._field_translations[old_bits] = bits
+        self._field_bits.append(bits)
+
+        # a missing licence is coded as "" but named under None
+        key = licence if licence or licence in previous.licence_names else None
+        if not (key and key in self.licence_names):
+            self.licence_names[key] = previous.licence_names.get(key)
+
+        self.reused += 1
+        self.size += 1
+
+    def finish(self):
+        columns = self._columns
+        self.hashes = np.array(columns["hash"], dtype='S20')
+        self.publisher = np.array(columns["publisher"], dtype=np.int32)
+        self.licence = np.array(columns["licence"], dtype=np.int16)
+        self.filetype = np.array(columns["filetype"], dtype=np.int16)
+        self.count = np.array(columns["count"], dtype=np.int64)
+        self.recipients = np.array(columns["recipients"], dtype=np.int64)
+        self.funders = np.array(columns["funders"], dtype=np.int64)
+        self.min_award_date = np.array(columns["min_award_date"], dtype='datetime64[D]')
+        self.max_award_date = np.array(columns["max_award_date"], dtype='datetime64[D]')
+        self.modified = np.array(columns["modified"], dtype='datetime64[us]')
+
+        # currency totals for record i are entries
+        # currency_offsets[i]:currency_offsets[i+1]
+        self.currency_offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(columns["currency_entries"], out=self.currency_offsets[1:])
+        entries = self._currency_entries
+        self.currency_code = np.array([e[0] for e in entries], dtype=np.int16)
+        self.currency_amount = np.array([e[1] for e in entries], dtype=np.float64)
+        self.currency_count = np.array([e[2] for e in entries], dtype=np.int64)
+        self.currency_record = np.repeat(
+            np.arange(self.size, dtype=np.int32), np.diff(self.currency_offsets)
+        )
+
+        # one bit per field in the registry, 64 to a word
+        words = max((len(self.fields) + 63) // 64, 1)
+        field_words = []
+        for bits in self._field_bits:
+            field_words.extend((bits >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for w in range(words))
+        self.field_bits = np.array(field_words, dtype=np.uint64).reshape(self.size, words)
+        self.standard_fields = set(self._standard_fields)
+
+        del self._columns, self._currency_entries, self._field_bits, self._standard_fields
+        if self.previous is not None:
+            del self.previous, self._previous_positions, self._field_translations
+        return self
+
+    def field_mask(self, codes):
+        # bit mask words with the given field codes set
+        bits = 0
+        for f in codes:
+            bits |= 1 << int(f)
+        return np.array([
+            (bits >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for w in range(self.field_bits.shape[1])
+        ], dtype=np.uint64)
+
+    def nbytes(self):
+        arrays = sum(
+            v.nbytes for v in vars(self).values() if isinstance(v, np.ndarray)
+        )
+        return arrays + sum(len(b) for b in self._blobs)
+
+    @classmethod
+    def from_columns(cls, arrays, tables, blobs, zdict, identifiers, download_urls,
+                     licence_names, standard_fields):
+        # a finished store from previously saved columns
+        store = cls.__new__(cls)
+        store.size = len(blobs)
+        for name in cls.array_names:
+            setattr(store, name, arrays[name])
+        for name in cls.table_names:
+            setattr(store, name, StringTable(tables[name]))
+        store._blobs = blobs
+        store._zdict = zdict
+        store.records = RecordSequence(store)
+        store.identifiers = identifiers
+        store.download_urls = download_urls
+        store.licence_names = dict(licence_names)
+        store.standard_fields = set(standard_fields)
+        return store
+
+
+def build_store(records, fields=RECORD_FIELDS, previous=None):
+    store = RegistryStore(fields=fields, previous=previous)
+    for r in records:
+        store.add(r)
+    return store.finish()
+
+
+def read_store(f, fields=RECORD_FIELDS, previous=None):
+    # build a store from a registry JSON file object, parsing one entry at
+    # a time so that the whole document is never held in memory. A document
+    # that is cut short or malformed is a ValueError, as from json.load.
+    try:
+        return build_store(ijson.items(f, 'item', use_float=True), fields=fields, previous=previous)
+    except ijson.JSONError as e:
+        raise ValueError('Could not parse registry: {}'.format(e)) from e
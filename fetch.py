@@ -0,0 +1,313 @@
+import collections
+import contextlib
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# a dedicated HTTP client for the registry feed. It keeps one pooled,
+# keep-alive session, streams the download, and revalidates against its
+# own cache store with conditional GETs, in place of a process-wide
+# requests_cache.
+
+CacheEntry = collections.namedtuple('CacheEntry', 'content etag last_modified stored')
+
+
+def encode_entry(entry):
+    meta = json.dumps({
+        "etag": entry.etag,
+        "last_modified": entry.last_modified,
+        "stored": entry.stored,
+    }).encode('utf8')
+    return meta + b'\n' + entry.content
+
+
+def decode_entry(value):
+    meta, content = value.split(b'\n', 1)
+    meta = json.loads(meta.decode('utf8'))
+    return CacheEntry(content, meta["etag"], meta["last_modified"], meta["stored"])
+
+
+@contextlib.contextmanager
+def atomic_file(location):
+    # write to a temporary file and rename it into place once complete
+    directory = os.path.dirname(location)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_location = '{}.{}.{}.tmp'.format(location, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_location, 'wb') as f:
+            yield f
+        os.replace(tmp_location, location)
+    finally:
+        if os.path.exists(tmp_location):
+            os.remove(tmp_location)
+
+
+class MemoryCache(object):
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        self._entries[key] = entry
+
+
+# one file per url, replaced atomically so readers in other processes see
+# either the old entry or the new one
+class FileCache(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def location(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self.location(key), 'rb') as f:
+                return decode_entry(f.read())
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set(self, key, entry):
+        with atomic_file(self.location(key)) as f:
+            f.write(encode_entry(entry))
+
+
+# entries in Redis, shared by every process that can reach it. Takes a
+# redis:// url, or any client with redis-py's get and set.
+class RedisCache(object):
+
+    prefix = 'registry-feed:'
+
+    def __init__(self, client, expire=None):
+        if isinstance(client, str):
+            import redis
+            client = redis.Redis.from_url(client)
+        self.client = client
+        self.expire = expire
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        try:
+            return decode_entry(value)
+        except (ValueError, KeyError):
+            return None
+
+    def set(self, key, entry):
+        self.client.set(self.prefix + key, encode_entry(entry), ex=self.expire)
+
+
+def make_cache(spec):
+    # "memory", "redis://host:port/db", or a directory for a FileCache
+    if not spec:
+        return None
+    if spec == 'memory':
+        return MemoryCache()
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCache(spec)
+    if spec.startswith('file://'):
+        spec = spec[len('file://'):]
+    return FileCache(spec)
+
+
+# count, total and longest time for named operations
+class Timings(object):
+
+    def __init__(self):
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            count, total, longest = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def timed(self, name):
+        return _Timer(self, name)
+
+    def summary(self):
+        with self._lock:
+            return {
+                name: {"count": count, "total": total, "max": longest}
+                for name, (count, total, longest) in self._timings.items()
+            }
+
+
+class _Timer(object):
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.timings.add(self.name, self.elapsed)
+
+
+# a response body as a file object, read from the network as the reader
+# asks for it and copied to any other files on the way through
+class ResponseBody(io.RawIOBase):
+
+    def __init__(self, chunks, copies=()):
+        self._chunks = chunks
+        self._copies = copies
+        self._pending = b''
+        self.wait_time = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._pending:
+            start = time.perf_counter()
+            chunk = next(self._chunks, b'')
+            self.wait_time += time.perf_counter() - start
+            for f in self._copies:
+                f.write(chunk)
+            self._pending = memoryview(chunk)
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+class FetchResult(object):
+
+    def __init__(self, content, etag=None, last_modified=None, not_modified=False,
+                 from_cache=False, fetch_time=0.0, parsed=None, parse_time=0.0):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+        self.from_cache = from_cache
+        self.fetch_time = fetch_time
+        self.parsed = parsed
+        self.parse_time = parse_time
+
+
+class FeedClient(object):
+
+    chunk_size = 1 << 16
+
+    def __init__(self, cache=None, pool_size=4, retries=2, timeout=60, max_age=None):
+        self.cache = cache
+        self.timeout = timeout
+        self.max_age = max_age
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.timings = Timings()
+
+    def close(self):
+        # drop pooled connections, which mustn't be shared with forked
+        # processes; the session opens new ones as needed
+        self.session.close()
+
+    # the feed at url. If the caller already holds the version with the
+    # given etag or last_modified and it hasn't changed, the result is
+    # not_modified and has no content.
+    #
+    # With parse, the body is handed to parse as a file object while it
+    # downloads, and the result is parsed rather than content; the raw body
+    # is only held in memory if there is a cache store to keep it in.
+    # save_to also keeps a copy of the body on disk.
+    def fetch(self, url, etag=None, last_modified=None, timeout=None, parse=None, save_to=None):
+        start = time.perf_counter()
+        entry = self.cache.get(url) if self.cache is not None else None
+        if entry is not None and self.max_age is not None \
+                and time.time() - entry.stored < self.max_age:
+            self.timings.add('cache_hit', time.perf_counter() - start)
+            return self._from_entry(entry, etag, last_modified, start, parse)
+
+        # revalidate the caller's copy if it has one, otherwise the cached one
+        if etag or last_modified or entry is None:
+            validators = (etag, last_modified)
+        else:
+            validators = (entry.etag, entry.last_modified)
+        headers = {}
+        if validators[0]:
+            headers['If-None-Match'] = validators[0]
+        if validators[1]:
+            headers['If-Modified-Since'] = validators[1]
+
+        with self.session.get(url, headers=headers, stream=True,
+                              timeout=timeout or self.timeout) as r:
+            self.timings.add('response', r.elapsed.total_seconds())
+            if r.status_code == 304 and headers:
+                self.timings.add('not_modified', time.perf_counter() - start)
+                if entry is not None and validators == (entry.etag, entry.last_modified):
+                    if self.max_age is not None:
+                        # only max_age reads the stored time
+                        entry = entry._replace(stored=time.time())
+                        self.cache.set(url, entry)
+                    return self._from_entry(entry, etag, last_modified, start, parse)
+                return FetchResult(None, etag, last_modified, not_modified=True,
+                                   fetch_time=time.perf_counter() - start)
+            r.raise_for_status()
+            with contextlib.ExitStack() as stack:
+                copies = []
+                if save_to:
+                    copies.append(stack.enter_context(atomic_file(save_to)))
+                if parse is not None and self.cache is not None:
+                    copies.append(io.BytesIO())
+                body = ResponseBody(r.iter_content(self.chunk_size), copies)
+                parse_start = time.perf_counter()
+                if parse is None:
+                    content = body.read()
+                    parsed = None
+                else:
+                    parsed = parse(io.BufferedReader(body, self.chunk_size))
+                    # anything after the end of the document still has to
+                    # reach the copies
+                    body.read()
+                    content = copies[-1].getvalue() if self.cache is not None else None
+                parse_time = time.perf_counter() - parse_start - body.wait_time
+            self.timings.add('download', body.wait_time)
+            result = FetchResult(
+                content,
+                etag=r.headers.get('ETag'),
+                last_modified=r.headers.get('Last-Modified'),
+                fetch_time=time.perf_counter() - start,
+                parsed=parsed,
+                parse_time=parse_time,
+            )
+        if self.cache is not None:
+            self.cache.set(url, CacheEntry(content, result.etag, result.last_modified, time.time()))
+        self.timings.add('fetch', result.fetch_time)
+        return result
+
+    def _from_entry(self, entry, etag, last_modified, start, parse=None):
+        # the cached copy, or not_modified if it's the version the caller has
+        not_modified = (etag and etag == entry.etag) or \
+            (not etag and last_modified and last_modified == entry.last_modified)
+        result = FetchResult(
+            None if not_modified else entry.content,
+            etag=entry.etag,
+            last_modified=entry.last_modified,
+            not_modified=bool(not_modified),
+            from_cache=True,
+        )
+        if parse is not None and not not_modified:
+            parse_start = time.perf_counter()
+            result.parsed = parse(io.BytesIO(entry.content))
+            result.parse_time = time.perf_counter() - parse_start
+        result.fetch_time = time.perf_counter() - start
+        return result
@@ -0,0 +1,116 @@
+import functools
+import numbers
+
+import babel
+import babel.numbers
+import dateutil.parser
+import humanize
+import humanize.number
+import inflect
+import numpy as np
+
+# shared formatting helpers. Engines, locales and number patterns are built
+# once at import, and results that only depend on a few distinct inputs
+# (plural forms, currency names, parsed dates) are memoized.
+
+_inflect = inflect.engine()
+_locale = babel.Locale.parse('en_UK')
+_humanized_pattern = babel.numbers.parse_pattern("¤#,##0.0")
+_whole_pattern = babel.numbers.parse_pattern("¤#,##0")
+_million = 10**6
+# the powers humanize.intword names, as floats for numpy to search
+_powers = np.array(humanize.number.powers, dtype=np.float64)
+
+
+@functools.lru_cache(maxsize=1024)
+def _plural(string, count):
+    return _inflect.plural(string, count)
+
+
+def pluralize(string, count):
+    # inflect only distinguishes a count of one from any other number
+    if isinstance(count, int) and not isinstance(count, bool):
+        return _plural(string, 1 if count == 1 else 2)
+    return _inflect.plural(string, count)
+
+
+@functools.lru_cache(maxsize=512)
+def currency_name(currency):
+    return babel.numbers.get_currency_name(currency)
+
+
+@functools.lru_cache(maxsize=512)
+def currency_symbol(currency):
+    return babel.numbers.get_currency_symbol(currency, _locale)
+
+
+def warm_up(currencies=('GBP',)):
+    # Babel reads its locale data from disk the first time it's used, so
+    # format something in each currency ahead of the first request
+    for currency in currencies:
+        currency_name(currency)
+        format_currency(_million, currency)
+        format_currency(1, currency)
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_datetime(value):
+    return dateutil.parser.parse(value, ignoretz=True)
+
+
+def format_currency(amount, currency='GBP', humanize_=True, int_format="{:,.0f}"):
+    # intword leaves anything under a million as a single word, so those
+    # amounts can skip it
+    if humanize_ and int(amount) >= _million:
+        amount_str = humanize.intword(amount).split(" ")
+        if len(amount_str) == 2:
+            return (
+                _humanized_pattern.apply(
+                    float(amount_str[0]),
+                    _locale,
+                    currency=currency,
+                    currency_digits=False,
+                ),
+                amount_str[1]
+            )
+
+    return (
+        _whole_pattern.apply(
+            amount,
+            _locale,
+            currency=currency,
+            currency_digits=False,
+        ),
+        ""
+    )
+
+
+def format_currencies(amounts, currency='GBP', humanize_=True):
+    # format_currency for many amounts in one currency, with the same
+    # results. The symbol is looked up once, and the amounts are truncated,
+    # matched to humanize's powers and scaled together, so all that's left
+    # for each one is Python's own number formatting. Babel's patterns,
+    # which it would otherwise go through twice for a large amount, round
+    # half to even like Python does for these one and no decimal places.
+    amounts = list(amounts)
+    symbol = currency_symbol(currency)
+    values = np.trunc(np.asarray(amounts, dtype=np.float64))
+    # powers[ordinal - 1] <= value < powers[ordinal]
+    ordinals = np.searchsorted(_powers, values, side='right')
+    humanized = (ordinals >= 1) & (ordinals < len(_powers)) & bool(humanize_)
+    chopped = values / _powers[np.maximum(ordinals - 1, 0)]
+
+    result = []
+    for amount, h, c, ordinal in zip(amounts, humanized.tolist(), chopped.tolist(), ordinals.tolist()):
+        if h:
+            # as intword rounds it, then to one place again as the pattern does
+            result.append((
+                '{}{:,.1f}'.format(symbol, float('%.1f' % c)),
+                humanize.number._(humanize.number.human_powers[ordinal - 1]),
+            ))
+        else:
+            # whole numbers exactly, however large
+            whole = '{:,}'.format(abs(int(amount))) if isinstance(amount, numbers.Integral) \
+                else '{:,.0f}'.format(abs(amount))
+            result.append(('{}{}{}'.format('-' if amount < 0 else '', symbol, whole), ''))
+    return result
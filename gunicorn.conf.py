@@ -0,0 +1,17 @@
+import os
+
+# gunicorn -c gunicorn.conf.py app:app.server
+#
+# imports the app once in the master, which loads the registry, its
+# indexes and the landing page before forking, so every worker starts
+# ready to serve and shares that memory copy-on-write. Each worker then
+# starts its own background threads, which don't survive a fork and which
+# importing the app doesn't start.
+
+os.environ.setdefault('PRELOAD', '1')
+preload_app = True
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background()
@@ -0,0 +1,369 @@
+import collections
+import datetime
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from aggregates import totals
+from columnar import StringTable
+from fetch import atomic_file
+
+# how the registry changes over time. Each new snapshot is summarised as
+# totals for the registry and per publisher (files, grants, the amount in
+# each currency, files using each field and files under each licence) and
+# appended to a directory of compressed numpy files, one per snapshot in a
+# directory for its day. Days that are over are compacted into a file for
+# the day, and months that are over into a file for the month.
+#
+# Publishers are only written when the changelog says their files changed;
+# a point written without a changelog to go on (the first in a process)
+# is a keyframe with every publisher in it. Queries forward fill from the
+# last row written for a publisher, so a year of hourly snapshots is a few
+# thousand rows to search.
+
+logger = logging.getLogger(__name__)
+
+STATS = ("files", "grants", "recipients", "funders")
+TABLES = ("publishers", "currencies", "fields", "licences")
+# the per-publisher and registry-wide columns for each table
+COLUMNS = {
+    "currencies": ("currency", "total_currency"),
+    "fields": ("field_files", "total_fields"),
+    "licences": ("licence_files", "total_licences"),
+}
+
+
+# points in time, each with the registry totals, and rows of publisher
+# totals at some of those points. Held in the same form on disk, whether
+# for one snapshot or a day of them, and in memory for querying.
+class HistoryChunk(object):
+
+    def __init__(self, arrays):
+        self.time = arrays["time"]
+        self.digest = arrays["digest"]
+        self.keyframe = arrays["keyframe"]
+        self.total = arrays["total"]
+        self.total_currency = arrays["total_currency"]
+        self.total_fields = arrays["total_fields"]
+        self.total_licences = arrays["total_licences"]
+        self.point = arrays["point"]
+        self.publisher = arrays["publisher"]
+        self.stats = arrays["stats"]
+        self.currency = arrays["currency"]
+        self.field_files = arrays["field_files"]
+        self.licence_files = arrays["licence_files"]
+        for name in TABLES:
+            setattr(self, name, StringTable(str(v) for v in arrays[name]))
+
+    @property
+    def size(self):
+        return len(self.time)
+
+    def arrays(self):
+        arrays = {name: np.array(getattr(self, name).values, dtype=str) for name in TABLES}
+        for name in (
+            "time", "digest", "keyframe", "total", "total_currency", "total_fields",
+            "total_licences", "point", "publisher", "stats", "currency", "field_files",
+            "licence_files",
+        ):
+            arrays[name] = getattr(self, name)
+        return arrays
+
+    def save(self, location):
+        with atomic_file(location) as f:
+            np.savez_compressed(f, **self.arrays())
+
+    @classmethod
+    def load(cls, location):
+        with np.load(location, allow_pickle=False) as f:
+            return cls({name: f[name] for name in f.files})
+
+    def only(self, publishers):
+        # the same point with just the rows for the named publishers, and
+        # empty rows for any of them no longer in the registry
+        names = [p for p in publishers if p in self.publishers]
+        missing = [p for p in publishers if p not in self.publishers]
+        keep = np.isin(self.publisher, self.publishers.codes(names))
+        arrays = self.arrays()
+        arrays["keyframe"] = np.zeros(self.size, dtype=bool)
+        for name in ("point", "publisher", "stats", "currency", "field_files", "licence_files"):
+            value = arrays[name][keep]
+            if missing:
+                empty = np.zeros((len(missing),) + value.shape[1:], dtype=value.dtype)
+                if name == "publisher":
+                    empty[:] = [self.publishers.code(p) for p in missing]
+                value = np.concatenate([value, empty])
+            arrays[name] = value
+        arrays["publishers"] = np.array(self.publishers.values, dtype=str)
+        return HistoryChunk(arrays)
+
+    # queries. start and end are datetimes, or None for no limit.
+
+    def points(self, start=None, end=None):
+        selected = np.ones(self.size, dtype=bool)
+        if start is not None:
+            selected &= self.time >= start.timestamp()
+        if end is not None:
+            selected &= self.time <= end.timestamp()
+        return np.flatnonzero(selected)
+
+    def times(self, points):
+        return [datetime.datetime.fromtimestamp(t) for t in self.time[points]]
+
+    def values(self, table, publisher=None, points=None):
+        # (names, points x names array) for "stats" or one of the tables,
+        # for the whole registry or one publisher. A publisher is NaN at
+        # points where it wasn't in the registry.
+        if points is None:
+            points = np.arange(self.size)
+        if table == "stats":
+            names, rows, totals_ = STATS, self.stats, self.total
+        else:
+            names = getattr(self, table).values
+            rows, totals_ = (getattr(self, c) for c in COLUMNS[table])
+        if publisher is None:
+            return names, totals_[points].astype(np.float64)
+        if publisher not in self.publishers:
+            return names, np.full((len(points), len(names)), np.nan)
+
+        found = np.flatnonzero(self.publisher == self.publishers.code(publisher))
+        changes = self.point[found]
+        values = rows[found].astype(np.float64)
+        values[self.stats[found, 0] == 0] = np.nan
+        # a keyframe without a row means the publisher had gone
+        gone = np.setdiff1d(np.flatnonzero(self.keyframe), changes)
+        changes = np.concatenate([changes, gone])
+        values = np.concatenate([values, np.full((len(gone), len(names)), np.nan)])
+        order = np.argsort(changes, kind='stable')
+        changes, values = changes[order], values[order]
+
+        last = np.searchsorted(changes, points, side='right') - 1
+        result = values[np.maximum(last, 0)] if len(values) else np.full((len(points), len(names)), np.nan)
+        result[last < 0] = np.nan
+        return names, result
+
+    def series(self, metric, key=None, publisher=None, start=None, end=None):
+        # (times, values) of one statistic, or of one currency, field or
+        # licence when metric is a table and key names the entry
+        points = self.points(start, end)
+        table, name = ("stats", metric) if key is None else (metric, key)
+        names, values = self.values(table, publisher, points)
+        if name not in names:
+            return self.times(points), np.zeros(len(points))
+        return self.times(points), values[:, list(names).index(name)]
+
+    def publisher_names(self):
+        # publishers with a row in the history
+        return sorted(self.publishers[p] for p in np.unique(self.publisher))
+
+
+def empty_arrays():
+    return {
+        "time": np.zeros(0), "digest": np.zeros(0, dtype='S40'),
+        "keyframe": np.zeros(0, dtype=bool), "total": np.zeros((0, len(STATS)), dtype=np.int64),
+        "total_currency": np.zeros((0, 0)), "total_fields": np.zeros((0, 0), dtype=np.int64),
+        "total_licences": np.zeros((0, 0), dtype=np.int64),
+        "point": np.zeros(0, dtype=np.int32), "publisher": np.zeros(0, dtype=np.int32),
+        "stats": np.zeros((0, len(STATS)), dtype=np.int64), "currency": np.zeros((0, 0)),
+        "field_files": np.zeros((0, 0), dtype=np.int32),
+        "licence_files": np.zeros((0, 0), dtype=np.int32),
+        "publishers": np.zeros(0, dtype=str), "currencies": np.zeros(0, dtype=str),
+        "fields": np.zeros(0, dtype=str), "licences": np.zeros(0, dtype=str),
+    }
+
+
+def summarise(snapshot, when=None):
+    # a keyframe for one snapshot, with a row for every publisher
+    store = snapshot.store
+    agg = snapshot.publisher_aggregates
+    npublishers = len(store.publishers)
+    whole = totals(store)
+
+    field_files = snapshot.index.field_coverage().astype(np.int32)
+    nlicences = len(store.licences)
+    licence_files = np.bincount(
+        store.publisher.astype(np.int64) * nlicences + store.licence,
+        minlength=npublishers * nlicences,
+    ).reshape(npublishers, nlicences).astype(np.int32)
+    stats = np.stack([agg.files, agg.count, agg.recipients, agg.funders], axis=1).astype(np.int64)
+
+    return HistoryChunk({
+        "time": np.array([time.time() if when is None else when]),
+        "digest": np.array([snapshot.digest], dtype='S40'),
+        "keyframe": np.ones(1, dtype=bool),
+        "total": np.array([[whole.files[0], whole.count[0], whole.recipients[0], whole.funders[0]]], dtype=np.int64),
+        "total_currency": whole.currency_total[:1].astype(np.float64),
+        "total_fields": field_files.sum(axis=0, dtype=np.int64)[np.newaxis],
+        "total_licences": licence_files.sum(axis=0, dtype=np.int64)[np.newaxis],
+        "point": np.zeros(npublishers, dtype=np.int32),
+        "publisher": np.arange(npublishers, dtype=np.int32),
+        "stats": stats,
+        "currency": agg.currency_total.astype(np.float64),
+        "field_files": field_files,
+        "licence_files": licence_files,
+        "publishers": np.array([p or '' for p in store.publishers], dtype=str),
+        "currencies": np.array(store.currencies.values, dtype=str),
+        "fields": np.array(store.fields.values, dtype=str),
+        "licences": np.array(store.licences.values, dtype=str),
+    })
+
+
+def merge(chunks):
+    # one chunk with the points of all of them, in time order, and their
+    # strings in one set of tables
+    chunks = [c for c in chunks if c.size]
+    if not chunks:
+        return HistoryChunk(empty_arrays())
+    tables = {name: StringTable() for name in TABLES}
+    remaps = []
+    for c in chunks:
+        remaps.append({
+            name: np.array([tables[name].code(v) for v in getattr(c, name)], dtype=np.int32)
+            for name in TABLES
+        })
+
+    def widen(values, remap, name):
+        # values with columns in the merged table's order
+        result = np.zeros((len(values), len(tables[name])), dtype=values.dtype)
+        if len(remap):
+            result[:, remap] = values
+        return result
+
+    arrays = {name: np.array(tables[name].values, dtype=str) for name in TABLES}
+    offsets = np.cumsum([0] + [c.size for c in chunks])
+    parts = {}
+    for c, remap, offset in zip(chunks, remaps, offsets):
+        add = lambda name, value: parts.setdefault(name, []).append(value)
+        add("time", c.time)
+        add("digest", c.digest)
+        add("keyframe", c.keyframe)
+        add("total", c.total)
+        add("point", c.point + offset)
+        add("publisher", remap["publishers"][c.publisher] if len(c.publisher) else c.publisher)
+        add("stats", c.stats)
+        for table, (rows, whole) in COLUMNS.items():
+            add(whole, widen(getattr(c, whole), remap[table], table))
+            add(rows, widen(getattr(c, rows), remap[table], table))
+    for name, values in parts.items():
+        arrays[name] = np.concatenate(values)
+
+    # points in time order, without any that were in two of the chunks
+    # (if compacting was interrupted), and rows in the order of their points
+    order = np.argsort(arrays["time"], kind='stable')
+    times, digests = arrays["time"][order], arrays["digest"][order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (times[1:] != times[:-1]) | (digests[1:] != digests[:-1])
+    order = order[first]
+    for name in ("time", "digest", "keyframe", "total", "total_currency", "total_fields", "total_licences"):
+        arrays[name] = arrays[name][order]
+    position = np.full(len(first), -1, dtype=np.int32)
+    position[order] = np.arange(len(order), dtype=np.int32)
+    arrays["point"] = position[arrays["point"]]
+    rows = np.argsort(arrays["point"], kind='stable')
+    rows = rows[arrays["point"][rows] >= 0]
+    for name in ("point", "publisher", "stats", "currency", "field_files", "licence_files"):
+        arrays[name] = arrays[name][rows]
+    return HistoryChunk(arrays)
+
+
+# the history on disk: directory/YYYY-MM-DD/<time>-<digest>.npz for each
+# snapshot, directory/YYYY-MM-DD.npz once a day is compacted and
+# directory/YYYY-MM.npz once a month is. Only one process should append;
+# any number can read.
+class HistoryStore(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.last_digest = None
+        self._index = None
+        self._loaded = set()
+        self._lock = threading.Lock()
+
+    def append(self, snapshot, when=None):
+        if snapshot.digest == self.last_digest:
+            return None
+        chunk = summarise(snapshot, when)
+        changelog = snapshot.changelog
+        if self.last_digest is not None and changelog is not None and changelog.from_digest == self.last_digest:
+            chunk = chunk.only(sorted(p or '' for p in changelog.publishers))
+        location = self.write(chunk)
+        self.last_digest = snapshot.digest
+        self.compact()
+        return location
+
+    def write(self, chunk):
+        when = datetime.datetime.utcfromtimestamp(chunk.time[0])
+        location = os.path.join(
+            self.directory, when.strftime('%Y-%m-%d'),
+            '{}-{}.npz'.format(when.strftime('%H%M%S%f'), chunk.digest[0].decode('ascii')[:12]),
+        )
+        chunk.save(location)
+        return location
+
+    def compact(self, today=None):
+        # merge the snapshots of each day before today (in UTC) into one
+        # file for the day, and the days of each month before this one into
+        # one for the month
+        today = today or datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        if not os.path.isdir(self.directory):
+            return
+        for day in sorted(os.listdir(self.directory)):
+            directory = os.path.join(self.directory, day)
+            if day >= today[:10] or not os.path.isdir(directory):
+                continue
+            paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+            self._merge_into(directory + '.npz', [p for p in paths if p.endswith('.npz')])
+            shutil.rmtree(directory)
+
+        days = collections.defaultdict(list)
+        for name in sorted(os.listdir(self.directory)):
+            if len(name) == len('YYYY-MM-DD.npz') and name.endswith('.npz') and name[:7] < today[:7]:
+                days[name[:7]].append(os.path.join(self.directory, name))
+        for month, paths in sorted(days.items()):
+            self._merge_into(os.path.join(self.directory, month + '.npz'), paths)
+            for p in paths:
+                os.remove(p)
+
+    def _merge_into(self, location, paths):
+        if os.path.exists(location):
+            paths = [location] + paths
+        merge([HistoryChunk.load(p) for p in paths]).save(location)
+
+    def paths(self):
+        if not os.path.isdir(self.directory):
+            return []
+        paths = []
+        for name in sorted(os.listdir(self.directory)):
+            location = os.path.join(self.directory, name)
+            if name.endswith('.npz'):
+                paths.append(location)
+            elif os.path.isdir(location):
+                paths.extend(
+                    os.path.join(location, n) for n in sorted(os.listdir(location)) if n.endswith('.npz')
+                )
+        return paths
+
+    def index(self):
+        # everything on disk, merged for querying. New files are merged into
+        # what was loaded before; if a day has been compacted since, the
+        # whole history is loaded again.
+        paths = self.paths()
+        with self._lock:
+            current = set(paths)
+            if self._index is None or not self._loaded <= current:
+                self._index, self._loaded = None, set()
+            new = [p for p in paths if p not in self._loaded]
+            if new or self._index is None:
+                chunks = [] if self._index is None else [self._index]
+                for p in new:
+                    try:
+                        chunks.append(HistoryChunk.load(p))
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning('Could not read history from %s: %s', p, e)
+                self._index = merge(chunks)
+                self._loaded.update(new)
+            return self._index
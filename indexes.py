@@ -0,0 +1,308 @@
+import base64
+import collections
+import datetime
+import json
+import threading
+
+import numpy as np
+
+LAST_MODIFIED_DAYS = {
+    "lastmonth": 30,
+    "6month": 30*6,
+    "12month": 365,
+}
+# "fields" matches files with any of the fields, "fields_all" files with
+# all of them and "fields_none" files with none of them
+LIST_FILTERS = ("licence", "currency", "filetype", "fields", "fields_all", "fields_none")
+
+
+def normalise_filters(filters):
+    # filters in one canonical form, leaving out any that have no effect,
+    # so that equivalent filters give the same key
+    normalised = {}
+    if filters.get("search"):
+        normalised["search"] = filters["search"].lower()
+    if filters.get("last_modified") in LAST_MODIFIED_DAYS:
+        normalised["last_modified"] = filters["last_modified"]
+    for name in LIST_FILTERS:
+        values = filters.get(name)
+        if isinstance(values, str):
+            values = [values]
+        values = sorted(set(v for v in values or () if v))
+        # "__all" is the dropdowns' way of saying no filter
+        if values and "__all" not in values:
+            normalised[name] = values
+    return normalised
+
+
+def filter_key(filters):
+    return json.dumps(normalise_filters(filters), sort_keys=True, separators=(',', ':'))
+
+
+def filter_time(filters):
+    # the time to filter last_modified against, to the minute, so that
+    # results for the same filters can be shared within that minute
+    if filters.get("last_modified") in LAST_MODIFIED_DAYS:
+        return datetime.datetime.now().replace(second=0, microsecond=0)
+    return None
+
+
+def encode_array(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+# substring search over short texts such as publisher names. Every 1, 2 and
+# 3 character gram points at a sorted array of the texts containing it, so
+# a query only has to check the texts that share all of its trigrams.
+# Results for recent queries are kept so that typing one more character
+# narrows the previous result rather than starting again.
+class SearchIndex(object):
+
+    gram_size = 3
+    empty = np.zeros(0, dtype=np.int32)
+
+    def __init__(self, texts, recent_queries=64):
+        self.texts = [(text or "").lower() for text in texts]
+        self.recent_queries = recent_queries
+        self._recent = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        grams = {}
+        for t, text in enumerate(self.texts):
+            for n in range(1, self.gram_size + 1):
+                for j in range(len(text) - n + 1):
+                    grams.setdefault(text[j:j+n], set()).add(t)
+        self.grams = {
+            g: np.array(sorted(ts), dtype=np.int32) for g, ts in grams.items()
+        }
+
+    def _candidates(self, query):
+        # narrow from the longest recent query that this one extends
+        for end in range(len(query) - 1, 0, -1):
+            previous = self._recent.get(query[:end])
+            if previous is not None:
+                return previous
+
+        postings = sorted(
+            (self.grams.get(query[j:j+self.gram_size], self.empty)
+             for j in range(len(query) - self.gram_size + 1)),
+            key=len
+        )
+        candidates = postings[0]
+        for p in postings[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, p, assume_unique=True)
+        return candidates
+
+    # positions of the texts containing query
+    def search(self, query):
+        query = query.lower()
+        # queries no longer than a gram are answered by the gram itself
+        if len(query) <= self.gram_size:
+            return self.grams.get(query, self.empty)
+
+        with self._lock:
+            matches = self._recent.get(query)
+            if matches is not None:
+                self._recent.move_to_end(query)
+                return matches
+            candidates = self._candidates(query)
+
+        matches = np.array(
+            [t for t in candidates if query in self.texts[t]], dtype=np.int32
+        )
+        with self._lock:
+            self._recent[query] = matches
+            while len(self._recent) > self.recent_queries:
+                self._recent.popitem(last=False)
+        return matches
+
+
+# filters over a RegistryStore. Each active filter becomes a boolean mask
+# over the records, worked out from the store's code arrays and field
+# bitsets, and the masks are and-ed together. Record ids are positions in
+# the registry, so the matching ids come out in registry order.
+class RegistryIndex(object):
+
+    def __init__(self, store, search_titles=False, previous=None):
+        self.store = store
+        self.size = store.size
+        self._field_matrix = None
+
+        if previous is not None and not search_titles and previous.search_by_publisher \
+                and previous.store.publishers.values == store.publishers.values:
+            # the same publishers, with the same codes
+            self.search_index = previous.search_index
+            self.search_by_publisher = True
+        elif search_titles:
+            # the separator can't appear in a search box query, so a match
+            # never spans the publisher name and the title
+            self.search_index = SearchIndex(
+                "{}\n{}".format(store.publishers[p] or "", r.get("title") or "")
+                for p, r in zip(store.publisher, store.records)
+            )
+            self.search_by_publisher = False
+        else:
+            self.search_index = SearchIndex(store.publishers)
+            self.search_by_publisher = True
+
+    def any_of(self, codes, values):
+        return np.isin(codes, values)
+
+    def any_currency(self, currencies):
+        mask = np.zeros(self.size, dtype=bool)
+        entries = np.isin(self.store.currency_code, self.store.currencies.codes(currencies))
+        mask[self.store.currency_record[entries]] = True
+        return mask
+
+    def any_field(self, fields):
+        field_mask = self.store.field_mask(self.store.fields.codes(fields))
+        return ((self.store.field_bits & field_mask) != 0).any(axis=1)
+
+    def all_fields(self, fields):
+        codes = self.store.fields.codes(fields)
+        if len(codes) < len(set(fields)):
+            # no file has a field that isn't in the registry
+            return np.zeros(self.size, dtype=bool)
+        field_mask = self.store.field_mask(codes)
+        return ((self.store.field_bits & field_mask) == field_mask).all(axis=1)
+
+    def no_fields(self, fields):
+        field_mask = self.store.field_mask(self.store.fields.codes(fields))
+        return ((self.store.field_bits & field_mask) == 0).all(axis=1)
+
+    @property
+    def field_matrix(self):
+        # a files x fields boolean matrix of the field bitsets, unpacked
+        # once. unpackbits puts the high bit of each byte first, so the
+        # columns are put back in field code order.
+        if self._field_matrix is None:
+            store = self.store
+            nbytes = store.field_bits.shape[1] * 8
+            unpacked = np.unpackbits(
+                np.ascontiguousarray(store.field_bits, dtype='<u8').view(np.uint8).reshape(self.size, nbytes),
+                axis=1,
+            )
+            f = np.arange(len(store.fields))
+            self._field_matrix = unpacked[:, (f // 8) * 8 + 7 - f % 8].astype(bool)
+        return self._field_matrix
+
+    def field_coverage(self, ids=None):
+        # a publishers x fields count of the files with each field, for
+        # all the files or just ids
+        store = self.store
+        matrix = self.field_matrix if ids is None else self.field_matrix[ids]
+        publishers = store.publisher if ids is None else store.publisher[ids]
+        files, fields = np.nonzero(matrix)
+        nfields = len(store.fields)
+        shape = (len(store.publishers), nfields)
+        return np.bincount(
+            publishers[files].astype(np.int64) * nfields + fields, minlength=shape[0] * shape[1]
+        ).reshape(shape)
+
+    def coverage(self, ids=None, fields=None):
+        # (publisher codes, their files, fields, publishers x fields
+        # percentage of files with each field) for the publishers with
+        # any of ids, most files first. fields defaults to the standard
+        # fields, in order.
+        store = self.store
+        if fields is None:
+            fields = sorted(store.standard_fields)
+        fields = [f for f in fields if f in store.fields]
+        publishers = store.publisher if ids is None else store.publisher[ids]
+        files = np.bincount(publishers, minlength=len(store.publishers))
+        codes = np.flatnonzero(files)
+        codes = codes[np.argsort(-files[codes], kind='stable')]
+        counts = self.field_coverage(ids)[np.ix_(codes, store.fields.codes(fields))]
+        return codes, files[codes], fields, counts * 100.0 / files[codes, np.newaxis]
+
+    def modified_since(self, since):
+        # records without a modified date are NaT, which never compares true
+        return self.store.modified >= np.datetime64(since, 'us')
+
+    def search(self, search):
+        matches = self.search_index.search(search)
+        if self.search_by_publisher:
+            return np.isin(self.store.publisher, matches)
+        mask = np.zeros(self.size, dtype=bool)
+        mask[matches] = True
+        return mask
+
+    def filter_mask(self, filters, now=None):
+        store = self.store
+        mask = np.ones(self.size, dtype=bool)
+        if filters.get("licence"):
+            mask &= self.any_of(store.licence, store.licences.codes(filters["licence"]))
+        if filters.get("last_modified") in LAST_MODIFIED_DAYS:
+            now = now or datetime.datetime.now()
+            mask &= self.modified_since(
+                now - datetime.timedelta(days=LAST_MODIFIED_DAYS[filters["last_modified"]])
+            )
+        if filters.get("currency"):
+            mask &= self.any_currency(filters["currency"])
+        if filters.get("filetype"):
+            mask &= self.any_of(store.filetype, store.filetypes.codes(filters["filetype"]))
+        if filters.get("fields"):
+            mask &= self.any_field(filters["fields"])
+        if filters.get("fields_all"):
+            mask &= self.all_fields(filters["fields_all"])
+        if filters.get("fields_none"):
+            mask &= self.no_fields(filters["fields_none"])
+        if filters.get("search"):
+            mask &= self.search(filters["search"])
+        return mask
+
+    def filter(self, filters, now=None):
+        return np.flatnonzero(self.filter_mask(filters, now=now))
+
+    # the columns that filtering uses, as base64 little-endian typed arrays
+    # beside their string tables, for filtering in the browser with
+    # assets/client_filtering.js. Modified times are seconds since the
+    # epoch, NaN where there isn't one; field bitsets are split into 32 bit
+    # words.
+    def compact(self):
+        store = self.store
+        modified = store.modified.astype(np.int64) / 1e6
+        modified[np.isnat(store.modified)] = np.nan
+        field_bits = np.ascontiguousarray(store.field_bits, dtype='<u8').view('<u4')
+        return {
+            "size": self.size,
+            "last_modified_days": LAST_MODIFIED_DAYS,
+            "publisher": encode_array(store.publisher, '<i4'),
+            "licences": list(store.licences),
+            "licence": encode_array(store.licence, '<i4'),
+            "filetypes": list(store.filetypes),
+            "filetype": encode_array(store.filetype, '<i4'),
+            "currencies": list(store.currencies),
+            "currency_record": encode_array(store.currency_record, '<i4'),
+            "currency_code": encode_array(store.currency_code, '<i4'),
+            "fields": list(store.fields),
+            "field_words": field_bits.shape[1],
+            "field_bits": encode_array(field_bits, '<u4'),
+            "modified": encode_array(modified, '<f8'),
+            "search_texts": self.search_index.texts,
+            "search_by_publisher": self.search_by_publisher,
+        }
+
+    def from_bitset(self, value):
+        # the ids set in a base64 bitset of records, first record in the
+        # high bit of the first byte; None if it isn't a bitset of this index
+        try:
+            bits = np.frombuffer(base64.b64decode(value), dtype=np.uint8)
+        except (ValueError, TypeError):
+            return None
+        if len(bits) != (self.size + 7) // 8:
+            return None
+        return np.flatnonzero(np.unpackbits(bits)[:self.size])
+
+    def group_by_publisher(self, ids):
+        # split ids into one array per publisher, with publishers in the
+        # order they first appear
+        ids = np.asarray(ids)
+        codes = self.store.publisher[ids]
+        order = np.argsort(codes, kind='stable')
+        _, starts = np.unique(codes[order], return_index=True)
+        groups = np.split(ids[order], starts[1:]) if len(ids) else []
+        groups.sort(key=lambda g: g[0])
+        return [(self.store.publishers[self.store.publisher[g[0]]], g) for g in groups]
@@ -0,0 +1,256 @@
+import collections
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+
+import flask
+
+from fetch import Timings
+
+# where requests spend their time. Named stages are timed across the
+# process and per request; the totals go to a Prometheus /metrics page and
+# each request's can go back in a Server-Timing header. Slow requests can
+# also be profiled by sampling their stacks.
+
+stages = Timings()
+requests = Timings()
+payload_sizes = Timings()
+
+
+def request_stages():
+    # stage name: seconds spent in it by this request so far
+    if not flask.has_request_context():
+        return {}
+    if 'stages' not in flask.g:
+        flask.g.stages = collections.OrderedDict()
+    return flask.g.stages
+
+
+def record(name, seconds):
+    stages.add(name, seconds)
+    if flask.has_request_context():
+        current = request_stages()
+        current[name] = current.get(name, 0.0) + seconds
+
+
+def note(name, description):
+    # something about this request for its Server-Timing header, such as
+    # whether a cache had the answer
+    if flask.has_request_context():
+        if 'notes' not in flask.g:
+            flask.g.notes = collections.OrderedDict()
+        flask.g.notes[name] = description
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_dash_callback(func, name):
+    # dash's wrapper round a callback runs it, traced as name, and then
+    # serialises what it returned; the rest of the time is serialisation
+    @functools.wraps(func)
+    def wrapper(*args):
+        start = time.perf_counter()
+        before = request_stages().get(name, 0.0)
+        result = func(*args)
+        own = request_stages().get(name, 0.0) - before
+        record('serialise', time.perf_counter() - start - own)
+        return result
+    return wrapper
+
+
+def endpoint_name(dash_prefix):
+    # a label for the request with a bounded set of values: the url rule,
+    # and the output for dash's callbacks
+    request = flask.request
+    if request.url_rule is None:
+        return 'other'
+    if request.path == dash_prefix + '_dash-update-component':
+        body = request.get_json(silent=True) or {}
+        return '{}:{}'.format(request.url_rule.rule, body.get('output'))
+    return request.url_rule.rule
+
+
+def server_timing(total):
+    timings = list(request_stages().items()) + [('total', total)]
+    parts = ['{};dur={:.2f}'.format(name, seconds * 1000) for name, seconds in timings]
+    notes = flask.g.get('notes') or {}
+    parts.extend('{};desc="{}"'.format(name, desc) for name, desc in notes.items())
+    return ', '.join(parts)
+
+
+# samples the stacks of threads serving requests, and writes the samples
+# for any request slower than threshold seconds to directory in the folded
+# format ("outer;inner;innermost count" per line) that flamegraph.pl and
+# speedscope read
+class SlowRequestProfiler(object):
+
+    def __init__(self, threshold, directory, interval=0.005):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.written = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = (time.perf_counter(), collections.Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def end(self, name):
+        with self._lock:
+            started = self._active.pop(threading.get_ident(), None)
+        if started is None:
+            return None
+        start, samples = started
+        elapsed = time.perf_counter() - start
+        if elapsed < self.threshold or not samples:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        location = os.path.join(self.directory, '{}-{}-{:.0f}ms.folded'.format(
+            time.strftime('%Y%m%dT%H%M%S'), name.strip('/').replace('/', '_').replace(':', '_') or 'index',
+            elapsed * 1000))
+        with open(location, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        self.written += 1
+        return location
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, (_, samples) in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[fold(frame)] += 1
+
+
+def fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+def instrument(server, dash_prefix, server_timing_header=False, profiler=None):
+    # time every request, add Server-Timing if asked to, and profile slow
+    # requests if there's a profiler. Install before any before_request
+    # hook that can answer a request itself, so those are timed too.
+    @server.before_request
+    def start_request():
+        flask.g.request_start = time.perf_counter()
+        if profiler is not None:
+            profiler.begin()
+
+    @server.after_request
+    def finish_request(response):
+        start = flask.g.get('request_start')
+        if start is None:
+            return response
+        name = endpoint_name(dash_prefix)
+        elapsed = time.perf_counter() - start
+        requests.add(name, elapsed)
+        if not response.is_streamed:
+            payload_sizes.add(name, response.calculate_content_length() or 0)
+        if server_timing_header:
+            response.headers['Server-Timing'] = server_timing(elapsed)
+        if profiler is not None:
+            profiler.end(name)
+        return response
+
+
+def metrics_text(caches=None, snapshot=None, fetch_timings=None, lock_timings=None):
+    # the Prometheus text exposition format
+    lines = []
+
+    def family(name, kind, help_, samples):
+        lines.append('# HELP {} {}'.format(name, help_))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for suffix, labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels.items())
+            lines.append('{}{}{} {}'.format(
+                name, suffix, '{' + label_text + '}' if label_text else '', format_value(value)))
+
+    def timings_family(name, help_, timings, label):
+        summary = timings.summary()
+        family(name, 'summary', help_, [
+            (suffix, {label: key}, t[field])
+            for key, t in sorted(summary.items())
+            for suffix, field in (('_count', 'count'), ('_sum', 'total'))
+        ])
+        family(name + '_max', 'gauge', help_.rstrip('.') + ', the largest seen.', [
+            ('', {label: key}, t['max']) for key, t in sorted(summary.items())
+        ])
+
+    timings_family('dashboard_request_seconds', 'Time to answer requests.', requests, 'endpoint')
+    timings_family('dashboard_response_bytes', 'Size of response bodies.', payload_sizes, 'endpoint')
+    timings_family('dashboard_stage_seconds', 'Time spent in each stage of a request.', stages, 'stage')
+    if fetch_timings is not None:
+        timings_family('dashboard_registry_fetch_seconds', 'Time fetching the registry feed.',
+                       fetch_timings, 'operation')
+    if lock_timings is not None:
+        timings_family('dashboard_registry_lock_seconds', 'Time waiting for the registry.',
+                       lock_timings, 'operation')
+
+    if caches:
+        stats = {name: c.stats() for name, c in sorted(caches.items())}
+        for key, kind, help_ in [
+            ('hits', 'counter', 'Lookups answered by the cache.'),
+            ('misses', 'counter', 'Lookups the cache could not answer.'),
+            ('evictions', 'counter', 'Entries dropped to stay within limits.'),
+            ('expirations', 'counter', 'Entries dropped for being too old.'),
+            ('size', 'gauge', 'Entries in the cache.'),
+            ('bytes', 'gauge', 'Size of the entries in the cache.'),
+        ]:
+            name = 'dashboard_cache_{}{}'.format(key, '_total' if kind == 'counter' else '')
+            family(name, kind, help_, [
+                ('', {'cache': c}, s[key]) for c, s in stats.items() if s.get(key) is not None
+            ])
+
+    if snapshot is not None:
+        family('dashboard_registry_records', 'gauge', 'Records in the registry.', [
+            ('', {}, snapshot.store.size)])
+        family('dashboard_registry_age_seconds', 'gauge', 'Time since the registry was last checked.', [
+            ('', {}, snapshot.age)])
+        family('dashboard_registry_load_seconds', 'gauge', 'Time the current registry took to load.', [
+            ('', {'stage': 'fetch'}, snapshot.fetch_time or 0),
+            ('', {'stage': 'parse'}, snapshot.parse_time or 0),
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
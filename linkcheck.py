@@ -0,0 +1,275 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+import urllib.parse
+
+from requests.utils import requote_uri
+
+from fetch import atomic_file
+
+# checks that each file's download link works, rather than relying on what
+# the datagetter found on its last run. Links are checked concurrently
+# with asyncio, with a limit on requests in flight overall and, for each
+# host, on requests in flight and their rate. Each check is a HEAD, or a
+# GET for the first byte if the server won't answer HEAD, and only the
+# response headers are read.
+
+logger = logging.getLogger(__name__)
+
+LinkResult = collections.namedtuple(
+    'LinkResult', 'url status ok content_length latency checked error final_url')
+
+USER_AGENT = '360Giving-Dashboard-linkcheck'
+MAX_REDIRECTS = 5
+MAX_HEADERS = 100
+# statuses from servers that don't support HEAD, or refuse it
+HEAD_REFUSED = (403, 405, 501)
+
+
+class HTTPError(Exception):
+    pass
+
+
+# per host limits on requests in flight and on how often one can start
+class HostLimits(object):
+
+    def __init__(self, concurrency=4, rate=None):
+        self.concurrency = concurrency
+        self.rate = rate
+        self._hosts = {}
+
+    async def acquire(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = [asyncio.Semaphore(self.concurrency), 0.0]
+        state = self._hosts[host]
+        await state[0].acquire()
+        if self.rate:
+            now = asyncio.get_event_loop().time()
+            start = max(now, state[1])
+            state[1] = start + 1.0 / self.rate
+            if start > now:
+                await asyncio.sleep(start - now)
+
+    def release(self, host):
+        self._hosts[host][0].release()
+
+
+async def request_head(url, method='HEAD', headers=None, ssl_context=None):
+    # (status, headers) for url, without reading the body
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise HTTPError('not an http url')
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port,
+        ssl=(ssl_context or ssl.create_default_context()) if secure else None,
+        server_hostname=parts.hostname if secure else None,
+    )
+    try:
+        # links in the registry are as publishers wrote them, often with
+        # spaces or other characters a server won't take unquoted
+        target = requote_uri(urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, '')))
+        lines = [
+            '{} {} HTTP/1.1'.format(method, target),
+            'Host: {}'.format(parts.netloc.rsplit('@', 1)[-1]),
+            'User-Agent: {}'.format(USER_AGENT),
+            'Accept: */*',
+            'Connection: close',
+        ]
+        lines.extend('{}: {}'.format(k, v) for k, v in (headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+        status_line = (await reader.readline()).decode('latin-1').split(None, 2)
+        if len(status_line) < 2 or not status_line[0].startswith('HTTP/'):
+            raise HTTPError('not an HTTP response')
+        status = int(status_line[1])
+        response_headers = {}
+        for _ in range(MAX_HEADERS):
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        return status, response_headers
+    finally:
+        writer.close()
+
+
+def content_length(headers):
+    # the size of the whole file, from a ranged response if need be
+    if 'content-range' in headers:
+        total = headers['content-range'].rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    value = headers.get('content-length', '')
+    return int(value) if value.isdigit() else None
+
+
+async def check_link(url, limits, timeout=10, ssl_context=None):
+    start = time.perf_counter()
+    status = length = error = None
+    final_url = url
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            host = urllib.parse.urlsplit(final_url).netloc
+            await limits.acquire(host)
+            try:
+                status, headers = await asyncio.wait_for(
+                    request_head(final_url, ssl_context=ssl_context), timeout)
+                if status in HEAD_REFUSED:
+                    status, headers = await asyncio.wait_for(
+                        request_head(final_url, 'GET', {'Range': 'bytes=0-0'}, ssl_context), timeout)
+            finally:
+                limits.release(host)
+            if 300 <= status < 400 and headers.get('location'):
+                final_url = urllib.parse.urljoin(final_url, headers['location'])
+                continue
+            length = content_length(headers)
+            break
+        else:
+            error = 'too many redirects'
+    except asyncio.TimeoutError:
+        error = 'timed out'
+    except (OSError, ValueError, HTTPError, ssl.SSLError) as e:
+        error = str(e) or e.__class__.__name__
+    ok = error is None and status is not None and 200 <= status < 300
+    return LinkResult(url, status, ok, length, time.perf_counter() - start, time.time(),
+                      error, final_url if final_url != url else None)
+
+
+async def check_links_async(urls, concurrency=100, per_host=4, rate=None, timeout=10):
+    limits = HostLimits(per_host, rate)
+    pool = asyncio.Semaphore(concurrency)
+    ssl_context = ssl.create_default_context()
+
+    async def check(url):
+        async with pool:
+            return await check_link(url, limits, timeout, ssl_context)
+
+    results = await asyncio.gather(*[check(url) for url in urls])
+    return {r.url: r for r in results}
+
+
+def check_links(urls, concurrency=100, per_host=4, rate=None, timeout=10):
+    # {url: LinkResult} for each distinct url; per_host and rate (requests
+    # a second) limit what each host sees
+    urls = list(dict.fromkeys(u for u in urls if u))
+    if not urls:
+        return {}
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            check_links_async(urls, concurrency, per_host, rate, timeout))
+    finally:
+        loop.close()
+
+
+# the latest result for each url in a JSON file, replaced atomically so
+# that every process can read it. Results are reread when the file changes.
+class LinkCache(object):
+
+    def __init__(self, location):
+        self.location = location
+        self.results = {}
+        self._stat = None
+        self._merged = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            stat = os.stat(self.location)
+        except OSError:
+            return self.results
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != self._stat:
+            with self._lock:
+                try:
+                    with open(self.location) as f:
+                        self.results = {
+                            url: LinkResult(**r) for url, r in json.load(f).items()
+                        }
+                except (OSError, ValueError, TypeError):
+                    logger.exception('Could not read link results from %s', self.location)
+                self._stat = key
+        return self.results
+
+    def version(self):
+        # changes whenever the results do
+        self.load()
+        return self._stat
+
+    def update(self, results):
+        with self._lock:
+            self.results = dict(self.results, **results)
+            with atomic_file(self.location) as f:
+                f.write(json.dumps({url: r._asdict() for url, r in self.results.items()}).encode('utf8'))
+            stat = os.stat(self.location)
+            self._stat = (stat.st_mtime_ns, stat.st_size)
+
+    def due(self, urls, max_age):
+        # the urls not checked in the last max_age seconds
+        results = self.load()
+        now = time.time()
+        return [u for u in urls if u not in results or now - results[u].checked > max_age]
+
+    def merged(self, snapshot):
+        # {record id: LinkResult} for the records of snapshot, worked out
+        # again only when the snapshot or the results change
+        results = self.load()
+        key = (snapshot.digest, self._stat)
+        merged = self._merged
+        if merged is None or merged[0] != key:
+            by_record = {}
+            if results:
+                for i, url in enumerate(download_urls(snapshot)):
+                    if url in results:
+                        by_record[i] = results[url]
+            merged = self._merged = (key, by_record)
+        return merged[1]
+
+
+def download_urls(snapshot):
+    return snapshot.store.download_urls
+
+
+# checks the links of the current registry every interval seconds, when
+# should_check() says this process is the one to do it
+class LinkChecker(threading.Thread):
+
+    def __init__(self, cache, get_snapshot, interval, should_check=None, **options):
+        super(LinkChecker, self).__init__(name='link-checker', daemon=True)
+        self.cache = cache
+        self.get_snapshot = get_snapshot
+        self.interval = interval
+        self.should_check = should_check
+        self.options = options
+        self._stopped = threading.Event()
+
+    def check(self):
+        urls = self.cache.due(download_urls(self.get_snapshot()), self.interval)
+        if not urls:
+            return {}
+        start = time.perf_counter()
+        results = check_links(urls, **self.options)
+        self.cache.update(results)
+        logger.info('Checked %d links in %.1fs, %d broken', len(results),
+                    time.perf_counter() - start, sum(not r.ok for r in results.values()))
+        return results
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval / 10):
+            if self.should_check is not None and not self.should_check():
+                continue
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Could not check links')
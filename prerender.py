@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import threading
+import time
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# responses that only change with the registry, built once per snapshot and
+# kept with their gzip and brotli encodings, so that serving one is a
+# matter of picking the encoding the client accepts
+
+
+class StaticPayload(object):
+
+    def __init__(self, content, mimetype, digest):
+        self.content = content
+        self.mimetype = mimetype
+        self.etag = '{}-{}'.format(digest[:12], hashlib.sha1(content).hexdigest()[:12])
+        self.encodings = {'gzip': gzip.compress(content, 9)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(content, quality=11)
+
+    def response(self, cache_control='no-cache'):
+        if self.etag in flask.request.if_none_match:
+            response = flask.Response(status=304)
+        else:
+            accepted = flask.request.accept_encodings
+            encoding = max(
+                (e for e in self.encodings if accepted[e]),
+                key=lambda e: (accepted[e], e == 'br'),
+                default=None,
+            )
+            response = flask.Response(
+                self.encodings[encoding] if encoding else self.content,
+                mimetype=self.mimetype,
+            )
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etag)
+        response.headers['Cache-Control'] = cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+# the payloads for the current snapshot. build(snapshot) returns a dict of
+# name: (content, mimetype). If what was built goes out of date with time
+# rather than with the registry, max_age rebuilds it, and if it depends on
+# more than the registry, version(snapshot) can say what it was built from;
+# requests keep getting the previous build while either happens.
+class PrerenderedPayloads(object):
+
+    def __init__(self, build, max_age=None, version=None):
+        self.build = build
+        self.max_age = max_age
+        self.version = version
+        self.digest = None
+        self.built_from = None
+        self.built = None
+        self.builds = 0
+        self.build_time = None
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def get(self, snapshot):
+        built_from = self.version(snapshot) if self.version is not None else None
+        if self.digest == snapshot.digest and self.built_from == built_from and not self._expired():
+            return self._payloads
+        # only wait for a build if there's nothing built for this snapshot
+        if not self._lock.acquire(blocking=self.digest != snapshot.digest):
+            return self._payloads
+        try:
+            if self.digest != snapshot.digest or self.built_from != built_from or self._expired():
+                start = time.perf_counter()
+                payloads = {
+                    name: StaticPayload(content, mimetype, snapshot.digest)
+                    for name, (content, mimetype) in self.build(snapshot).items()
+                }
+                self._payloads, self.digest, self.built = payloads, snapshot.digest, time.time()
+                self.built_from = built_from
+                self.builds += 1
+                self.build_time = time.perf_counter() - start
+            return self._payloads
+        finally:
+            self._lock.release()
+
+    def _expired(self):
+        return self.max_age is not None and time.time() - self.built > self.max_age
+
+    def stats(self):
+        payloads = self._payloads
+        return {
+            "version": self.digest,
+            "built": self.built,
+            "builds": self.builds,
+            "build_time": self.build_time,
+            "payloads": {
+                name: {
+                    "etag": p.etag,
+                    "bytes": len(p.content),
+                    "encoded_bytes": {e: len(v) for e, v in p.encodings.items()},
+                } for name, p in payloads.items()
+            },
+        }
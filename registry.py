@@ -0,0 +1,423 @@
+import collections
+import contextlib
+import fcntl
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from aggregates import publisher_aggregates
+from changelog import Changelog
+from columnar import build_store, read_store
+from fetch import FeedClient, Timings
+from indexes import RegistryIndex
+from snapshot_file import SnapshotFileError, read_snapshot_file, write_snapshot_file
+
+logger = logging.getLogger(__name__)
+
+
+# a parsed copy of the 360Giving registry, shared by every callback until
+# it is replaced by a newer one. The records are held in a columnar store;
+# `registry` decodes them one at a time as they are needed. A snapshot
+# that replaces a previous one has a changelog of the records that differ.
+class RegistrySnapshot(object):
+
+    _versions = 0
+
+    def __init__(self, registry, source=None, fetch_time=0.0, parse_time=0.0,
+                 etag=None, last_modified=None, store=None, previous=None):
+        RegistrySnapshot._versions += 1
+        self.version = RegistrySnapshot._versions
+        self.store = store if store is not None else build_store(
+            registry, previous=previous.store if previous is not None else None)
+        self.registry = self.store.records
+        self.index = RegistryIndex(
+            self.store, previous=previous.index if previous is not None else None)
+        self.publisher_aggregates = publisher_aggregates(self.store)
+        self.source = source
+        self.created = time.time()
+        self.checked = self.created
+        self.fetch_time = fetch_time
+        self.parse_time = parse_time
+        self.etag = etag
+        self.last_modified = last_modified
+        self.shared_version = None
+        self._digest = None
+        self.changelog = None
+        if previous is not None:
+            self.changelog = Changelog(previous.store, self.store, previous.digest, self.digest)
+
+    def __len__(self):
+        return len(self.registry)
+
+    def __iter__(self):
+        return iter(self.registry)
+
+    def __repr__(self):
+        return '<RegistrySnapshot v{} records={} age={:.0f}s parse={:.3f}s>'.format(
+            self.version, len(self), self.age, self.parse_time
+        )
+
+    @property
+    def digest(self):
+        # identifies the content, and is the same in every process that
+        # holds this registry
+        if self._digest is None:
+            self._digest = hashlib.sha1(self.store.hashes.tobytes()).hexdigest()
+        return self._digest
+
+    @property
+    def age(self):
+        return time.time() - self.checked
+
+    def is_stale(self, max_age=None):
+        if max_age is None:
+            return False
+        return self.age > max_age
+
+    def touch(self):
+        # the upstream copy was confirmed unchanged
+        self.checked = time.time()
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+_refreshers = {}
+_client = None
+_changelogs = {}
+_listeners = []
+CHANGELOG_SIZE = 50
+
+# time spent waiting for _snapshots_lock
+timings = Timings()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = FeedClient()
+    return _client
+
+
+def set_client(client):
+    global _client
+    _client = client
+    return client
+
+
+def load_snapshot(reg_url, previous=None, client=None, timeout=None, save_to=None):
+    # the feed is parsed into the store as it downloads, copying the records
+    # that are unchanged from the previous snapshot
+    result = (client or get_client()).fetch(
+        reg_url,
+        etag=previous.etag if previous is not None else None,
+        last_modified=previous.last_modified if previous is not None else None,
+        timeout=timeout,
+        parse=functools.partial(read_store, previous=previous.store if previous is not None else None),
+        save_to=save_to,
+    )
+    if result.not_modified:
+        previous.touch()
+        return previous
+
+    return RegistrySnapshot(
+        None,
+        source=reg_url,
+        fetch_time=result.fetch_time - result.parse_time,
+        parse_time=result.parse_time,
+        etag=result.etag,
+        last_modified=result.last_modified,
+        store=result.parsed,
+        previous=previous,
+    )
+
+
+def load_snapshot_file(location, previous=None):
+    start = time.perf_counter()
+    with open(location, 'rb') as f:
+        store = read_store(f, previous=previous.store if previous is not None else None)
+    return RegistrySnapshot(
+        None,
+        source=location,
+        parse_time=time.perf_counter() - start,
+        store=store,
+        previous=previous,
+    )
+
+
+def save_shared_snapshot(snapshot, location, version):
+    write_snapshot_file(snapshot.store, location, version, meta={
+        "source": snapshot.source,
+        "etag": snapshot.etag,
+        "last_modified": snapshot.last_modified,
+    })
+
+
+def load_shared_snapshot(location, previous=None):
+    start = time.perf_counter()
+    version, store, meta = read_snapshot_file(location)
+    snapshot = RegistrySnapshot(
+        None,
+        source=meta.get("source"),
+        parse_time=time.perf_counter() - start,
+        etag=meta.get("etag"),
+        last_modified=meta.get("last_modified"),
+        store=store,
+        previous=previous,
+    )
+    snapshot.shared_version = version
+    # the file is touched whenever the leader confirms it is up to date
+    snapshot.checked = os.stat(location).st_mtime
+    return snapshot
+
+
+@contextlib.contextmanager
+def snapshots_locked():
+    with timings.timed('lock_wait'):
+        _snapshots_lock.acquire()
+    try:
+        yield
+    finally:
+        _snapshots_lock.release()
+
+
+def set_snapshot(reg_url, snapshot):
+    # swapping the dict entry is atomic, so readers see either the old
+    # snapshot or the new one and never a partially built registry
+    previous = _snapshots.get(reg_url)
+    _snapshots[reg_url] = snapshot
+    if snapshot is not previous:
+        if snapshot.changelog is not None:
+            logger.info('Registry %s changed: %r', reg_url, snapshot.changelog)
+            _changelogs.setdefault(
+                reg_url, collections.deque(maxlen=CHANGELOG_SIZE)
+            ).append(snapshot.changelog)
+        for listener in _listeners:
+            listener(reg_url, snapshot, previous)
+    return snapshot
+
+
+def on_snapshot(listener):
+    # call listener(reg_url, snapshot, previous) whenever a new snapshot
+    # replaces the current one
+    _listeners.append(listener)
+    return listener
+
+
+def get_changelogs(reg_url):
+    # recent changelogs for a feed, oldest first
+    return list(_changelogs.get(reg_url, ()))
+
+
+# the snapshot this process holds for reg_url, if any, without waiting
+def current_snapshot(reg_url):
+    return _snapshots.get(reg_url)
+
+
+def get_snapshot(reg_url, max_age=None):
+    snapshot = _snapshots.get(reg_url)
+    if snapshot is not None and not snapshot.is_stale(max_age):
+        return snapshot
+
+    # stale-while-revalidate: if a refresher owns this feed, serve what we
+    # have and leave the fetch to the background thread. Until it has a
+    # first copy, wait for that rather than fetching alongside it
+    refresher = _refreshers.get(reg_url)
+    if snapshot is not None and refresher is not None:
+        return snapshot
+    if refresher is not None and refresher.ready.wait(refresher.timeout):
+        snapshot = _snapshots.get(reg_url)
+        if snapshot is not None:
+            return snapshot
+
+    with snapshots_locked():
+        # another thread may have refreshed it while we were waiting
+        snapshot = _snapshots.get(reg_url)
+        if snapshot is None or snapshot.is_stale(max_age):
+            snapshot = set_snapshot(reg_url, load_snapshot(reg_url, previous=snapshot))
+    return snapshot
+
+
+# keeps the snapshot for a feed fresh from a background thread, so that
+# callbacks never wait on the network.
+#
+# With a shared_location, the refreshers in several worker processes share
+# one registry. Whichever holds the lock on the file is the leader: it
+# fetches the feed and writes each new registry to the shared snapshot file.
+# The others follow, checking the file every poll_interval and mapping it
+# again when it has been replaced. If the leader exits its lock is released
+# and the next follower to check takes over.
+class RegistryRefresher(threading.Thread):
+
+    def __init__(self, reg_url, interval, fallback_location=None, client=None, timeout=60,
+                 shared_location=None, poll_interval=5):
+        super(RegistryRefresher, self).__init__(name='registry-refresher', daemon=True)
+        self.reg_url = reg_url
+        self.interval = interval
+        self.fallback_location = fallback_location
+        self.client = client
+        self.timeout = timeout
+        self.shared_location = shared_location
+        self.poll_interval = poll_interval
+        self.last_error = None
+        self.ready = threading.Event()
+        self._stopped = threading.Event()
+        self._lock_file = None
+        self._shared_stat = None
+        self._last_refresh = None
+
+    @property
+    def is_leader(self):
+        return self.shared_location is None or self._lock_file is not None
+
+    def acquire_leadership(self):
+        if self.is_leader:
+            return True
+        directory = os.path.dirname(self.shared_location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(self.shared_location + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info('Refreshing registry for %s in process %s', self.reg_url, os.getpid())
+        return True
+
+    def release_leadership(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def refresh(self):
+        with snapshots_locked():
+            previous = _snapshots.get(self.reg_url)
+            try:
+                snapshot = load_snapshot(
+                    self.reg_url,
+                    previous=previous,
+                    client=self.client,
+                    timeout=self.timeout,
+                    save_to=self.fallback_location,
+                )
+                self.last_error = None
+            except (requests.RequestException, ValueError) as e:
+                self.last_error = e
+                logger.warning('Could not refresh registry from %s: %s', self.reg_url, e)
+                if previous is not None:
+                    return previous
+                if not self.fallback_location or not os.path.exists(self.fallback_location):
+                    return None
+                logger.warning('Using registry from %s', self.fallback_location)
+                snapshot = load_snapshot_file(self.fallback_location, previous=previous)
+            if self.shared_location:
+                snapshot = self.publish(snapshot, previous)
+            return set_snapshot(self.reg_url, snapshot)
+
+    def publish(self, snapshot, previous):
+        # write a new registry to the shared file, and map it back so this
+        # process shares the same pages as the followers
+        if snapshot is previous:
+            os.utime(self.shared_location)
+            self._shared_stat = self._stat()
+            return snapshot
+        version = (previous.shared_version or 0) + 1 if previous is not None else 1
+        save_shared_snapshot(snapshot, self.shared_location, version)
+        self._shared_stat = self._stat()
+        shared = load_shared_snapshot(self.shared_location, previous=previous)
+        shared.fetch_time = snapshot.fetch_time
+        shared.parse_time = snapshot.parse_time
+        return shared
+
+    def _stat(self):
+        try:
+            st = os.stat(self.shared_location)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def follow(self):
+        # map the shared file again if the leader has replaced it
+        stat = self._stat()
+        if stat is None or stat == self._shared_stat:
+            return _snapshots.get(self.reg_url)
+        previous_stat, self._shared_stat = self._shared_stat, stat
+        snapshot = _snapshots.get(self.reg_url)
+        if snapshot is not None and previous_stat and stat[0] == previous_stat[0]:
+            # same file, touched by the leader after checking upstream
+            snapshot.checked = stat[1] / 1e9
+            return snapshot
+        try:
+            shared = load_shared_snapshot(self.shared_location, previous=snapshot)
+        except (OSError, SnapshotFileError) as e:
+            logger.warning('Could not read registry from %s: %s', self.shared_location, e)
+            return snapshot
+        if snapshot is not None and snapshot.shared_version and shared.digest == snapshot.digest:
+            snapshot.checked = shared.checked
+            snapshot.shared_version = shared.shared_version
+            return snapshot
+        return set_snapshot(self.reg_url, shared)
+
+    def warm_up(self):
+        # load the registry now, without starting the thread: from the
+        # shared file if there is one, otherwise from the feed. Run before
+        # forking workers, so leadership is let go again afterwards for one
+        # of them to take.
+        snapshot = self.follow() if self.shared_location else None
+        if snapshot is None and self.acquire_leadership():
+            try:
+                snapshot = self.refresh()
+                self._last_refresh = time.monotonic()
+            finally:
+                if self.shared_location:
+                    self.release_leadership()
+        if snapshot is not None:
+            self.ready.set()
+        return snapshot
+
+    def start(self):
+        _refreshers[self.reg_url] = self
+        if self.shared_location:
+            # start from the shared copy rather than waiting on the feed; a
+            # leader also picks up its ETag for the first conditional GET
+            self.follow()
+        super(RegistryRefresher, self).start()
+
+    def stop(self):
+        self._stopped.set()
+        self.release_leadership()
+        if _refreshers.get(self.reg_url) is self:
+            del _refreshers[self.reg_url]
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                try:
+                    self.step()
+                except Exception as e:
+                    # keep going: the next refresh may well work
+                    self.last_error = e
+                    logger.exception('Could not refresh registry from %s', self.reg_url)
+                self._stopped.wait(self.interval if self.shared_location is None else self.poll_interval)
+        finally:
+            # a leader that stops for any reason lets a follower take over
+            self.release_leadership()
+
+    def step(self):
+        if self.acquire_leadership():
+            if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.interval:
+                try:
+                    self.refresh()
+                finally:
+                    self._last_refresh = time.monotonic()
+                    # callbacks waiting on the first load can go ahead, and
+                    # load it themselves if it failed
+                    self.ready.set()
+        elif self.follow() is not None:
+            self.ready.set()
@@ -0,0 +1,107 @@
+import collections
+import threading
+import time
+
+
+# a bounded LRU of built Dash components, filtered ids or serialised
+# payloads. Keys should include a hash of whatever the value was made from.
+# Entries can be dropped selectively with discard(), or all at once when
+# the cache is used with a new version. The cache can also be bounded by
+# the total size of its values, given by sizeof, and entries can expire
+# after ttl seconds, or a ttl given for the entry when it is put.
+class RenderCache(object):
+
+    def __init__(self, maxsize=2048, maxbytes=None, sizeof=None, ttl=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.nbytes = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self, version=None):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+            self.version = version
+
+    def lookup(self, key, version=None):
+        # the cached value, or None
+        if version != self.version:
+            self.clear(version)
+
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] is not None and item[1] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, version=None, ttl=None):
+        if version != self.version:
+            self.clear(version)
+
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return value
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (value, expires, size)
+            self.nbytes += size
+            while len(self._items) > self.maxsize or \
+                    (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+        return value
+
+    def get(self, key, render, version=None, ttl=None):
+        value = self.lookup(key, version=version)
+        if value is not None:
+            return value
+        # rendered outside the lock; two threads may both build the same
+        # value, which is harmless
+        return self.put(key, render(), version=version, ttl=ttl)
+
+    def _remove(self, key):
+        self.nbytes -= self._items.pop(key)[2]
+
+    def discard(self, predicate):
+        # drop the entries whose key matches predicate
+        with self._lock:
+            keys = [k for k in self._items if predicate(k)]
+            for k in keys:
+                self._remove(k)
+        return len(keys)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "bytes": self.nbytes,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": (self.hits / lookups) if lookups else None,
+        }
@@ -0,0 +1,121 @@
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from columnar import RegistryStore, PackedSequence, pack
+
+# a RegistryStore saved as a single binary file that worker processes can
+# memory-map read-only. The file is a fixed prefix, the store's numpy
+# columns and packed record blobs as 64-byte aligned sections, then a JSON
+# header describing the sections. Arrays are read straight out of the
+# mapping, so every worker on the host shares one copy in the page cache.
+#
+# Files are written to a temporary name and renamed into place. A worker
+# that has mapped the old file keeps reading it until it maps the new one,
+# so it never sees a mix of two versions.
+
+MAGIC = b'360GSNAP'
+FORMAT = 2
+_prefix = struct.Struct('<8sIQQQ')  # magic, format, version, header offset, header length
+_align = 64
+
+
+class SnapshotFileError(ValueError):
+    pass
+
+
+def _sections(store):
+    for name in RegistryStore.array_names:
+        yield name, getattr(store, name)
+    blob_offsets, blobs = pack(store._blobs)
+    yield '_blob_offsets', blob_offsets
+    yield '_blobs', blobs
+    yield '_zdict', np.frombuffer(store._zdict, dtype=np.uint8)
+
+
+def write_snapshot_file(store, location, version, meta=None):
+    directory = os.path.dirname(location)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_location = '{}.{}.tmp'.format(location, os.getpid())
+
+    try:
+        sections = {}
+        with open(tmp_location, 'wb') as f:
+            f.write(b'\0' * _prefix.size)
+            for name, array in _sections(store):
+                array = np.ascontiguousarray(array)
+                f.write(b'\0' * (-f.tell() % _align))
+                sections[name] = {
+                    "offset": f.tell(),
+                    "dtype": array.dtype.str,
+                    "shape": array.shape,
+                }
+                f.write(array.tobytes())
+
+            header = json.dumps({
+                "sections": sections,
+                "tables": {name: getattr(store, name).values for name in RegistryStore.table_names},
+                "identifiers": store.identifiers,
+                "download_urls": store.download_urls,
+                "licence_names": list(store.licence_names.items()),
+                "standard_fields": sorted(store.standard_fields),
+                "meta": meta or {},
+            }).encode('utf8')
+            header_offset = f.tell()
+            f.write(header)
+            f.seek(0)
+            f.write(_prefix.pack(MAGIC, FORMAT, version, header_offset, len(header)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_location, location)
+    except BaseException:
+        # don't leave a partial file behind for each failed write
+        if os.path.exists(tmp_location):
+            os.remove(tmp_location)
+        raise
+
+
+def _read_prefix(data, location):
+    if len(data) < _prefix.size:
+        raise SnapshotFileError('{} is not a registry snapshot'.format(location))
+    magic, format_, version, header_offset, header_length = _prefix.unpack_from(data)
+    if magic != MAGIC or format_ != FORMAT:
+        raise SnapshotFileError('{} is not a registry snapshot'.format(location))
+    return version, header_offset, header_length
+
+
+def peek_version(location):
+    with open(location, 'rb') as f:
+        return _read_prefix(f.read(_prefix.size), location)[0]
+
+
+# (version, store, meta) for a snapshot file
+def read_snapshot_file(location):
+    with open(location, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    version, header_offset, header_length = _read_prefix(data, location)
+    header = json.loads(data[header_offset:header_offset + header_length].decode('utf8'))
+
+    sections = {}
+    for name, s in header["sections"].items():
+        dtype = np.dtype(s["dtype"])
+        count = int(np.prod(s["shape"], dtype=np.int64))
+        sections[name] = np.frombuffer(
+            data, dtype=dtype, count=count, offset=s["offset"]
+        ).reshape(s["shape"])
+
+    store = RegistryStore.from_columns(
+        arrays=sections,
+        tables=header["tables"],
+        blobs=PackedSequence(sections["_blobs"], sections["_blob_offsets"]),
+        zdict=sections["_zdict"].tobytes(),
+        identifiers=header["identifiers"],
+        download_urls=header["download_urls"],
+        licence_names=header["licence_names"],
+        standard_fields=header["standard_fields"],
+    )
+    return version, store, header["meta"]
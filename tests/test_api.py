@@ -0,0 +1,45 @@
+import flask
+import pytest
+
+import registry
+from api import create_api
+from benchmarks.synthetic import make_registry
+
+# the API picks CSV or JSON from the Accept header when there's no
+# ?format, so caches have to keep the two apart
+
+REG_URL = 'http://registry.invalid/coverage.json'
+
+
+@pytest.fixture
+def client():
+    registry.set_snapshot(REG_URL, registry.RegistrySnapshot(make_registry(50)))
+    server = flask.Flask(__name__)
+    server.register_blueprint(create_api(REG_URL))
+    yield server.test_client()
+    registry._snapshots.pop(REG_URL, None)
+
+
+@pytest.mark.parametrize('path', ['/api/publishers', '/api/files', '/api/coverage'])
+def test_negotiated_responses_vary_on_accept(client, path):
+    as_json = client.get(path, headers={'Accept': 'application/json'})
+    as_csv = client.get(path, headers={'Accept': 'text/csv'})
+    assert as_json.mimetype == 'application/json'
+    assert as_csv.mimetype == 'text/csv'
+    assert 'Accept' in as_json.vary and 'Accept' in as_csv.vary
+    assert as_json.get_etag() != as_csv.get_etag()
+
+    # revalidating the CSV as JSON gets the JSON, not a 304
+    etag = as_csv.get_etag()[0]
+    response = client.get(path, headers={'Accept': 'application/json', 'If-None-Match': '"{}"'.format(etag)})
+    assert response.status_code == 200 and response.mimetype == 'application/json'
+    response = client.get(path, headers={'Accept': 'text/csv', 'If-None-Match': '"{}"'.format(etag)})
+    assert response.status_code == 304 and 'Accept' in response.vary
+
+
+def test_explicit_format_does_not_vary(client):
+    response = client.get('/api/publishers?format=csv', headers={'Accept': 'application/json'})
+    assert response.mimetype == 'text/csv'
+    assert 'Accept' not in response.vary
+    response = client.get('/api/changelog')
+    assert 'Accept' not in response.vary
@@ -0,0 +1,23 @@
+import datetime
+
+from benchmarks.synthetic import make_registry
+from columnar import build_store
+
+NOW = datetime.datetime(2020, 6, 1, 12, 0)
+
+
+def test_unchanged_records_are_reused():
+    records = make_registry(1000, now=NOW)
+    previous = build_store(records)
+    # some of the hashes end in a nul byte, which numpy leaves off
+    assert any(not h.endswith(b'\0') and len(h) < 20 for h in previous.hashes)
+
+    store = build_store(records, previous=previous)
+    assert store.reused == len(records)
+    assert store.hashes.tobytes() == previous.hashes.tobytes()
+    assert store.records[4] == previous.records[4]
+
+    records[10]["title"] = "Changed"
+    store = build_store(records, previous=previous)
+    assert store.reused == len(records) - 1
+    assert store.hashes[10] != previous.hashes[10]
@@ -0,0 +1,152 @@
+import datetime
+import random
+
+import dateutil.parser
+import pytest
+
+import utils
+from benchmarks.synthetic import make_registry
+from indexes import normalise_filters
+from registry import RegistrySnapshot
+
+# the index filters against the linear scan over the registry that they
+# replaced, on a synthetic registry
+
+NOW = datetime.datetime(2020, 6, 1, 12, 0)
+
+
+def scan(registry, filters, now):
+    # the original filter, one record at a time, with now fixed
+    reg_ = {}
+    for r in registry:
+        p = r.get("publisher", {}).get("name")
+
+        if filters.get("licence"):
+            if r.get("license", "") not in filters["licence"]:
+                continue
+
+        if filters.get("search"):
+            if filters.get("search", "").lower() not in p.lower():
+                continue
+
+        if filters.get("last_modified"):
+            last_modified_poss = {
+                "lastmonth": now - datetime.timedelta(days=30),
+                "6month": now - datetime.timedelta(days=30*6),
+                "12month": now - datetime.timedelta(days=365),
+            }
+            if last_modified_poss.get(filters.get("last_modified")):
+                last_modified = dateutil.parser.parse(r.get("modified"), ignoretz=True)
+                if last_modified < last_modified_poss.get(filters.get("last_modified")):
+                    continue
+
+        if filters.get("currency"):
+            if not any(c in r.get("datagetter_aggregates", {}).get("currencies", {})
+                       for c in filters["currency"]):
+                continue
+
+        if filters.get("filetype"):
+            if r.get('datagetter_metadata', {}).get("file_type") not in filters["filetype"]:
+                continue
+
+        if filters.get("fields"):
+            if not any(f in r.get("datagetter_coverage", {}) for f in filters["fields"]):
+                continue
+
+        reg_.setdefault(p, []).append(r)
+    return reg_
+
+
+def identifiers(reg_):
+    return {p: [r["identifier"] for r in records] for p, records in reg_.items()}
+
+
+def filtered(snapshot, filters):
+    ids = snapshot.index.filter(normalise_filters(filters), now=NOW)
+    return {
+        p: [snapshot.registry[i]["identifier"] for i in g]
+        for p, g in snapshot.index.group_by_publisher(ids)
+    }
+
+
+@pytest.fixture(scope='module')
+def registry():
+    return make_registry(600, seed=3, now=NOW)
+
+
+@pytest.fixture(scope='module')
+def snapshot(registry):
+    return RegistrySnapshot(registry)
+
+
+def publisher_names(registry):
+    return sorted(set(r["publisher"]["name"] for r in registry))
+
+
+CASES = [
+    {},
+    {"currency": ["EUR"]},
+    {"currency": ["EUR", "USD"]},
+    {"currency": ["XXX"]},
+    {"fields": ["Grant Type"]},
+    {"fields": ["Grant Type", "From an open call?"]},
+    {"fields": ["Recipient Org:Web Address", "Beneficiary Location:Name"]},
+    {"licence": ["https://creativecommons.org/licenses/by/4.0/"]},
+    {"filetype": ["csv", "json"]},
+    {"search": "trust"},
+    {"search": "TRUST"},
+    {"search": "Community"},
+    {"search": "zzz"},
+    {"last_modified": "lastmonth"},
+    {"last_modified": "6month"},
+    {"last_modified": "12month"},
+    {"last_modified": "12month", "currency": ["GBP", "USD"], "fields": ["Grant Type"]},
+    {"search": "found", "filetype": ["xlsx"], "last_modified": "6month"},
+]
+
+
+@pytest.mark.parametrize('filters', CASES, ids=[str(c) for c in CASES])
+def test_index_filter_matches_scan(registry, snapshot, filters):
+    expected = identifiers(scan(registry, filters, NOW))
+    got = filtered(snapshot, filters)
+    # the same publishers in the same order, each with the same files
+    assert list(got) == list(expected)
+    assert got == expected
+
+
+def test_search_by_publisher_name(registry, snapshot):
+    # every publisher is found by any part of its name, in any case
+    for name in publisher_names(registry)[:40]:
+        for query in (name, name.upper(), name[2:9].lower(), name.split()[1]):
+            ids = snapshot.index.filter(normalise_filters({"search": query}))
+            assert set(snapshot.registry[i]["publisher"]["name"] for i in ids) == \
+                set(scan(registry, {"search": query}, NOW))
+
+
+def test_random_filters(registry, snapshot):
+    rnd = random.Random(1)
+    store = snapshot.store
+    for _ in range(200):
+        filters = {}
+        if rnd.random() < 0.4:
+            filters["licence"] = rnd.sample(list(store.licences), 2)
+        if rnd.random() < 0.4:
+            filters["currency"] = rnd.sample(list(store.currencies), 2)
+        if rnd.random() < 0.3:
+            filters["filetype"] = [rnd.choice(list(store.filetypes))]
+        if rnd.random() < 0.4:
+            filters["fields"] = rnd.sample(list(store.fields), 2)
+        if rnd.random() < 0.4:
+            filters["last_modified"] = rnd.choice(["lastmonth", "6month", "12month"])
+        if rnd.random() < 0.5:
+            filters["search"] = rnd.choice(["a", "TRU", "st ", "found", "zz", "e"])
+        assert filtered(snapshot, filters) == identifiers(scan(registry, filters, NOW)), filters
+
+
+def test_get_registry_by_publisher(registry, snapshot):
+    # without a time filter the result doesn't depend on the clock
+    for filters in CASES:
+        if "last_modified" in filters:
+            continue
+        assert identifiers(utils.get_registry_by_publisher(filters, snapshot=snapshot)) == \
+            identifiers(scan(registry, filters, NOW))
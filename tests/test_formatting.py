@@ -0,0 +1,38 @@
+import random
+
+import numpy as np
+import pytest
+
+from formatting import format_currencies, format_currency
+
+# the batch formatter gives what formatting each amount on its own does
+
+AMOUNTS = [
+    0, 1, -1, 0.5, 1.5, 2.5, -0.4, -1.5, 999999, 999999.5, 999999.99, 10**6,
+    1000000.0, 999949999, 999950000, 999999999, 10**9, 1.5e9, 10**12 - 1, 10**15,
+    10**18, 2**53 + 1, 12345678901234567890, np.int64(5000000), np.float64(2500000.5),
+]
+
+
+def random_amounts(count, seed=1):
+    rnd = random.Random(seed)
+    return [
+        rnd.choice([
+            rnd.randint(0, 10**rnd.randint(1, 13)),
+            rnd.uniform(-1e4, 1e13),
+            round(rnd.uniform(0, 1e7), 2),
+        ])
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize('currency', ['GBP', 'USD', 'EUR', 'XYZ'])
+@pytest.mark.parametrize('humanize_', [True, False])
+def test_format_currencies_matches_format_currency(currency, humanize_):
+    amounts = AMOUNTS + random_amounts(5000)
+    expected = [format_currency(a, currency, humanize_=humanize_) for a in amounts]
+    assert format_currencies(amounts, currency, humanize_=humanize_) == expected
+
+
+def test_format_currencies_empty():
+    assert format_currencies([]) == []
@@ -0,0 +1,71 @@
+import pytest
+
+import registry
+from benchmarks.bench_linkcheck import serve
+from benchmarks.synthetic import make_registry
+from linkcheck import check_links, download_urls
+from snapshot_file import read_snapshot_file, write_snapshot_file
+
+# the link checker against a local stand-in for a publisher's server that,
+# like most, refuses a request line it can't parse
+
+
+class Strict(object):
+
+    def __init__(self):
+        self.targets = []
+
+    async def handle(self, reader, writer):
+        request = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        if len(request) != 3:
+            head = 'HTTP/1.1 400 Bad Request\r\nContent-Length: 0'
+        else:
+            self.targets.append(request[1])
+            head = 'HTTP/1.1 200 OK\r\nContent-Length: 12345'
+        writer.write((head + '\r\nConnection: close\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+        writer.close()
+
+
+@pytest.fixture(scope='module')
+def stand_in():
+    strict = Strict()
+    port, = serve(strict, 1)
+    return strict, 'http://127.0.0.1:{}'.format(port)
+
+
+def test_links_are_quoted(stand_in):
+    strict, host = stand_in
+    urls = [
+        host + '/Grants 2019.xlsx',
+        host + '/grants%202018.csv',
+        host + '/export?year=2017&name=Trust Grants',
+    ]
+    results = check_links(urls)
+    assert all(results[u].ok for u in urls), results
+    assert all(results[u].content_length == 12345 for u in urls)
+    assert sorted(strict.targets) == [
+        '/Grants%202019.xlsx', '/export?year=2017&name=Trust%20Grants', '/grants%202018.csv',
+    ]
+
+
+def test_download_urls_are_kept_with_the_store(tmp_path):
+    records = make_registry(100)
+    records[3]["distribution"] = []
+    expected = [(r.get("distribution") or [{}])[0].get("downloadURL") for r in records]
+    snapshot = registry.RegistrySnapshot(records)
+    assert list(download_urls(snapshot)) == expected
+
+    # records copied from the previous store, and stores read back from a
+    # snapshot file, have them too
+    records[5]["title"] = "Changed"
+    updated = registry.RegistrySnapshot(records, previous=snapshot)
+    assert updated.store.reused == len(records) - 1
+    assert list(download_urls(updated)) == expected
+
+    location = str(tmp_path / 'registry.snapshot')
+    write_snapshot_file(updated.store, location, 1)
+    _, store, _ = read_snapshot_file(location)
+    assert list(store.download_urls) == expected
@@ -0,0 +1,49 @@
+import pytest
+
+from utils import filters_tag, get_page_args, get_page_filters, page_url
+
+# page links keep their page while the filters they were made for are
+# set, and otherwise start again from the first page. Only pages of the
+# unfiltered results can be linked to from outside the dashboard.
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app
+    return app
+
+
+def request(app, search, **filters):
+    values = {i: None for i in app.STATUS_INPUTS}
+    values['url.search'] = search
+    for name, value in filters.items():
+        values['status-{}.value'.format(name.replace('_', '-'))] = value
+    _, _, page, page_size = app.status_request(values)
+    return page, page_size
+
+
+def test_page_url():
+    assert page_url(3, 20) == '?page=3'
+    assert page_url(3, 50) == '?page=3&per_page=50'
+    url = page_url(2, 20, filters={'currency': ['GBP']})
+    assert get_page_args(url) == (2, 20)
+    assert get_page_filters(url) == filters_tag({'currency': ['GBP']}) != ''
+
+
+def test_unfiltered_deep_link_keeps_its_page(app):
+    assert request(app, page_url(3, 50)) == (3, 50)
+
+
+def test_page_links_keep_their_page_with_their_filters(app):
+    url = page_url(2, 20, filters=app.normalise_filters({'currency': ['GBP']}))
+    assert request(app, url, currency=['GBP']) == (2, 20)
+    # a filter changed since the link was made
+    assert request(app, url, currency=['USD']) == (1, 20)
+
+
+def test_filtered_deep_link_opens_on_the_first_page(app):
+    # the filters aren't in the url, so the page opens with none set and
+    # the link's page isn't one of those results
+    url = page_url(2, 20, filters=app.normalise_filters({'currency': ['GBP']}))
+    assert request(app, url) == (1, 20)
@@ -0,0 +1,68 @@
+import datetime
+import json
+import types
+
+import plotly
+import pytest
+
+import registry
+import render_cache
+from benchmarks.synthetic import make_registry
+
+# file rows say how long ago each file was modified, so a cached row has to
+# be rendered again as time passes, even if its record hasn't changed
+
+NOW = datetime.datetime(2020, 6, 1, 12, 0)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app
+    return app
+
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    # moves the time both the cache and the rows see
+    state = {"now": NOW, "monotonic": 1000.0}
+
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return state["now"]
+
+    def advance(seconds):
+        state["now"] += datetime.timedelta(seconds=seconds)
+        state["monotonic"] += seconds
+
+    monkeypatch.setattr(app, 'datetime', types.SimpleNamespace(
+        datetime=FrozenDatetime, timedelta=datetime.timedelta, date=datetime.date))
+    monkeypatch.setattr(render_cache, 'time', types.SimpleNamespace(
+        monotonic=lambda: state["monotonic"]))
+    return advance
+
+
+def text(component):
+    return json.dumps(component, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def test_file_rows_say_how_long_ago_now(app, clock):
+    records = make_registry(3, files_per_publisher=1, now=NOW)
+    records[0]["modified"] = (NOW - datetime.timedelta(hours=3)).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+    snapshot = registry.RegistrySnapshot(records)
+    app.render_cache.clear()
+
+    row = app.cached_file_row(snapshot, 0)
+    assert '3 hours' in text(row)
+    detail = app.cached_publisher_detail(snapshot, [0])
+    assert '3 hours' in text(detail)
+
+    # cached for a while
+    clock(60)
+    assert app.cached_file_row(snapshot, 0) is row
+    assert app.cached_publisher_detail(snapshot, [0]) is detail
+
+    clock(2 * 24 * 60 * 60)
+    assert '2 days' in text(app.cached_file_row(snapshot, 0))
+    assert '2 days' in text(app.cached_publisher_detail(snapshot, [0]))
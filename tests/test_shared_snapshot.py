@@ -0,0 +1,122 @@
+import http.server
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+import registry
+from benchmarks.bench_shared_snapshot import Feed, versioned_registry, worker
+from benchmarks.synthetic import make_registry
+from snapshot_file import read_snapshot_file, write_snapshot_file
+
+# refreshers in several processes sharing one registry through a snapshot
+# file, against a local stand-in for the feed
+
+
+@pytest.fixture
+def feed():
+    records = make_registry(300)
+    Feed.version = 1
+    Feed.content = versioned_registry(records, Feed.version)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Feed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def publish(version):
+        Feed.content = versioned_registry(records, version)
+        Feed.version = version
+
+    yield 'http://127.0.0.1:{}/coverage.json'.format(server.server_port), publish
+    server.shutdown()
+
+
+def test_workers_read_consistent_snapshots(feed, tmp_path):
+    # every worker only ever sees whole versions while the leader replaces
+    # the file under them, and all of them follow it
+    reg_url, publish = feed
+    ctx = multiprocessing.get_context('fork')
+    started = ctx.Semaphore(0)
+    stop = ctx.Event()
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=worker, args=(reg_url, str(tmp_path / 'registry.snapshot'),
+                                         started, stop, results))
+        for _ in range(3)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        assert started.acquire(timeout=30)
+    for version in range(2, 5):
+        publish(version)
+        time.sleep(1)
+    stop.set()
+    stats = [results.get(timeout=30) for _ in workers]
+    for w in workers:
+        w.join(10)
+
+    assert sum(s["leader"] for s in stats) == 1
+    assert all(s["errors"] == 0 for s in stats), stats
+    assert all(s["reads"] > 0 for s in stats)
+    assert all(s["versions"] > 1 for s in stats), stats
+
+
+def test_leader_keeps_going_after_an_error(feed, tmp_path, monkeypatch):
+    reg_url, _ = feed
+    failures = []
+
+    def fail(*args, **kwargs):
+        failures.append(1)
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(registry, 'load_snapshot', fail)
+    refresher = registry.RegistryRefresher(
+        reg_url, interval=0.05, shared_location=str(tmp_path / 'registry.snapshot'),
+        poll_interval=0.02)
+    refresher.start()
+    try:
+        assert refresher.ready.wait(5)
+        time.sleep(0.3)
+        assert refresher.is_alive()
+        assert len(failures) > 1
+        assert isinstance(refresher.last_error, RuntimeError)
+    finally:
+        refresher.stop()
+        refresher.join(5)
+        registry._snapshots.pop(reg_url, None)
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_leadership_is_released_when_the_thread_ends(feed, tmp_path, monkeypatch):
+    # even if it ends on an error that isn't caught, a follower can take over
+    reg_url, _ = feed
+    location = str(tmp_path / 'registry.snapshot')
+    leader = registry.RegistryRefresher(reg_url, interval=60, shared_location=location)
+
+    def step():
+        leader.acquire_leadership()
+        raise SystemExit
+
+    monkeypatch.setattr(leader, 'step', step)
+    leader.start()
+    leader.join(5)
+    assert not leader.is_alive()
+
+    follower = registry.RegistryRefresher(reg_url, interval=60, shared_location=location)
+    try:
+        assert follower.acquire_leadership()
+    finally:
+        follower.release_leadership()
+        leader.stop()
+        follower.stop()
+
+
+def test_failed_write_leaves_no_partial_file(tmp_path):
+    location = str(tmp_path / 'registry.snapshot')
+    store = registry.RegistrySnapshot(make_registry(20)).store
+    write_snapshot_file(store, location, 1)
+    with pytest.raises(TypeError):
+        write_snapshot_file(store, location, 2, meta={"source": object()})
+    assert os.listdir(str(tmp_path)) == ['registry.snapshot']
+    assert read_snapshot_file(location)[0] == 1
@@ -0,0 +1,75 @@
+import http.server
+import io
+import json
+import threading
+
+import pytest
+
+import registry
+from benchmarks.synthetic import make_registry
+from columnar import read_store
+
+# a feed that stops partway through the document, as when the upload of a
+# new coverage.json is still in progress
+
+
+class Truncated(http.server.BaseHTTPRequestHandler):
+
+    content = b''
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(Truncated.content)))
+        self.end_headers()
+        self.wfile.write(Truncated.content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def records():
+    return make_registry(50)
+
+
+@pytest.fixture
+def feed(records):
+    content = json.dumps(records).encode('utf8')
+    Truncated.content = content[:len(content) // 2]
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Truncated)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    reg_url = 'http://127.0.0.1:{}/coverage.json'.format(server.server_port)
+    yield reg_url
+    server.shutdown()
+    registry._snapshots.pop(reg_url, None)
+
+
+def test_read_store_raises_value_error(records):
+    content = json.dumps(records).encode('utf8')
+    with pytest.raises(ValueError):
+        read_store(io.BytesIO(content[:len(content) // 2]))
+    with pytest.raises(ValueError):
+        read_store(io.BytesIO(b'[{"identifier": }]'))
+
+
+def test_refresher_falls_back_to_the_saved_feed(feed, records, tmp_path):
+    fallback_location = tmp_path / 'coverage.json'
+    fallback_location.write_text(json.dumps(records))
+    refresher = registry.RegistryRefresher(
+        feed, interval=0.05, fallback_location=str(fallback_location))
+    refresher.start()
+    try:
+        assert refresher.ready.wait(5)
+        snapshot = registry.current_snapshot(feed)
+        assert snapshot is not None
+        assert snapshot.source == str(fallback_location)
+        assert snapshot.store.size == len(records)
+        assert isinstance(refresher.last_error, ValueError)
+        # the saved copy isn't replaced by the partial download
+        assert json.loads(fallback_location.read_text()) == records
+        refresher.ready.clear()
+        assert refresher.ready.wait(5)
+        assert refresher.is_alive()
+    finally:
+        refresher.stop()
+        refresher.join(5)
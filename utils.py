@@ -1,75 +1,90 @@
-import datetime
-
-import requests
-import inflect
-import humanize
-import babel.numbers
-import dateutil.parser
+import hashlib
+import math
+import urllib.parse
 
 import dash_core_components as dcc
 import dash_html_components as html
 
-# fetch the 360Giving registry
-def get_registry(reg_url):
-    r = requests.get(reg_url)
-    return r.json()
+from indexes import filter_key, filter_time, normalise_filters
+from instrumentation import traced
+from registry import get_snapshot
+from formatting import pluralize, format_currency
 
+# fetch the 360Giving registry
+@traced('get_registry')
+def get_registry(reg_url, max_age=None):
+    return get_snapshot(reg_url, max_age=max_age).registry
+
+# the ids of the matching records for each publisher. With a cache, the
+# matching ids are kept for the snapshot under the normalised filters, so
+# equivalent filters share an entry
+@traced('filter')
+def get_ids_by_publisher(filters={}, cache=None, snapshot=None, **kwargs):
+    if snapshot is None:
+        snapshot = get_snapshot(**kwargs)
+    filters = normalise_filters(filters)
+    now = filter_time(filters)
+    if cache is None:
+        ids = snapshot.index.filter(filters, now=now)
+    else:
+        ids = cache.get(
+            (filter_key(filters), now),
+            lambda: snapshot.index.filter(filters, now=now),
+            version=snapshot.digest,
+        )
+    return snapshot, dict(snapshot.index.group_by_publisher(ids))
+
+@traced('get_registry_by_publisher')
 def get_registry_by_publisher(filters={}, **kwargs):
-    reg = get_registry(**kwargs)
-
-    reg_ = {}
-    for r in reg:
-        
-        p = r.get("publisher", {}).get("name")
-
-        # filter
-        if filters.get("licence"):
-            if r.get("license", "") not in filters["licence"]:
-                continue
-
-        if filters.get("search"):
-            if filters.get("search", "").lower() not in p.lower():
-                continue
-
-        if filters.get("last_modified"):
-            last_modified_poss = {
-                "lastmonth": datetime.datetime.now() - datetime.timedelta(days=30),
-                "6month": datetime.datetime.now() - datetime.timedelta(days=30*6),
-                "12month": datetime.datetime.now() - datetime.timedelta(days=365),
-            }
-            if last_modified_poss.get(filters.get("last_modified")):
-                last_modified = dateutil.parser.parse(r.get("modified"), ignoretz=True)
-                if last_modified < last_modified_poss.get(filters.get("last_modified")):
-                    continue
-
-        if filters.get("currency"):
-            choose_this = False
-            for c in filters.get("currency", []):
-                if c in r.get("datagetter_aggregates", {}).get("currencies", {}).keys():
-                    choose_this = True
-            if not choose_this:
-                continue
-
-        if filters.get("filetype"):
-            if r.get('datagetter_metadata', {}).get("file_type") not in filters["filetype"]:
-                continue
-
-        if filters.get("fields"):
-            this_fields = list(r.get("datagetter_coverage", {}).keys())
-            choose_this = False
-            for f in filters.get("fields", []):
-                if f in this_fields:
-                    choose_this = True
-            if not choose_this:
-                continue
-
-
-        if p not in reg_:
-            reg_[p] = []
-
-        reg_[p].append(r)
-
-    return reg_
+    snapshot, reg_ = get_ids_by_publisher(filters, **kwargs)
+    return {
+        p: [snapshot.registry[i] for i in ids]
+        for p, ids in reg_.items()
+    }
+
+MAX_PAGE_SIZE = 100 # the most results a page can ask for
+
+# read ?page=&per_page= from the url, keeping both within range
+def get_page_args(url_search, default_page_size=20, max_page_size=MAX_PAGE_SIZE):
+    query = urllib.parse.parse_qs((url_search or '').lstrip('?'))
+
+    def get_int(key, default):
+        try:
+            return int(query.get(key, [default])[0])
+        except ValueError:
+            return default
+
+    page = max(get_int('page', 1), 1)
+    page_size = min(max(get_int('per_page', default_page_size), 1), max_page_size)
+    return page, page_size
+
+def paginate(items, page, page_size):
+    pages = max(math.ceil(len(items) / page_size), 1)
+    page = min(page, pages)
+    start = (page - 1) * page_size
+    return items[start:start + page_size], page, pages
+
+def page_url(page, page_size, default_page_size=20, filters=None):
+    query = {'page': page}
+    if page_size != default_page_size:
+        query['per_page'] = page_size
+    if filters_tag(filters):
+        query['filters'] = filters_tag(filters)
+    return '?' + urllib.parse.urlencode(query)
+
+# a short tag for a set of filters, which page links carry so that a page
+# number is only used with the filters it was a page of. No filters have
+# no tag. The filters themselves are only in the inputs, not the url, so
+# only pages of the unfiltered results can be linked to: a shared link to
+# a page of filtered results opens on the first page, unfiltered.
+def filters_tag(filters):
+    if not filters:
+        return ''
+    return hashlib.sha1(filter_key(filters).encode('utf8')).hexdigest()[:8]
+
+def get_page_filters(url_search):
+    query = urllib.parse.parse_qs((url_search or '').lstrip('?'))
+    return query.get('filters', [''])[0]
 
 def message_box(title, contents, error=False):
     border = 'b--red' if error else 'b--black'
@@ -86,34 +101,3 @@ def message_box(title, contents, error=False):
                 children=title),
         html.Div(className='pa3', children=contents_div),
     ])
-
-
-def pluralize(string, count):
-    p = inflect.engine()
-    return p.plural(string, count)
-
-def format_currency(amount, currency='GBP', humanize_=True, int_format="{:,.0f}"):
-    if humanize_:
-        amount_str = humanize.intword(amount).split(" ")
-        if len(amount_str) == 2:
-            return (
-                babel.numbers.format_currency(
-                    float(amount_str[0]),
-                    currency,
-                    format="¤#,##0.0",
-                    currency_digits=False,
-                    locale='en_UK'
-                ), 
-                amount_str[1]
-            )
-
-    return (
-        babel.numbers.format_currency(
-            amount,
-            currency,
-            format="¤#,##0",
-            currency_digits=False,
-            locale='en_UK'
-        ), 
-        ""
-    )
\ No newline at end of file